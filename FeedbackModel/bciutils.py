@@ -4,10 +4,49 @@ Includes all classes needed for performing online eeg analyis.
 
 from enum import Enum
 import math
+import multiprocessing
 import numpy as np
-from pylsl import StreamInfo, StreamInlet, StreamOutlet, resolve_stream, local_clock
+import os
+from pylsl import StreamInfo, StreamInlet, StreamOutlet, resolve_byprop, local_clock, proc_clocksync, proc_dejitter
 from scipy import signal
+import scipy.io
+import signal as system_signal
 import threading
+import time
+
+try:
+    # Compiled kernel of signal.sosfilt which filters in place and skips the argument validation. It is private to scipy
+    # (tested with scipy 1.8.0 of requirements.txt up to 1.17), signal.sosfilt is used if it is missing.
+    from scipy.signal._sosfilt import _sosfilt
+except ImportError:
+    _sosfilt = None
+
+# Maximum time (in seconds) to wait for a block of eeg samples
+PULL_TIMEOUT = 1.0
+
+# Time (in seconds) to wait for a LSL stream per attempt and number of attempts (None to retry until it is found)
+RESOLVE_TIMEOUT = 5.0
+RESOLVE_ATTEMPTS = None
+
+# Duration (in seconds) of eeg data which is kept in the ring buffer
+RING_BUFFER_DURATION = 10
+
+# Duration (in seconds) of eeg data which is fed to the filters after starting the feedback model
+WARM_UP_DURATION = 3
+
+# Duration (in seconds) of eeg data which primes the filters after starting the feedback model (warm start)
+WARM_START_DURATION = 0.5
+
+# Maximum number of state changes kept in the state timeline
+STATE_TIMELINE_CAPACITY = 64
+
+# Maximum number of samples filtered at once by the state-space backend of the bandpass (larger blocks are split)
+STATE_SPACE_MAX_BLOCK = 64
+
+# Logarithmic bins of the latency histogram: lower limit (in seconds), bins per decade and number of decades
+LATENCY_HISTOGRAM_MIN = 1e-4
+LATENCY_HISTOGRAM_BINS_PER_DECADE = 20
+LATENCY_HISTOGRAM_DECADES = 5
 
 
 class BCIState(Enum):
@@ -33,6 +72,80 @@ class ERDSMode(str, Enum):
     SINGLE = 'single'
 
 
+class LogBandPowerMode(str, Enum):
+    """Enum class for definition of the log band power calculation mode.
+
+        FIR:     the moving average of the power is computed with a FIR filter (see `LogBandPower`).
+        RUNNING: the moving average of the power is computed with a running sum (see `RunningLogBandPower`).
+    """
+
+    FIR = 'fir'
+    RUNNING = 'running'
+
+
+class PipelineOrder(str, Enum):
+    """Enum class for definition of the order of the classification pipeline.
+
+        BANDPASS_FIRST: all enabled channels are band passed, then the CSP filter is applied.
+        SPATIAL_FIRST:  the CSP filter is applied first, then only the CSP outputs are band passed.
+    """
+
+    BANDPASS_FIRST = 'bandpass-first'
+    SPATIAL_FIRST = 'spatial-first'
+
+
+class ExecutionMode(str, Enum):
+    """Enum class for definition of the execution mode of the classification and ERDS computation.
+
+        THREAD:  classification and ERDS computation run in threads of the feedback model process.
+        PROCESS: classification and ERDS computation run in separate worker processes (not limited by the GIL).
+    """
+
+    THREAD = 'thread'
+    PROCESS = 'process'
+
+
+class Precision(str, Enum):
+    """Enum class for definition of the floating point precision of the eeg buffer and the signal processing.
+
+        DOUBLE: all filter states, CSP and LDA coefficients and work buffers are float64.
+        SINGLE: all filter states, CSP and LDA coefficients and work buffers are float32 (half the memory traffic).
+                The rounding error of the bandpass grows with the sample rate and with narrower pass bands: compared
+                to float64 the band passed signals of a 12th order bandpass with a pass band of at least 2 Hz differ
+                by less than 1e-4 of their amplitude up to 500 Hz and by less than 1e-3 up to 2000 Hz, the log band
+                power by less than 1e-3 (log10). The filter falls back to float64 (with a warning) if it would be
+                unstable in float32.
+    """
+
+    DOUBLE = 'float64'
+    SINGLE = 'float32'
+
+
+class FilterBackend(str, Enum):
+    """Enum class for definition of the filter backend of the bandpass.
+
+        SOS:         the second order sections are applied one after the other (sosfilt).
+        STATE_SPACE: the cascade of the sections is applied as one state-space system, so a block of samples is
+                     filtered with a few matrix products over all channels (for single samples and small blocks).
+    """
+
+    SOS = 'sos'
+    STATE_SPACE = 'state-space'
+
+
+class OutputDecimation(str, Enum):
+    """Enum class for definition of the reduction of the feedback values of an output interval.
+
+        LATEST: the value of the last sample of the interval.
+        MEAN:   the mean of the values of the interval.
+        MAX:    the maximum of the values of the interval.
+    """
+
+    LATEST = 'latest'
+    MEAN = 'mean'
+    MAX = 'max'
+
+
 class BCI:
     """Main unit of the feedback loop.
 
@@ -42,29 +155,56 @@ class BCI:
     ----------
     bci_config: `dict`
         Settings for the feedback loop.
+    sample_rate: `int`
+        Sample rate of the eeg signal (if None, the eeg LSL stream is resolved to read it).
+    n_channels: `int`
+        Number of channels of the eeg signal (if None, the eeg LSL stream is resolved to read it).
+    resolver: `StreamResolver instance`
+        Resolver of the LSL streams (e.g. shared by several BCI models), a new one is created if None.
+    feedback_loop: `bool`
+        Whether the BCI runs its own feedback loop (see `start_feedback_loop`). If False, the caller drives the
+        workers directly (e.g. the feedback server), so the threads and the eeg ring buffer are not created.
 
     Other Parameters
     ----------------
+    state_timeline: `StateTimeline instance`
+        State changes of the BCI with the time stamps of the markers which caused them.
     state: `enum`
-        Current state of the BCI.
+        Current (most recent) state of the BCI.
     bci_core: `BCICore instance`
         Signal processing unit.
+    model_watcher: `ModelWatcher instance`
+        Watches the files of the CSP and LDA coefficients for a new model (None to keep the model).
     stream_eeg: `str`
         Name of the eeg LSL stream.
     stream_marker: `str`
         Name of the marker LSL stream from unity.
     inlet_eeg: `StreamInlet`
         Inlet of the eeg stream.
+    inlet_marker: `StreamInlet`
+        Inlet of the marker stream (opened by the feedback loop, as the marker stream may appear later).
+    execution_mode: `str`
+        Whether classification and ERDS computation run in threads or in worker processes (see `ExecutionMode`).
+    eeg_buffer: `RingBuffer instance`
+        Buffer of the received eeg data (enabled channels only), shared by the classification and ERDS worker (None
+        without own feedback loop).
     stream_fb_cl: `str`
         Name of the feedback stream for the class labels and distance.
     stream_fb_erds: `str`
         Name of the feedback stream for the ERDS values.
+    stream_diagnostics: `str`
+        Name of the diagnostics stream for the latency of the feedback.
+    diagnostics: `dict`
+        Settings for the latency report (printed after each trial), the diagnostics stream and the profiling of the
+        processing stages.
     thread_classification: `Thread object`
-        Thread object for performing the classification.
+        Thread object (or process object in process execution mode) for performing the classification.
     thread_erds: `Thread object`
-        Thread object for computation of ERDS values.
+        Thread object (or process object in process execution mode) for computation of ERDS values.
     thread_marker: `Thread object`
-        Thread object for receiving the markers.
+        Thread object for receiving the markers (None without own feedback loop).
+    thread_eeg: `Thread object`
+        Thread object for receiving the eeg data (None without own feedback loop).
     sample_rate: `int`
         Sample rate of the eeg signal.
     idx_start_ref: `int`
@@ -73,60 +213,144 @@ class BCI:
         Number of channels used for the feedback calculation.
     idx_enabled_channels: `ndarray`
         1-D Array of indexes of enabled channels.
+    n_erds_channels: `int`
+        Number of channels used for the computation of ERDS values.
+    idx_erds_channels: `ndarray`
+        1-D Array of indexes (within the enabled channels) of the channels used for the computation of ERDS values.
     channel_to_roi_map:  `ndarray`
-        2-D Array of indexes of channels (per ROI) to use for the computation of ERDS values.
+        2-D Array of indexes of channels (per ROI, within the ERDS channels) to use for the computation of ERDS values.
+    roi_matrix: `ndarray`
+        2-D Array (ERDS channels x ROIs) which averages the ERDS values of the channels of each ROI.
     n_roi: `int`
         Number of region of interests.
-    data_ref: `ndarray`
-        2-D array of eeg data during the reference period.
-    data_ref_mean: `ndarray`
-        2-D array of mean eeg reference data for each channel.
+    block_size: `int`
+        Maximum number of eeg samples which are pulled and processed at once.
+    ref_buffer: `ReferenceBuffer instance`
+        Buffer of the eeg data during the reference period.
+    warm_up_cl: `WarmUp instance`
+        Warm up of the classification worker.
+    warm_up_erds: `WarmUp instance`
+        Warm up of the ERDS worker.
+    warm_start_cl: `WarmStart instance`
+        First samples which prime the filters of the classification worker (None without warm start).
+    warm_start_erds: `WarmStart instance`
+        First samples which prime the bandpass of the ERDS worker (None without warm start).
+    decimator_cl: `Decimator instance`
+        Reduces the class labels and distances to the output rate (None to send them for every sample).
+    decimator_erds: `Decimator instance`
+        Reduces the ERDS values to the output rate (None to send them for every sample).
+    latency_cl: `LatencyHistogram instance`
+        Latency of the classification feedback.
+    latency_erds: `LatencyHistogram instance`
+        Latency of the ERDS feedback.
     """
 
-    def __init__(self, bci_config):
-        self.state = BCIState.START
+    def __init__(self, bci_config, sample_rate=None, n_channels=None, resolver=None, feedback_loop=True):
+        self.execution_mode = bci_config['feedback-model-settings']['execution-mode']
+        shared = self.execution_mode == ExecutionMode.PROCESS
+        self.dtype = np.dtype(Precision(bci_config['feedback-model-settings']['precision']).value)
+
+        self.state_timeline = StateTimeline(capacity=STATE_TIMELINE_CAPACITY, state=BCIState.START, shared=shared)
         self.bci_core = None
+        self.model_watcher = None
 
         self.stream_eeg = bci_config['general-settings']['lsl-streams']['eeg']
         self.stream_marker = bci_config['general-settings']['lsl-streams']['marker']
-        self.inlet_eeg: None
+        self.resolver = resolver if resolver is not None else StreamResolver()
+        self.inlet_eeg = None
+        self.inlet_marker = None
+        self.eeg_buffer = None
 
         self.stream_fb_cl = bci_config['general-settings']['lsl-streams']['fb-lda']
         self.stream_fb_erds = bci_config['general-settings']['lsl-streams']['fb-erds']
+        self.stream_diagnostics = bci_config['general-settings']['lsl-streams']['diagnostics']
+        self.diagnostics = bci_config['feedback-model-settings']['diagnostics']
 
-        self.thread_classification = threading.Thread(target=self.__compute_classification)
-        self.thread_erds = threading.Thread(target=self.__compute_erds)
-        self.thread_marker = threading.Thread(target=self.start_feedback_loop)
+        self.thread_classification = None
+        self.thread_erds = None
+        self.thread_marker = None
+        self.thread_eeg = None
+        if feedback_loop:
+            self.thread_marker = threading.Thread(target=self.start_feedback_loop)
+            self.thread_eeg = threading.Thread(target=self.__receive_eeg)
 
         self.sample_rate = 0
         self.idx_start_ref = 0
         self.n_enabled_channels = 0
         self.idx_enabled_channels = 0
+        self.n_erds_channels = 0
+        self.idx_erds_channels = 0
         self.channel_to_roi_map = []
+        self.roi_matrix = None
         self.n_roi = bci_config['feedback-model-settings']['erds']['number-roi']
-
-        self.data_ref = None
-        self.data_ref_mean = None
-
-        self.__resolve_eeg_stream()
+        self.block_size = int(bci_config['feedback-model-settings']['block-size'])
+
+        self.ref_buffer = None
+        self.warm_up_cl = None
+        self.warm_up_erds = None
+        self.warm_start_cl = None
+        self.warm_start_erds = None
+        self.decimator_cl = None
+        self.decimator_erds = None
+
+        # Without the eeg stream (e.g. to replay a recorded session)
+        if sample_rate is not None:
+            self.n_enabled_channels = n_channels
+            self.sample_rate = int(sample_rate)
+            self.idx_start_ref = int(sample_rate / 2)
+        else:
+            self.__resolve_streams()
         self.__select_enabled_channels(bci_config['eeg-settings']['channels'],
                                        bci_config['feedback-model-settings']['erds'])
 
+        if feedback_loop:
+            self.eeg_buffer = RingBuffer(capacity=RING_BUFFER_DURATION * self.sample_rate, n=self.n_enabled_channels,
+                                         shared=shared, dtype=self.dtype)
+        self.ref_buffer = ReferenceBuffer(n=self.n_erds_channels, idx_start=self.idx_start_ref)
+
+        # With warm start the filters are primed with the first samples, so the warm-up is much shorter
+        if bci_config['feedback-model-settings']['warm-start']:
+            n_warm_up = math.ceil(WARM_START_DURATION * self.sample_rate)
+            self.warm_start_cl = WarmStart(n_samples=n_warm_up, n=self.n_enabled_channels, dtype=self.dtype)
+            self.warm_start_erds = WarmStart(n_samples=n_warm_up, n=self.n_erds_channels, dtype=self.dtype)
+        else:
+            n_warm_up = WARM_UP_DURATION * self.sample_rate
+        self.warm_up_cl = WarmUp(n_samples=n_warm_up, shared=shared)
+        self.warm_up_erds = WarmUp(n_samples=n_warm_up, shared=shared)
+
+        # The feedback is only sent at the rate unity uses it (e.g. the frame rate of the headset)
+        output_rate = bci_config['feedback-model-settings']['output-rate']
+        if output_rate > 0:
+            mode = OutputDecimation(bci_config['feedback-model-settings']['output-decimation'])
+            self.decimator_cl = Decimator(sample_rate=self.sample_rate, output_rate=output_rate, mode=mode)
+            self.decimator_erds = Decimator(sample_rate=self.sample_rate, output_rate=output_rate, mode=mode)
+        self.latency_cl = LatencyHistogram(shared=shared)
+        self.latency_erds = LatencyHistogram(shared=shared)
+
     def __del__(self):
-        if self.thread_erds.is_alive():
+        if self.thread_eeg is not None and self.thread_eeg.is_alive():
+            self.thread_eeg.join()
+        if self.thread_erds is not None and self.thread_erds.is_alive():
             self.thread_erds.join()
-        if self.thread_classification.is_alive():
+        if self.thread_classification is not None and self.thread_classification.is_alive():
             self.thread_classification.join()
-        if self.thread_marker.is_alive():
+        if self.thread_marker is not None and self.thread_marker.is_alive():
             self.thread_marker.join()
 
-    def __resolve_eeg_stream(self):
-        """Resolves the eeg stream and extracts some information.
+    def __resolve_streams(self):
+        """Resolves the eeg and the marker stream concurrently, opens the eeg inlet and extracts some information.
         """
 
-        self.inlet_eeg = self.resolve_lsl_stream(name=self.stream_eeg['name'])
+        self.resolver.start([self.stream_eeg['name'], self.stream_marker['name']])
 
-        info_eeg = self.inlet_eeg.info()
+        # The time stamps of eeg and markers must be comparable (see StateTimeline). The inlet buffers as much eeg data
+        # as the ring buffer and receives chunks of at most one block.
+        self.inlet_eeg = self.resolver.open_inlet(self.stream_eeg['name'], max_buflen=RING_BUFFER_DURATION,
+                                                  max_chunklen=self.block_size,
+                                                  processing_flags=proc_clocksync | proc_dejitter)
+
+        # The resolved stream info is used, which saves querying it from the inlet
+        info_eeg = self.resolver.stream_infos[self.stream_eeg['name']]
         print(info_eeg.as_xml())
 
         self.n_enabled_channels = int(info_eeg.channel_count())
@@ -172,141 +396,590 @@ class BCI:
             for ch in erds_settings['single-mode-channels']:
                 self.channel_to_roi_map.append(np.where(list_id_of_channel == ch)[0])
 
-    def __reset_buffer(self):
-        """Resets the buffer for the eeg data during the reference period after each trial.
-        """
+        # Only the channels of the ROIs are filtered for the ERDS computation
+        self.idx_erds_channels = np.unique(np.concatenate(self.channel_to_roi_map)).astype(int)
+        self.n_erds_channels = np.shape(self.idx_erds_channels)[0]
+        self.channel_to_roi_map = [np.searchsorted(self.idx_erds_channels, idx) for idx in self.channel_to_roi_map]
 
-        self.data_ref = np.zeros((1, self.n_enabled_channels))
-        self.data_ref_mean = np.zeros((1, self.n_enabled_channels))
-        self.data_ref_mean[:] = np.nan
+        # The mean over the channels of each ROI as a single matrix product (like the mean of an empty slice, a ROI
+        # without channels results in nan)
+        self.roi_matrix = np.zeros((self.n_erds_channels, self.n_roi))
+        for roi in range(self.n_roi):
+            n_roi_channels = np.shape(self.channel_to_roi_map[roi])[0]
+            if n_roi_channels > 0:
+                self.roi_matrix[self.channel_to_roi_map[roi], roi] = 1 / n_roi_channels
+            else:
+                self.roi_matrix[:, roi] = np.nan
+
+    @property
+    def state(self):
+        return self.state_timeline.state
 
-    def __compute_erds(self):
-        """Computes ERDS values during each trial.
+    def create_workers(self):
+        """Creates the classification and ERDS worker.
 
-        During the reference period eeg data is stored in a buffer. During the feedback period the ERDS values are
-        calculated.
+        Returns
+        -------
+        worker_cl: `ClassificationWorker instance`
+            The classification worker.
+        worker_erds: `ERDSWorker instance`
+            The ERDS worker.
         """
 
-        # important that this thread has its own instance of inlet eeg
-        inlet_eeg = self.resolve_lsl_stream(name=self.stream_eeg['name'])
+        worker_cl = ClassificationWorker(bci_core=self.bci_core, eeg_buffer=self.eeg_buffer,
+                                         state_timeline=self.state_timeline, warm_up=self.warm_up_cl,
+                                         latency=self.latency_cl, stream_fb_cl=self.stream_fb_cl,
+                                         block_size=self.block_size, model_watcher=self.model_watcher,
+                                         warm_start=self.warm_start_cl, decimator=self.decimator_cl)
+        worker_erds = ERDSWorker(bci_core=self.bci_core, eeg_buffer=self.eeg_buffer,
+                                 state_timeline=self.state_timeline, warm_up=self.warm_up_erds,
+                                 latency=self.latency_erds, stream_fb_erds=self.stream_fb_erds,
+                                 block_size=self.block_size,
+                                 idx_erds_channels=self.idx_erds_channels, roi_matrix=self.roi_matrix,
+                                 ref_buffer=self.ref_buffer, idx_start_ref=self.idx_start_ref,
+                                 warm_start=self.warm_start_erds, decimator=self.decimator_erds)
+
+        return worker_cl, worker_erds
+
+    def __start_workers(self):
+        """Starts the classification and ERDS worker.
+
+        In process execution mode the workers run in separate processes. They read the eeg data and the BCI state from
+        shared memory, everything else is copied to the processes.
+        """
 
-        stream_info = StreamInfo(name=self.stream_fb_erds['name'], channel_count=self.n_roi, nominal_srate=0,
-                                 channel_format='float32', source_id=self.stream_fb_erds['id'])
-        outlet_fb_erds = StreamOutlet(stream_info)
+        if self.diagnostics['profiling']:
+            self.bci_core.enable_profiling(shared=self.execution_mode == ExecutionMode.PROCESS)
 
-        self.__reset_buffer()
-        erds_per_roi = np.zeros((self.n_roi,))
+        worker_cl, worker_erds = self.create_workers()
 
-        while True:
-            sample, timestamp = inlet_eeg.pull_sample()
-            sample = np.expand_dims(sample, axis=0)[:, self.idx_enabled_channels]
+        if self.execution_mode == ExecutionMode.PROCESS:
+            self.thread_classification = multiprocessing.Process(target=worker_cl.run, daemon=True)
+            self.thread_erds = multiprocessing.Process(target=worker_erds.run, daemon=True)
+        else:
+            self.thread_classification = threading.Thread(target=worker_cl.run)
+            self.thread_erds = threading.Thread(target=worker_erds.run)
 
-            if self.state == BCIState.REFERENCE:
-                self.data_ref = np.append(self.data_ref, np.square(self.bci_core.bandpass_erds.bandpass_filter(sample)),
-                                          axis=0)
-            elif self.state == BCIState.FEEDBACK:
-                erds_a = np.square(self.bci_core.bandpass_erds.bandpass_filter(sample))
+        self.thread_classification.start()
+        self.thread_erds.start()
 
-                # May happen if the state changed to BREAK in the meantime (this means the buffer was reset)
-                if np.any(np.isnan(erds_a)) or np.any(np.isnan(self.data_ref_mean)):
-                    continue
+    def __report_latency(self, outlet_diagnostics):
+        """Reports the latency of the feedback since the last report.
 
-                erds = np.divide(-(self.data_ref_mean - erds_a), self.data_ref_mean)
+        Parameters
+        ----------
+        outlet_diagnostics: `StreamOutlet`
+            Outlet of the diagnostics stream (p50, p99 and maximum latency in milliseconds of the classification and
+            the ERDS feedback) or None.
+        """
 
-                # Compute mean erds over each roi
-                for roi in range(self.n_roi):
-                    erds_per_roi[roi] = np.mean(erds[0, self.channel_to_roi_map[roi]])
+        sample = []
+        for name, latency in [('classification', self.latency_cl), ('ERDS', self.latency_erds)]:
+            n_samples, p50, p99, latency_max = latency.read()
+            if self.diagnostics['latency-report']:
+                print("INFO latency %s: %d samples, p50 %.2f ms, p99 %.2f ms, max %.2f ms"
+                      % (name, n_samples, 1000 * p50, 1000 * p99, 1000 * latency_max))
+            sample.extend([1000 * p50, 1000 * p99, 1000 * latency_max])
 
-                outlet_fb_erds.push_sample(erds_per_roi, local_clock())
+        if outlet_diagnostics is not None:
+            outlet_diagnostics.push_sample(sample)
 
-            elif self.state == BCIState.START:
-                self.bci_core.bandpass_erds.bandpass_filter(sample)
+    def __report_on_signal(self, *args):
+        """Prints the enabled diagnostics (signal handler): the latency of the feedback since the last report and the
+        timing counters of the processing stages.
+        """
 
-    def __compute_classification(self):
-        """Performs classification of the eeg data.
+        if self.diagnostics['latency-report']:
+            self.__report_latency(None)
+        if self.diagnostics['profiling']:
+            self.__report_profile()
 
-        During the Feedback period the class label and the distance is computed.
+    def __report_profile(self):
+        """Prints the timing counters of the processing stages.
         """
 
-        stream_info = StreamInfo(name=self.stream_fb_cl['name'], channel_count=2, nominal_srate=0,
-                                 channel_format='float32', source_id=self.stream_fb_cl['id'])
-        outlet_fb_cl = StreamOutlet(stream_info)
+        timers = [('classification', self.bci_core.timer), ('classification bandpass', self.bci_core.bandpass_cl.timer),
+                  ('ERDS bandpass', self.bci_core.bandpass_erds.timer)]
+        for name, timer in timers:
+            print("INFO profile " + name + ": " + timer.summary())
 
-        while True:
-            sample, timestamp = self.inlet_eeg.pull_sample()
-            sample = np.expand_dims(sample, axis=0)[:, self.idx_enabled_channels]
+    def __receive_eeg(self):
+        """Receives the eeg data.
+
+        Pulls blocks of samples from the (single) eeg inlet and writes the enabled channels into the eeg buffer, from
+        where they are read by the classification and ERDS worker. The samples are pulled into an array of the channel
+        format of the stream (no conversion to python lists).
+        """
 
-            if self.state == BCIState.FEEDBACK:
-                y_bp = self.bci_core.bandpass_cl.bandpass_filter(sample)
-                y_csp = self.bci_core.csp_filter(y_bp)
-                y_lbp = self.bci_core.log_band_power.compute_log_band_power(y_csp)
+        chunk = np.zeros((self.block_size, self.inlet_eeg.channel_count), dtype=np.dtype(self.inlet_eeg.value_type))
+        while True:
+            _, timestamps = self.inlet_eeg.pull_chunk(timeout=PULL_TIMEOUT, max_samples=self.block_size,
+                                                      dest_obj=chunk)
+            if not timestamps:
+                continue
 
-                label, distance = self.bci_core.lda_predict(y_lbp)
-                outlet_fb_cl.push_sample([label - 1, distance], local_clock())
-            elif self.state == BCIState.START:
-                self.bci_core.bandpass_cl.bandpass_filter(sample)
+            self.eeg_buffer.write(chunk[:len(timestamps), self.idx_enabled_channels], timestamps)
 
     def start_feedback_loop(self):
         """Manages the feedback loop.
 
-        Starts the classification and ERDS thread and receives the markers from unity
+        Starts the classification and ERDS worker and receives the markers from unity
         in order to set the BCI state accordingly.
         """
 
-        inlet_marker = self.resolve_lsl_stream(name=self.stream_marker['name'])
+        self.inlet_marker = self.open_marker_inlet()
+        outlet_diagnostics = self.create_diagnostics_outlet()
 
-        self.thread_classification.start()
-        self.thread_erds.start()
+        self.thread_eeg.start()
+        self.__start_workers()
+
+        # The latency and the timing counters can also be printed on request (kill -USR1 on Linux, Ctrl+Break on
+        # Windows)
+        if ((self.diagnostics['latency-report'] or self.diagnostics['profiling'])
+                and threading.current_thread() is threading.main_thread()):
+            signal_number = getattr(system_signal, 'SIGUSR1', None) or getattr(system_signal, 'SIGBREAK')
+            system_signal.signal(signal_number, self.__report_on_signal)
 
-        # Feed the bandpass filter during the first 3 seconds after starting the feedback model
-        # (because those first values are rubbish)
+        # Feed the bandpass filter with the first 3 seconds of eeg data after starting the feedback model
+        # (because those first values are rubbish), with warm start the first samples prime the filters instead
         start_time = local_clock()
-        while self.state == BCIState.START:
-            if int(local_clock() - start_time) > 3:
-                self.state = BCIState.SLEEP
+        start_cpu_time = time.process_time()
+        self.warm_up_cl.event.wait()
+        self.warm_up_erds.event.wait()
+        self.state_timeline.set_state(BCIState.SLEEP, local_clock())
+
+        duration = local_clock() - start_time
+        print("INFO warm-up finished after %.2f s (cpu load %.1f %%)"
+              % (duration, 100 * (time.process_time() - start_cpu_time) / duration))
+        print("INFO warm-up latency classification: " + self.warm_up_cl.latency_summary())
+        print("INFO warm-up latency ERDS: " + self.warm_up_erds.latency_summary())
 
         while True:
-            if inlet_marker is None:
-                continue
-            marker, timestamp = inlet_marker.pull_sample()
+            # With a timeout, so signal handlers are not blocked by the pull
+            marker, timestamp = self.inlet_marker.pull_sample(timeout=PULL_TIMEOUT)
             if marker is None:
                 continue
 
-            if marker[0] == 'Reference':
-                self.state = BCIState.REFERENCE
-            elif marker[0] == 'Cue':
-                self.state = BCIState.CUE
-                # Calculate mean erds values over reference period
-                if np.shape(self.data_ref)[0] > 1:
-                    self.data_ref_mean = np.mean(np.delete(self.data_ref, 0, 0)[self.idx_start_ref:, :],
-                                                 axis=0)
-                else:
-                    print("ERROR no ERDS values are calculated")
-            elif marker[0] == 'Feedback':
-                self.state = BCIState.FEEDBACK
-            elif marker[0] == 'End_of_Trial':
-                self.state = BCIState.BREAK
-                self.bci_core.reset_buffer()
-                self.__reset_buffer()
+            self.handle_marker(marker[0], timestamp, outlet_diagnostics)
 
-    @staticmethod
-    def resolve_lsl_stream(name):
-        """Opens an inlet for a LSL stream.
+    def create_diagnostics_outlet(self):
+        """Opens the outlet of the diagnostics stream (if enabled).
+
+        Returns
+        -------
+        outlet_diagnostics: `StreamOutlet`
+            Outlet of the diagnostics stream or None.
+        """
+
+        if not self.diagnostics['latency-stream']:
+            return None
+
+        stream_info = StreamInfo(name=self.stream_diagnostics['name'], channel_count=6, nominal_srate=0,
+                                 channel_format='float32', source_id=self.stream_diagnostics['id'])
+        return StreamOutlet(stream_info)
+
+    def handle_marker(self, marker, timestamp, outlet_diagnostics):
+        """Sets the BCI state according to a marker from unity and reports the diagnostics after each trial.
 
         Parameters
         ----------
-        name: `str`
-            Name of the LSL stream.
+        marker: `str`
+            The marker.
+        timestamp: `float`
+            Time stamp of the marker.
+        outlet_diagnostics: `StreamOutlet`
+            Outlet of the diagnostics stream or None.
+
+        Returns
+        -------
+        state: `enum`
+            The new state or None if the marker does not change the state.
+        """
+
+        state = self.apply_marker(marker, timestamp)
+        if state == BCIState.BREAK:
+            self.__report_latency(outlet_diagnostics)
+            if self.diagnostics['profiling']:
+                self.__report_profile()
+
+        return state
+
+    def apply_marker(self, marker, timestamp):
+        """Sets the BCI state according to a marker from unity.
+
+        The workers apply the state change (incl. the computation of the mean reference and the reset of the buffers)
+        at the sample of the marker time stamp.
+
+        Parameters
+        ----------
+        marker: `str`
+            The marker.
+        timestamp: `float`
+            Time stamp of the marker.
+
+        Returns
+        -------
+        state: `enum`
+            The new state or None if the marker does not change the state.
+        """
+
+        if marker == 'Reference':
+            state = BCIState.REFERENCE
+        elif marker == 'Cue':
+            state = BCIState.CUE
+        elif marker == 'Feedback':
+            state = BCIState.FEEDBACK
+        elif marker == 'End_of_Trial':
+            state = BCIState.BREAK
+        else:
+            return None
+
+        self.state_timeline.set_state(state, timestamp)
+        return state
+
+    def open_marker_inlet(self):
+        """Opens the inlet of the marker stream (waits until the stream is resolved).
 
         Returns
         -------
         inlet: `StreamInlet`
-            Inlet for the LSL stream.
+            Inlet of the marker stream. Each marker is sent on its own (chunks of one sample).
+        """
+
+        return self.resolver.open_inlet(self.stream_marker['name'], max_chunklen=1, processing_flags=proc_clocksync)
+
+
+class ClassificationWorker:
+    """Classification worker.
+
+    Performs the classification of the eeg data. During the Feedback period the class label and the distance are sent
+    to the feedback stream, with the time stamp of the eeg sample they were computed from. Runs in a thread or (in
+    process execution mode) in a separate process.
+
+    Parameters
+    ----------
+    bci_core: `BCICore instance`
+        Signal processing unit.
+    eeg_buffer: `RingBuffer instance`
+        Buffer of the received eeg data.
+    state_timeline: `StateTimeline instance`
+        State changes of the BCI.
+    warm_up: `WarmUp instance`
+        Warm up of the worker.
+    latency: `LatencyHistogram instance`
+        Latency of the feedback (None to skip the measurement).
+    stream_fb_cl: `dict`
+        Name and id of the feedback stream for the class labels and distance.
+    block_size: `int`
+        Maximum number of eeg samples which are processed at once.
+    model_watcher: `ModelWatcher instance`
+        Watches the files of the CSP and LDA coefficients, a new model is applied at the end of a trial (None to keep
+        the model).
+    warm_start: `WarmStart instance`
+        Collects the first samples which prime the filters (None to only feed the filters during the warm-up).
+    decimator: `Decimator instance`
+        Reduces the distances to the output rate, the class label is the one of the last sample of each interval (None
+        to send the feedback for every sample).
+
+    Other Parameters
+    ----------------
+    previous_state: `enum`
+        State of the last processed sample.
+    fb_cl: `ndarray`
+        2-D array (block size x 2) the feedback is written to before it is pushed.
+    """
+
+    def __init__(self, bci_core, eeg_buffer, state_timeline, warm_up, latency, stream_fb_cl, block_size,
+                 model_watcher=None, warm_start=None, decimator=None):
+        self.bci_core = bci_core
+        self.eeg_buffer = eeg_buffer
+        self.state_timeline = state_timeline
+        self.warm_up = warm_up
+        self.latency = latency
+        self.stream_fb_cl = stream_fb_cl
+        self.block_size = block_size
+        self.model_watcher = model_watcher
+        self.warm_start = warm_start
+        self.decimator = decimator
+        self.previous_state = BCIState.START
+        self.fb_cl = np.zeros((self.block_size, 2), dtype=np.float32)
+
+    def create_outlet(self):
+        """Opens the outlet of the feedback stream.
+
+        Returns
+        -------
+        outlet_fb_cl: `StreamOutlet`
+            Outlet of the feedback stream for the class labels and distance.
+        """
+
+        stream_info = StreamInfo(name=self.stream_fb_cl['name'], channel_count=2, nominal_srate=0,
+                                 channel_format='float32', source_id=self.stream_fb_cl['id'])
+        return StreamOutlet(stream_info)
+
+    def run(self):
+        """Processes the eeg data until the feedback model is stopped.
+        """
+
+        outlet_fb_cl = self.create_outlet()
+        cursor = self.eeg_buffer.cursor(self.block_size)
+
+        while True:
+            block, timestamps = cursor.read(timeout=PULL_TIMEOUT)
+            if block is None:
+                continue
+
+            self.process(block, timestamps, outlet_fb_cl)
+
+    def process(self, block, timestamps, outlet_fb_cl):
+        """Processes a block of eeg samples.
+
+        Parameters
+        ----------
+        block: `ndarray`
+            2-D array (samples x enabled channels) of raw eeg data (at most block size samples).
+        timestamps: `ndarray`
+            1-D array of the time stamps of the samples.
+        outlet_fb_cl: `StreamOutlet`
+            Outlet the feedback is pushed to.
+        """
+
+        fb_cl = self.fb_cl
+
+        # Each sample is processed according to the state at its time stamp
+        for start, stop, state in self.state_timeline.segments(timestamps):
+            if state != self.previous_state and state == BCIState.BREAK:
+                self.bci_core.reset_buffer()
+
+                # A new model is only applied between two trials
+                if self.model_watcher is not None:
+                    model = self.model_watcher.poll()
+                    if model is not None:
+                        self.bci_core.set_model(*model)
+                        print("INFO new CSP and LDA model applied")
+            if state != self.previous_state and state == BCIState.FEEDBACK and self.decimator is not None:
+                self.decimator.reset()
+            self.previous_state = state
+
+            if state == BCIState.FEEDBACK:
+                # Every sample is classified, as the distance depends on the labels of the last second
+                label, distance = self.bci_core.process(block[start:stop])
+                timestamps_fb = timestamps[start:stop]
+
+                if self.decimator is not None:
+                    ends = self.decimator.interval_ends(stop - start)
+                    distance = self.decimator.reduce(distance, ends)
+                    label = label[ends]
+                    timestamps_fb = timestamps_fb[ends]
+                    if np.shape(ends)[0] == 0:
+                        continue
+
+                n_samples = np.shape(label)[0]
+                np.subtract(label, 1, out=fb_cl[:n_samples, 0], casting='unsafe')
+                np.copyto(fb_cl[:n_samples, 1], distance, casting='unsafe')
+                outlet_fb_cl.push_chunk(fb_cl[:n_samples], timestamps_fb.tolist())
+                if self.latency is not None:
+                    self.latency.record(timestamps_fb)
+            elif state == BCIState.START:
+                x = block[start:stop]
+                if self.warm_start is not None and not self.warm_start.is_complete:
+                    x = x[self.warm_start.collect(x):]
+                    if self.warm_start.is_complete:
+                        self.bci_core.prime(self.warm_start.data)
+
+                if np.shape(x)[0] > 0:
+                    self.bci_core.filter(x)
+                self.warm_up.feed(timestamps[start:stop])
+
+
+class ERDSWorker:
+    """ERDS worker.
+
+    Computes ERDS values during each trial. During the reference period eeg data is stored in a buffer. During the
+    feedback period the ERDS values are calculated and sent to the feedback stream, with the time stamp of the eeg
+    sample they were computed from. Runs in a thread or (in process execution mode) in a separate process.
+
+    Parameters
+    ----------
+    bci_core: `BCICore instance`
+        Signal processing unit.
+    eeg_buffer: `RingBuffer instance`
+        Buffer of the received eeg data.
+    state_timeline: `StateTimeline instance`
+        State changes of the BCI.
+    warm_up: `WarmUp instance`
+        Warm up of the worker.
+    latency: `LatencyHistogram instance`
+        Latency of the feedback (None to skip the measurement).
+    stream_fb_erds: `dict`
+        Name and id of the feedback stream for the ERDS values.
+    block_size: `int`
+        Maximum number of eeg samples which are processed at once.
+    idx_erds_channels: `ndarray`
+        1-D Array of indexes (within the enabled channels) of the channels used for the computation of ERDS values.
+    roi_matrix: `ndarray`
+        2-D Array (ERDS channels x ROIs) which averages the ERDS values of the channels of each ROI.
+    ref_buffer: `ReferenceBuffer instance`
+        Buffer of the eeg data during the reference period.
+    idx_start_ref: `int`
+        Start index for the computation of the mean eeg in the reference period.
+    warm_start: `WarmStart instance`
+        Collects the first samples which prime the bandpass (None to only feed the bandpass during the warm-up).
+    decimator: `Decimator instance`
+        Reduces the ERDS values to the output rate (None to send them for every sample).
+
+    Other Parameters
+    ----------------
+    data_ref_mean: `ndarray`
+        2-D array of mean eeg reference data for each channel.
+    previous_state: `enum`
+        State of the last processed sample.
+    fb_erds: `ndarray`
+        2-D array (block size x ROIs) the feedback is written to before it is pushed.
+    """
+
+    def __init__(self, bci_core, eeg_buffer, state_timeline, warm_up, latency, stream_fb_erds, block_size,
+                 idx_erds_channels, roi_matrix, ref_buffer, idx_start_ref, warm_start=None, decimator=None):
+        self.bci_core = bci_core
+        self.eeg_buffer = eeg_buffer
+        self.state_timeline = state_timeline
+        self.warm_up = warm_up
+        self.latency = latency
+        self.stream_fb_erds = stream_fb_erds
+        self.block_size = block_size
+        self.idx_erds_channels = idx_erds_channels
+        self.roi_matrix = roi_matrix
+        self.ref_buffer = ref_buffer
+        self.idx_start_ref = idx_start_ref
+        self.warm_start = warm_start
+        self.decimator = decimator
+        self.data_ref_mean = None
+        self.previous_state = BCIState.START
+        self.fb_erds = np.zeros((self.block_size, np.shape(self.roi_matrix)[1]), dtype=np.float32)
+
+        self.__reset_buffer()
+
+    def __reset_buffer(self):
+        """Resets the buffer for the eeg data during the reference period after each trial.
+        """
+
+        self.ref_buffer.reset()
+        self.data_ref_mean = np.zeros((1, np.shape(self.idx_erds_channels)[0]))
+        self.data_ref_mean[:] = np.nan
+
+    def __change_state(self, previous_state, state):
+        """Updates the reference of the ERDS computation at the sample where the state changes.
+
+        Parameters
+        ----------
+        previous_state: `enum`
+            State of the previous sample.
+        state: `enum`
+            State of the current sample.
+        """
+
+        if previous_state == BCIState.REFERENCE:
+            # Calculate mean erds values over reference period
+            if self.ref_buffer.n_samples > self.idx_start_ref:
+                self.data_ref_mean = self.ref_buffer.mean()
+            else:
+                print("ERROR no ERDS values are calculated")
+        if state == BCIState.BREAK:
+            self.__reset_buffer()
+        if state == BCIState.FEEDBACK and self.decimator is not None:
+            self.decimator.reset()
+
+    def create_outlet(self):
+        """Opens the outlet of the feedback stream.
+
+        Returns
+        -------
+        outlet_fb_erds: `StreamOutlet`
+            Outlet of the feedback stream for the ERDS values.
+        """
+
+        stream_info = StreamInfo(name=self.stream_fb_erds['name'], channel_count=np.shape(self.roi_matrix)[1],
+                                 nominal_srate=0, channel_format='float32', source_id=self.stream_fb_erds['id'])
+        return StreamOutlet(stream_info)
+
+    def run(self):
+        """Processes the eeg data until the feedback model is stopped.
+        """
+
+        outlet_fb_erds = self.create_outlet()
+        cursor = self.eeg_buffer.cursor(self.block_size)
+
+        while True:
+            block, timestamps = cursor.read(timeout=PULL_TIMEOUT)
+            if block is None:
+                continue
+
+            self.process(block, timestamps, outlet_fb_erds)
+
+    def process(self, block, timestamps, outlet_fb_erds):
+        """Processes a block of eeg samples.
+
+        Parameters
+        ----------
+        block: `ndarray`
+            2-D array (samples x enabled channels) of raw eeg data (at most block size samples).
+        timestamps: `ndarray`
+            1-D array of the time stamps of the samples.
+        outlet_fb_erds: `StreamOutlet`
+            Outlet the feedback is pushed to.
         """
 
-        stream = resolve_stream("name", name)
-        inlet = StreamInlet(stream[0])
-        return inlet
+        block = block[:, self.idx_erds_channels]
+
+        # Each sample is processed according to the state at its time stamp
+        for start, stop, state in self.state_timeline.segments(timestamps):
+            if state != self.previous_state:
+                self.__change_state(self.previous_state, state)
+                self.previous_state = state
+
+            if state == BCIState.REFERENCE:
+                self.ref_buffer.append(np.square(self.bci_core.bandpass_erds.bandpass_filter(block[start:stop])))
+            elif state == BCIState.FEEDBACK:
+                erds_a = np.square(self.bci_core.bandpass_erds.bandpass_filter(block[start:stop]))
+                timestamps_fb = timestamps[start:stop]
+
+                # The latest value and the mean of an interval can be taken before the ERDS computation (affine for
+                # each channel and averaged over the ROIs), so the ERDS values are only computed once per interval
+                if self.decimator is not None:
+                    ends = self.decimator.interval_ends(stop - start)
+                    timestamps_fb = timestamps_fb[ends]
+                    if self.decimator.mode != OutputDecimation.MAX:
+                        erds_a = self.decimator.reduce(erds_a, ends)
+
+                # May happen if no reference was recorded in this trial
+                if np.any(np.isnan(erds_a)) or np.any(np.isnan(self.data_ref_mean)):
+                    continue
+
+                erds = np.divide(-(self.data_ref_mean - erds_a), self.data_ref_mean)
+
+                # Compute mean erds over each roi
+                erds_per_roi = self.fb_erds[:np.shape(erds)[0]]
+                np.matmul(erds, self.roi_matrix, out=erds_per_roi)
+
+                if self.decimator is not None and self.decimator.mode == OutputDecimation.MAX:
+                    erds_per_roi = self.decimator.reduce(erds_per_roi, ends)
+                if np.shape(timestamps_fb)[0] == 0:
+                    continue
+
+                outlet_fb_erds.push_chunk(erds_per_roi, timestamps_fb.tolist())
+                if self.latency is not None:
+                    self.latency.record(timestamps_fb)
+
+            elif state == BCIState.START:
+                x = block[start:stop]
+                if self.warm_start is not None and not self.warm_start.is_complete:
+                    x = x[self.warm_start.collect(x):]
+                    if self.warm_start.is_complete:
+                        self.bci_core.bandpass_erds.prime(self.warm_start.data)
+
+                if np.shape(x)[0] > 0:
+                    self.bci_core.bandpass_erds.bandpass_filter(x)
+                self.warm_up.feed(timestamps[start:stop])
 
 
 class BCICore:
@@ -319,7 +992,7 @@ class BCICore:
     sample_rate: `int`
         Sample rate of the eeg signal.
     bandpass_cl: `Bandpass instance`
-        Bandpass filtering unit for the classification.
+        Bandpass filtering unit for the classification (one channel per CSP filter in the spatial-first order).
     bandpass_erds: `Bandpass instance`
         Bandpass filtering unit for the ERDS calculation.
     csp: `ndarray`
@@ -328,6 +1001,9 @@ class BCICore:
         Linear discriminant analysis coefficients (2-D array).
     log_band_power: `LogBandPower instance`
         Unit for computing the log band power.
+    pipeline_order: `PipelineOrder`
+        Order of the bandpass and the CSP filter in the classification pipeline. Both are linear, so both orders
+        compute the same result, but the spatial-first order band passes only the CSP outputs.
 
     Other Parameters
     ----------------
@@ -340,26 +1016,116 @@ class BCICore:
     label_idx: `int`
         Current index for the buffered labels (label_buffer). The class label at this index represents the class label
         calculated a minute ago.
+    lda_weights: `ndarray`
+        LDA coefficients without the bias (2-D array, features x classes).
+    lda_bias: `ndarray`
+        Bias of the LDA coefficients (1-D array).
+    dtype: `dtype`
+        Data type of the CSP and LDA coefficients and of the work buffers (the one of the classification bandpass).
+    work_buffers: `dict`
+        Preallocated arrays used by process(), one set per block size.
+    timer: `StageTimer instance`
+        Timing counters of the processing stages (None unless profiling is enabled).
     """
 
-    def __init__(self, sample_rate, bandpass_cl, bandpass_erds, csp, lda, log_band_power):
+    def __init__(self, sample_rate, bandpass_cl, bandpass_erds, csp, lda, log_band_power,
+                 pipeline_order=PipelineOrder.BANDPASS_FIRST):
         self.sample_rate = sample_rate
         self.bandpass_cl = bandpass_cl
         self.bandpass_erds = bandpass_erds
-        self.CSP = csp
-        self.LDA = lda
+        self.dtype = bandpass_cl.dtype
+        self.CSP = np.asarray(csp, dtype=self.dtype)
+        self.LDA = np.asarray(lda, dtype=self.dtype)
         self.log_band_power = log_band_power
+        self.pipeline_order = pipeline_order
 
         self.label = None
         self.label_buffer = None
         self.is_class_buffer = None
         self.label_idx = 0
 
+        # Fold the bias column into a separate vector, so the features need no column of ones
+        self.lda_weights = np.ascontiguousarray(self.LDA[:, 1:].T)
+        self.lda_bias = np.ascontiguousarray(self.LDA[:, 0])
+        self.work_buffers = {}
+        self.timer = None
+
+        # The filter delay of the CSP outputs equals the CSP filtered delay of the channels (all channels start with the
+        # same initial conditions)
+        if self.pipeline_order == PipelineOrder.SPATIAL_FIRST:
+            self.bandpass_cl.set_initial_conditions(np.sum(self.CSP, axis=1))
+
         self.reset_buffer()
 
         np.seterr(invalid='ignore')  # ignores inf values (in matmul() in classification())
         np.seterr(divide='ignore')  # ignores division by zero (may happen in log_band_power())
 
+    def enable_profiling(self, shared=False):
+        """Enables the timing counters of the processing stages (of the BCI core and of its bandpass filters).
+
+        Parameters
+        ----------
+        shared: `bool`
+            Whether the counters are shared with worker processes.
+        """
+
+        self.timer = StageTimer(['bandpass', 'csp', 'log-band-power', 'lda', 'distance'], shared=shared)
+        self.bandpass_cl.enable_profiling(shared=shared)
+        if self.bandpass_erds is not None:
+            self.bandpass_erds.enable_profiling(shared=shared)
+
+    def set_model(self, csp, lda):
+        """Replaces the CSP and LDA coefficients (e.g. by a newly calibrated model) without restarting the filters.
+
+        The state of the bandpass of the channels (bandpass-first order) and of the log band power is kept. The log
+        band power window still holds the CSP outputs of the previous model, until the window has passed. In the
+        spatial-first order the bandpass filters the CSP outputs, so it restarts from the initial conditions of the new
+        CSP filter.
+
+        Parameters
+        ----------
+        csp: `ndarray`
+            Common spatial pattern (2-D array).
+        lda: `ndarray`
+            Linear discriminant analysis coefficients (2-D array).
+        """
+
+        n_csp = np.shape(csp)[0]
+        if n_csp != np.shape(self.CSP)[0]:
+            self.log_band_power = type(self.log_band_power)(window_length=self.log_band_power.window_length, n=n_csp,
+                                                            dtype=self.log_band_power.dtype)
+            if self.pipeline_order == PipelineOrder.SPATIAL_FIRST:
+                bandpass_cl = Bandpass(order=self.bandpass_cl.order, fstop=self.bandpass_cl.fstop,
+                                       fpass=self.bandpass_cl.fpass, n=n_csp, dtype=self.dtype,
+                                       backend=self.bandpass_cl.backend)
+                bandpass_cl.timer = self.bandpass_cl.timer
+                self.bandpass_cl = bandpass_cl
+
+        self.CSP = np.asarray(csp, dtype=self.dtype)
+        self.LDA = np.asarray(lda, dtype=self.dtype)
+        self.lda_weights = np.ascontiguousarray(self.LDA[:, 1:].T)
+        self.lda_bias = np.ascontiguousarray(self.LDA[:, 0])
+        self.work_buffers = {}
+
+        if self.pipeline_order == PipelineOrder.SPATIAL_FIRST:
+            self.bandpass_cl.set_initial_conditions(np.sum(self.CSP, axis=1))
+
+    def prime(self, x):
+        """Primes the bandpass and the log band power with the first received eeg samples (warm start).
+
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x enabled channels) of raw eeg data.
+        """
+
+        if self.pipeline_order == PipelineOrder.SPATIAL_FIRST:
+            y_csp = self.bandpass_cl.prime(self.csp_filter(x))
+        else:
+            y_csp = self.csp_filter(self.bandpass_cl.prime(x))
+
+        self.log_band_power.prime(y_csp)
+
     def reset_buffer(self):
         """Clears the buffered values after every trial.
         """
@@ -384,74 +1150,543 @@ class BCICore:
 
         return np.matmul(x, self.CSP.T)
 
-    def lda_predict(self, x):
-        """Predicts the class of the data with linear discriminant analysis.
+    def process(self, x):
+        """Classifies a block of eeg samples (bandpass, CSP, log band power, LDA and distance calculation).
+
+        All stages write into preallocated work buffers, so no arrays are allocated once the buffers for the block
+        size exist.
 
         Parameters
         ----------
         x: `ndarray`
-            1-D array.
+            2-D array (samples x enabled channels) of raw eeg data.
 
         Returns
         -------
-        label: `int`
-            Class label.
-        distance:  `float`
-            LDA distance.
+        label: `ndarray`
+            1-D array of class labels (one per sample). The array is reused by the next call.
+        distance:  `ndarray`
+            1-D array of LDA distances (one per sample). The array is reused by the next call.
         """
 
-        x_conc = np.append(np.ones([np.shape(x)[0], 1]), x, axis=1)
-        x_mat = np.matmul(x_conc, self.LDA.T)
-        linear_scores = np.divide(np.multiply(x_mat, 100),
-                                  np.max(np.abs(x_mat)))
-        self.label = np.nanargmax(linear_scores, axis=1)[0] + 1
-        label, distance = self.lda_disctance_calculation()
-
-        return label, distance
+        n_samples = np.shape(x)[0]
+        work = self.work_buffers.get(n_samples)
+        if work is None:
+            work = self.__init_work_buffers(n_samples)
 
-    def lda_disctance_calculation(self):
-        """Computes the distance (linear distance function) of the currently classified value and smoothes outliers.
+        self.__bandpass_csp_filter(x, work)
 
-        Returns
-        -------
-        class_label: `int`
-            Optimized class label.
-        distance:  `float`
-            LDA distance.
-        """
+        timer = self.timer
+        if timer is not None:
+            t = time.perf_counter_ns()
+        self.log_band_power.compute_log_band_power(work['csp'].T, out=work['lbp'])
+        if timer is not None:
+            t = timer.count('log-band-power', t)
 
-        # linear distance function
-        # distance equals length of feedback bar -> in VR intesity of outline glow
-        is_class_1 = 1 * (self.label == 1) - 1 * (self.label_buffer[self.label_idx] == 1) + self.is_class_buffer[0]
-        is_class_2 = 1 * (self.label == 2) - 1 * (self.label_buffer[self.label_idx] == 2) + self.is_class_buffer[1]
-        class_label = np.argmax([is_class_1, is_class_2], axis=0) + 1
+        scores = work['scores']
+        np.matmul(work['lbp'], self.lda_weights, out=scores)
+        scores += self.lda_bias
+        self.__predict_labels(scores, work)
+        if timer is not None:
+            t = timer.count('lda', t)
 
-        distance = self.is_class_buffer[class_label - 1] / self.sample_rate
+        self.__update_labels(work)
+        if timer is not None:
+            timer.count('distance', t)
 
-        self.label_buffer[self.label_idx] = self.label
-        self.is_class_buffer = np.array([is_class_1, is_class_2])
+        return work['class_label'], work['distance']
 
-        if self.label_idx < self.sample_rate - 1:
-            self.label_idx += 1
-        else:
-            self.label_idx = 0
+    def filter(self, x):
+        """Bandpass and CSP filters a block of eeg samples without classifying it (e.g. to feed the bandpass filter).
 
-        return class_label, distance
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x enabled channels) of raw eeg data.
+        """
 
+        n_samples = np.shape(x)[0]
+        work = self.work_buffers.get(n_samples)
+        if work is None:
+            work = self.__init_work_buffers(n_samples)
 
-class Bandpass:
-    """Bandpass unit.
+        self.__bandpass_csp_filter(x, work)
 
-    Holds parameters and methods for bandpass filtering.
+    def __bandpass_csp_filter(self, x, work):
+        """Bandpass and CSP filters a block of eeg samples (in the configured pipeline order).
 
-    Parameters
-    ----------
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x enabled channels) of raw eeg data.
+        work: `dict`
+            The work buffers, the result is written to 'csp' (CSP outputs x samples).
+        """
+
+        timer = self.timer
+        if timer is not None:
+            t = time.perf_counter_ns()
+
+        # The bandpass works in place on channels x samples
+        if self.pipeline_order == PipelineOrder.SPATIAL_FIRST:
+            np.matmul(self.CSP, x.T, out=work['csp'])
+            if timer is not None:
+                t = timer.count('csp', t)
+            self.bandpass_cl.bandpass_filter_inplace(work['csp'])
+            if timer is not None:
+                timer.count('bandpass', t)
+        else:
+            np.copyto(work['x'], x.T)
+            self.bandpass_cl.bandpass_filter_inplace(work['x'])
+            if timer is not None:
+                t = timer.count('bandpass', t)
+            np.matmul(self.CSP, work['x'], out=work['csp'])
+            if timer is not None:
+                timer.count('csp', t)
+
+    def __init_work_buffers(self, n_samples):
+        """Allocates the work buffers of process() for a block size.
+
+        Parameters
+        ----------
+        n_samples: `int`
+            Number of samples per block.
+
+        Returns
+        -------
+        work: `dict`
+            The work buffers.
+        """
+
+        n_channels = np.shape(self.CSP)[1]
+        n_csp = np.shape(self.CSP)[0]
+        n_classes = np.shape(self.LDA)[0]
+        n_hist = min(n_samples, self.sample_rate)
+
+        work = {'x': np.zeros((n_channels, n_samples), dtype=self.dtype),
+                'csp': np.zeros((n_csp, n_samples), dtype=self.dtype),
+                'lbp': np.zeros((n_samples, n_csp), dtype=self.dtype),
+                'scores': np.zeros((n_samples, n_classes), dtype=self.dtype),
+                'scores_abs': np.zeros((n_samples, n_classes), dtype=self.dtype),
+                'scores_max': np.zeros((n_samples, 1), dtype=self.dtype),
+                'scores_nan': np.zeros((n_samples, n_classes), dtype=bool),
+                'labels': np.zeros((n_samples,), dtype=int),
+                'labels_old': np.zeros((n_samples,), dtype=int),
+                'idx': np.zeros((n_hist,), dtype=int),
+                'idx_range': np.arange(n_hist),
+                'is_class': np.zeros((n_samples + 1, 2), dtype=int),
+                'is_label': np.zeros((n_samples,), dtype=int),
+                'is_class_2': np.zeros((n_samples,), dtype=bool),
+                'class_label': np.zeros((n_samples,), dtype=int),
+                'distance': np.zeros((n_samples,))}
+        self.work_buffers[n_samples] = work
+
+        return work
+
+    def __predict_labels(self, scores, work):
+        """Computes the class labels from the linear scores of the LDA (in place version of lda_predict).
+
+        Parameters
+        ----------
+        scores: `ndarray`
+            2-D array (samples x classes) of linear scores.
+        work: `dict`
+            The work buffers.
+        """
+
+        # Normalized like in lda_predict() (without the factor 100, which does not change the labels), so non-finite
+        # scores lead to the same labels
+        np.abs(scores, out=work['scores_abs'])
+        np.max(work['scores_abs'], axis=1, keepdims=True, out=work['scores_max'])
+        np.divide(scores, work['scores_max'], out=scores)
+
+        # Behaves like nanargmax
+        np.isnan(scores, out=work['scores_nan'])
+        np.copyto(scores, -np.inf, where=work['scores_nan'])
+        np.argmax(scores, axis=1, out=work['labels'])
+        work['labels'] += 1
+        self.label = work['labels'][-1]
+
+    def __update_labels(self, work):
+        """Computes the class labels and distances (linear distance function) and updates the buffered labels.
+
+        Parameters
+        ----------
+        work: `dict`
+            The work buffers, 'labels' holds the classified labels, the result is written to 'class_label' and
+            'distance'.
+        """
+
+        labels = work['labels']
+        labels_old = work['labels_old']
+        idx = work['idx']
+        is_class = work['is_class']
+        n_samples = np.shape(labels)[0]
+        n_hist = np.shape(idx)[0]
+
+        if n_samples == 1:
+            # Scalar version for sample wise processing (avoids the overhead of the array operations)
+            label = int(labels[0])
+            label_old = int(self.label_buffer[self.label_idx])
+            is_class_1 = (label == 1) - (label_old == 1) + int(self.is_class_buffer[0])
+            is_class_2 = (label == 2) - (label_old == 2) + int(self.is_class_buffer[1])
+            class_label = 2 if is_class_2 > is_class_1 else 1
+
+            work['class_label'][0] = class_label
+            work['distance'][0] = self.is_class_buffer[class_label - 1] / self.sample_rate
+            self.is_class_buffer[0] = is_class_1
+            self.is_class_buffer[1] = is_class_2
+            self.label_buffer[self.label_idx] = label
+            self.label_idx = (self.label_idx + 1) % self.sample_rate
+            return
+
+        # The label which leaves the buffer at step i: first the oldest buffered labels, then the new ones
+        np.add(work['idx_range'], self.label_idx, out=idx)
+        np.remainder(idx, self.sample_rate, out=idx)
+        np.take(self.label_buffer, idx, out=labels_old[:n_hist])
+        labels_old[n_hist:] = labels[:n_samples - n_hist]
+
+        # linear distance function
+        # distance equals length of feedback bar -> in VR intesity of outline glow
+        is_class[0, :] = self.is_class_buffer
+        for cl in range(2):
+            np.equal(labels, cl + 1, out=is_class[1:, cl], casting='unsafe')
+            np.equal(labels_old, cl + 1, out=work['is_label'], casting='unsafe')
+            is_class[1:, cl] -= work['is_label']
+        np.cumsum(is_class, axis=0, out=is_class)
+
+        # Class 1 wins a tie (like argmax)
+        np.greater(is_class[1:, 1], is_class[1:, 0], out=work['is_class_2'])
+        np.add(work['is_class_2'], 1, out=work['class_label'], casting='unsafe')
+        np.copyto(work['distance'], is_class[:-1, 0])
+        np.copyto(work['distance'], is_class[:-1, 1], where=work['is_class_2'])
+        work['distance'] /= self.sample_rate
+
+        # Only the last (sample rate) labels remain in the buffer
+        np.add(work['idx_range'], self.label_idx + n_samples - n_hist, out=idx)
+        np.remainder(idx, self.sample_rate, out=idx)
+        self.label_buffer[idx] = labels[n_samples - n_hist:]
+        self.label_idx = (self.label_idx + n_samples) % self.sample_rate
+        self.is_class_buffer[:] = is_class[-1, :]
+
+    def lda_predict(self, x):
+        """Predicts the class of the data with linear discriminant analysis.
+
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x features).
+
+        Returns
+        -------
+        label: `ndarray`
+            1-D array of class labels (one per sample).
+        distance:  `ndarray`
+            1-D array of LDA distances (one per sample).
+        """
+
+        x_conc = np.append(np.ones([np.shape(x)[0], 1]), x, axis=1)
+        x_mat = np.matmul(x_conc, self.LDA.T)
+        linear_scores = np.divide(np.multiply(x_mat, 100),
+                                  np.max(np.abs(x_mat), axis=1, keepdims=True))
+        labels = np.nanargmax(linear_scores, axis=1) + 1
+        self.label = labels[-1]
+        label, distance = self.lda_disctance_calculation(labels)
+
+        return label, distance
+
+    def lda_disctance_calculation(self, labels):
+        """Computes the distance (linear distance function) of the currently classified values and smoothes outliers.
+
+        Parameters
+        ----------
+        labels: `ndarray`
+            1-D array of the classified labels (in chronological order).
+
+        Returns
+        -------
+        class_label: `ndarray`
+            1-D array of optimized class labels.
+        distance:  `ndarray`
+            1-D array of LDA distances.
+        """
+
+        n_samples = np.shape(labels)[0]
+        work = self.work_buffers.get(n_samples)
+        if work is None:
+            work = self.__init_work_buffers(n_samples)
+
+        work['labels'][:] = labels
+        self.__update_labels(work)
+
+        return work['class_label'].copy(), work['distance'].copy()
+
+
+class BatchedBCICore:
+    """Signal processing unit for several classification pipelines.
+
+    Stacks the bandpass filter delays, CSP filters, log band power states and LDA coefficients of several BCI cores
+    (e.g. of several subjects or of candidate models for one subject), so each stage of process() runs once for all
+    pipelines instead of once per pipeline. The BCI cores must have the same sample rate, pipeline order, bandpass
+    filter and log band power window and matching shapes. The batch continues from the current state of the BCI cores,
+    which must not be used on their own afterwards. The ERDS calculation is not batched.
+
+    Parameters
+    ----------
+    bci_cores: `list`
+        The BCI cores (`BCICore` instances).
+
+    Other Parameters
+    ----------------
+    n_pipelines: `int`
+        Number of stacked pipelines.
+    CSP: `ndarray`
+        Stacked common spatial patterns (3-D array, pipelines x CSP filters x channels).
+    lda_weights: `ndarray`
+        Stacked LDA coefficients without the bias (3-D array, pipelines x features x classes).
+    lda_bias: `ndarray`
+        Stacked bias of the LDA coefficients (3-D array, pipelines x 1 x classes).
+    bandpass_cl: `Bandpass instance`
+        Bandpass filtering unit for the channels of all pipelines.
+    log_band_power: `LogBandPower instance`
+        Unit for computing the log band power of the CSP outputs of all pipelines.
+    label_buffer: `ndarray`
+        2-D array (pipelines x sample rate) of past class labels.
+    is_class_buffer: `ndarray`
+        2-D array (pipelines x 2) buffer used for the distance calculation.
+    label_idx: `int`
+        Current index for the buffered labels (the same for all pipelines).
+    work_buffers: `dict`
+        Preallocated arrays used by process(), one set per block size.
+    """
+
+    def __init__(self, bci_cores):
+        core = bci_cores[0]
+        for other in bci_cores[1:]:
+            if other.sample_rate != core.sample_rate or other.pipeline_order != core.pipeline_order \
+                    or np.shape(other.CSP) != np.shape(core.CSP) or np.shape(other.LDA) != np.shape(core.LDA) \
+                    or other.dtype != core.dtype \
+                    or not np.array_equal(other.bandpass_cl.sos, core.bandpass_cl.sos) \
+                    or type(other.log_band_power) is not type(core.log_band_power) \
+                    or other.log_band_power.window_length != core.log_band_power.window_length \
+                    or other.label_idx != core.label_idx:
+                raise ValueError("BCI cores with different settings can not be batched")
+
+        self.sample_rate = core.sample_rate
+        self.pipeline_order = core.pipeline_order
+        self.dtype = core.dtype
+        self.n_pipelines = len(bci_cores)
+        n_csp = np.shape(core.CSP)[0]
+
+        self.CSP = np.stack([bci_core.CSP for bci_core in bci_cores])
+        self.lda_weights = np.stack([bci_core.lda_weights for bci_core in bci_cores])
+        self.lda_bias = np.stack([bci_core.lda_bias for bci_core in bci_cores])[:, np.newaxis, :]
+
+        # One bandpass for the (CSP) channels of all pipelines, the filter delays are stacked along the channels
+        self.bandpass_cl = Bandpass(order=core.bandpass_cl.order, fstop=core.bandpass_cl.fstop,
+                                    fpass=core.bandpass_cl.fpass, n=self.n_pipelines * core.bandpass_cl.n,
+                                    dtype=self.dtype, backend=core.bandpass_cl.backend)
+        self.bandpass_cl.zi[:] = np.concatenate([bci_core.bandpass_cl.zi for bci_core in bci_cores])
+
+        # One log band power unit for the CSP outputs of all pipelines (pipeline after pipeline)
+        self.log_band_power = type(core.log_band_power)(window_length=core.log_band_power.window_length,
+                                                        n=self.n_pipelines * n_csp, dtype=self.dtype)
+        self.log_band_power.history[:] = np.concatenate([bci_core.log_band_power.history
+                                                         for bci_core in bci_cores], axis=1)
+        if isinstance(core.log_band_power, RunningLogBandPower):
+            self.log_band_power.sum[:] = np.concatenate([bci_core.log_band_power.sum for bci_core in bci_cores])
+            self.log_band_power.compensation[:] = np.concatenate([bci_core.log_band_power.compensation
+                                                                  for bci_core in bci_cores])
+            self.log_band_power.pos = core.log_band_power.pos
+
+        self.label_buffer = np.stack([bci_core.label_buffer for bci_core in bci_cores])
+        self.is_class_buffer = np.stack([bci_core.is_class_buffer for bci_core in bci_cores])
+        self.label_idx = core.label_idx
+        self.work_buffers = {}
+
+    def reset_buffer(self):
+        """Clears the buffered values of all pipelines after every trial.
+        """
+
+        self.label_buffer[:] = 0
+        self.label_idx = 0
+        self.is_class_buffer[:] = 0
+
+    def process(self, x):
+        """Classifies a block of eeg samples in all pipelines (see `BCICore.process`).
+
+        Parameters
+        ----------
+        x: `ndarray`
+            3-D array (pipelines x samples x enabled channels) of raw eeg data, or 2-D array (samples x enabled
+            channels) of raw eeg data processed by all pipelines.
+
+        Returns
+        -------
+        label: `ndarray`
+            2-D array (pipelines x samples) of class labels. The array is reused by the next call.
+        distance:  `ndarray`
+            2-D array (pipelines x samples) of LDA distances. The array is reused by the next call.
+        """
+
+        n_samples = np.shape(x)[-2]
+        work = self.work_buffers.get(n_samples)
+        if work is None:
+            work = self.__init_work_buffers(n_samples)
+
+        # The bandpass works in place on (pipelines * channels) x samples
+        x_t = np.swapaxes(x, -1, -2)
+        if self.pipeline_order == PipelineOrder.SPATIAL_FIRST:
+            np.matmul(self.CSP, x_t, out=work['csp'])
+            self.bandpass_cl.bandpass_filter_inplace(work['csp_2d'])
+        else:
+            np.copyto(work['x'], x_t)
+            self.bandpass_cl.bandpass_filter_inplace(work['x_2d'])
+            np.matmul(self.CSP, work['x'], out=work['csp'])
+
+        self.log_band_power.compute_log_band_power(work['csp_2d'].T, out=work['lbp_2d'])
+
+        scores = work['scores']
+        np.matmul(work['lbp'], self.lda_weights, out=scores)
+        scores += self.lda_bias
+        self.__predict_labels(scores, work)
+        self.__update_labels(work)
+
+        return work['class_label'], work['distance']
+
+    def __init_work_buffers(self, n_samples):
+        """Allocates the work buffers of process() for a block size.
+
+        Parameters
+        ----------
+        n_samples: `int`
+            Number of samples per block.
+
+        Returns
+        -------
+        work: `dict`
+            The work buffers.
+        """
+
+        n_pipelines, n_csp, n_channels = np.shape(self.CSP)
+        n_classes = np.shape(self.lda_weights)[2]
+        n_hist = min(n_samples, self.sample_rate)
+
+        work = {'x': np.zeros((n_pipelines, n_channels, n_samples), dtype=self.dtype),
+                'csp': np.zeros((n_pipelines, n_csp, n_samples), dtype=self.dtype),
+                'lbp_2d': np.zeros((n_samples, n_pipelines * n_csp), dtype=self.dtype),
+                'scores': np.zeros((n_pipelines, n_samples, n_classes), dtype=self.dtype),
+                'scores_abs': np.zeros((n_pipelines, n_samples, n_classes), dtype=self.dtype),
+                'scores_max': np.zeros((n_pipelines, n_samples, 1), dtype=self.dtype),
+                'scores_nan': np.zeros((n_pipelines, n_samples, n_classes), dtype=bool),
+                'labels': np.zeros((n_pipelines, n_samples), dtype=int),
+                'labels_old': np.zeros((n_pipelines, n_samples), dtype=int),
+                'idx': np.zeros((n_hist,), dtype=int),
+                'idx_range': np.arange(n_hist),
+                'is_class': np.zeros((n_pipelines, n_samples + 1, 2), dtype=int),
+                'is_label': np.zeros((n_pipelines, n_samples), dtype=int),
+                'is_class_2': np.zeros((n_pipelines, n_samples), dtype=bool),
+                'class_label': np.zeros((n_pipelines, n_samples), dtype=int),
+                'distance': np.zeros((n_pipelines, n_samples))}
+
+        # Views of the stacked arrays: channels of all pipelines for the bandpass and the log band power, features of
+        # each pipeline for the LDA
+        work['x_2d'] = work['x'].reshape((n_pipelines * n_channels, n_samples))
+        work['csp_2d'] = work['csp'].reshape((n_pipelines * n_csp, n_samples))
+        work['lbp'] = work['lbp_2d'].reshape((n_samples, n_pipelines, n_csp)).transpose((1, 0, 2))
+        self.work_buffers[n_samples] = work
+
+        return work
+
+    def __predict_labels(self, scores, work):
+        """Computes the class labels of all pipelines from the linear scores of the LDA.
+
+        Parameters
+        ----------
+        scores: `ndarray`
+            3-D array (pipelines x samples x classes) of linear scores.
+        work: `dict`
+            The work buffers.
+        """
+
+        np.abs(scores, out=work['scores_abs'])
+        np.max(work['scores_abs'], axis=2, keepdims=True, out=work['scores_max'])
+        np.divide(scores, work['scores_max'], out=scores)
+
+        # Behaves like nanargmax
+        np.isnan(scores, out=work['scores_nan'])
+        np.copyto(scores, -np.inf, where=work['scores_nan'])
+        np.argmax(scores, axis=2, out=work['labels'])
+        work['labels'] += 1
+
+    def __update_labels(self, work):
+        """Computes the class labels and distances of all pipelines and updates the buffered labels.
+
+        Parameters
+        ----------
+        work: `dict`
+            The work buffers, 'labels' holds the classified labels, the result is written to 'class_label' and
+            'distance'.
+        """
+
+        labels = work['labels']
+        labels_old = work['labels_old']
+        idx = work['idx']
+        is_class = work['is_class']
+        n_samples = np.shape(labels)[1]
+        n_hist = np.shape(idx)[0]
+
+        # The label which leaves the buffer at step i: first the oldest buffered labels, then the new ones
+        np.add(work['idx_range'], self.label_idx, out=idx)
+        np.remainder(idx, self.sample_rate, out=idx)
+        np.take(self.label_buffer, idx, axis=1, out=labels_old[:, :n_hist])
+        labels_old[:, n_hist:] = labels[:, :n_samples - n_hist]
+
+        is_class[:, 0, :] = self.is_class_buffer
+        for cl in range(2):
+            np.equal(labels, cl + 1, out=is_class[:, 1:, cl], casting='unsafe')
+            np.equal(labels_old, cl + 1, out=work['is_label'], casting='unsafe')
+            is_class[:, 1:, cl] -= work['is_label']
+        np.cumsum(is_class, axis=1, out=is_class)
+
+        # Class 1 wins a tie (like argmax)
+        np.greater(is_class[:, 1:, 1], is_class[:, 1:, 0], out=work['is_class_2'])
+        np.add(work['is_class_2'], 1, out=work['class_label'], casting='unsafe')
+        np.copyto(work['distance'], is_class[:, :-1, 0])
+        np.copyto(work['distance'], is_class[:, :-1, 1], where=work['is_class_2'])
+        work['distance'] /= self.sample_rate
+
+        # Only the last (sample rate) labels remain in the buffer
+        np.add(work['idx_range'], self.label_idx + n_samples - n_hist, out=idx)
+        np.remainder(idx, self.sample_rate, out=idx)
+        self.label_buffer[:, idx] = labels[:, n_samples - n_hist:]
+        self.label_idx = (self.label_idx + n_samples) % self.sample_rate
+        self.is_class_buffer[:] = is_class[:, -1, :]
+
+
+class Bandpass:
+    """Bandpass unit.
+
+    Holds parameters and methods for bandpass filtering.
+
+    Parameters
+    ----------
     order: `int`
         The order of the filter.
     fpass: `list`
         Frequencies of the filter.
     n: `int`
         Number of eeg channels.
+    dtype: `type`
+        Data type of the filter coefficients, the filter delay and the filtered data.
+    backend: `FilterBackend`
+        Implementation of the filter.
+    sos: `ndarray`
+        Precomputed second-order sections of the filter (e.g. of a compiled model), designed from the order and the
+        frequencies if None.
+    zi: `ndarray`
+        Precomputed initial conditions of the filter delay of one channel (2-D array, sections x 2), computed from the
+        second-order sections if None.
 
     Other Parameters
     ----------------
@@ -460,33 +1695,219 @@ class Bandpass:
     zi0: `ndarray`
         Initial conditions for the filter delay.
     zi: `ndarray`
-        Current filter delay values.
+        Current filter delay values (3-D array, channels x sections x 2).
+    system: `ndarray`
+        State-space matrix of one sample of the cascade (2-D array, maps the filter delays of all sections and the
+        input sample to the new filter delays and the output sample).
+    state_space: `dict`
+        Matrices and work buffers of the state-space backend, one set per block size.
+    timer: `StageTimer instance`
+        Timing counter of the filter (None unless profiling is enabled).
     """
 
-    def __init__(self, order, fstop, fpass, n):
+    def __init__(self, order, fstop, fpass, n, dtype=np.float64, backend=FilterBackend.SOS, sos=None, zi=None):
         self.order = order
         self.fstop = fstop
         self.fpass = fpass
         self.n = n
-        self.sos = None
-        self.zi0 = None
+        self.dtype = np.dtype(dtype)
+        self.backend = backend
+        self.sos = sos
+        self.zi0 = zi
         self.zi = None
+        self.system = None
+        self.state_space = {}
+        self.timer = None
 
         self.__init_filter()
+        if self.backend == FilterBackend.STATE_SPACE:
+            self.__init_system()
 
     def __init_filter(self):
-        """Computes the second order sections of the filter and the initial conditions for the filter delay.
+        """Computes the second order sections of the filter and the initial conditions for the filter delay (unless they
+        are precomputed).
+        """
+
+        if self.sos is not None:
+            sos = np.asarray(self.sos, dtype=np.float64)
+        else:
+            sos = signal.iirfilter(int(self.order / 2), self.fpass, btype='bandpass', ftype='butter', output='sos')
+
+        # The rounded coefficients must still describe a stable filter
+        if self.dtype != np.float64 and self.max_pole_radius(sos.astype(self.dtype)) >= 1:
+            print("WARNING the bandpass filter is unstable in " + self.dtype.name + ", float64 is used")
+            self.dtype = np.dtype(np.float64)
+        self.sos = sos.astype(self.dtype)
+
+        zi = signal.sosfilt_zi(sos) if self.zi0 is None else np.asarray(self.zi0, dtype=np.float64)
+
+        # All channels start with the initial conditions of one channel (sections x 2 x channels)
+        self.zi0 = np.repeat(zi[:, :, np.newaxis], self.n, axis=2).astype(self.dtype)
+        self.zi = np.ascontiguousarray(np.transpose(self.zi0, (2, 0, 1)))
+
+    def __init_system(self):
+        """Computes the state-space matrix of one sample of the cascade of the second order sections.
+
+        The states are the filter delays of all sections (the same as zi, transposed direct form II like sosfilt), so
+        both backends continue from the same filter delay.
+        """
+
+        n_states = 2 * np.shape(self.sos)[0]
+        sos = self.sos.astype(np.float64)
+
+        # One sample of the cascade is linear in the filter delays and the input sample, so the columns of the matrix
+        # are the results for the unit vectors
+        self.system = np.zeros((n_states + 1, n_states + 1))
+        for i, unit in enumerate(np.eye(n_states + 1)):
+            zi = unit[:n_states].reshape((-1, 2))
+            y = unit[n_states]
+            for (b0, b1, b2, _, a1, a2), z in zip(sos, zi):
+                u = y
+                y = b0 * u + z[0]
+                z[0], z[1] = b1 * u - a1 * y + z[1], b2 * u - a2 * y
+            self.system[:n_states, i] = zi.ravel()
+            self.system[n_states, i] = y
+
+    def __init_state_space(self, n_samples):
+        """Computes the matrices of the state-space backend for a block size and allocates its work buffers.
+
+        For a block of samples x (channels x samples) and the filter delay z (channels x states) the output is
+        z O + x T and the new filter delay is z A + x G, where O and T hold the responses of the cascade to the
+        filter delay and to the input samples of the block. Both are computed with one matrix product of [z, x] and
+        the stacked matrix [[O, A], [T, G]].
+
+        Parameters
+        ----------
+        n_samples: `int`
+            Number of samples per block.
+
+        Returns
+        -------
+        state_space: `dict`
+            The matrices and work buffers.
+        """
+
+        n_states = np.shape(self.system)[0] - 1
+        a = self.system[:n_states, :n_states]
+        b = self.system[:n_states, n_states]
+        c = self.system[n_states, :n_states]
+        d = self.system[n_states, n_states]
+
+        # Powers of the state matrix applied to the input (a^k b) and seen by the output (c a^k)
+        a_power_b = np.zeros((n_samples, n_states))
+        c_a_power = np.zeros((n_samples, n_states))
+        a_power_b[0] = b
+        c_a_power[0] = c
+        for k in range(1, n_samples):
+            a_power_b[k] = a @ a_power_b[k - 1]
+            c_a_power[k] = c_a_power[k - 1] @ a
+
+        # Impulse response of the cascade, the output sample k depends on the input samples j <= k
+        impulse_response = np.concatenate(([d], c_a_power[:n_samples - 1] @ b))
+        k, j = np.indices((n_samples, n_samples))
+        t = np.where(j <= k, impulse_response[np.maximum(k - j, 0)], 0)
+
+        matrix = np.block([[c_a_power.T, np.linalg.matrix_power(a, n_samples).T],
+                           [t.T, a_power_b[::-1]]])
+        state_space = {'matrix': matrix.astype(self.dtype),
+                       'zx': np.zeros((self.n, n_states + n_samples), dtype=self.dtype),
+                       'yz': np.zeros((self.n, n_samples + n_states), dtype=self.dtype)}
+        self.state_space[n_samples] = state_space
+
+        return state_space
+
+    def __filter_state_space(self, x):
+        """Bandpass filters the input array in place with the state-space backend.
+
+        Parameters
+        ----------
+        x: `ndarray`
+            Raw eeg data (2-D array, channels x samples), overwritten with the band passed data.
+        """
+
+        zi = self.zi.reshape((self.n, -1))
+        n_states = np.shape(zi)[1]
+        n_samples = np.shape(x)[1]
+
+        for start in range(0, n_samples, STATE_SPACE_MAX_BLOCK):
+            stop = min(start + STATE_SPACE_MAX_BLOCK, n_samples)
+            state_space = self.state_space.get(stop - start)
+            if state_space is None:
+                state_space = self.__init_state_space(stop - start)
+
+            # [y, z] = [z, x] [[O, A], [T, G]]
+            zx = state_space['zx']
+            yz = state_space['yz']
+            zx[:, :n_states] = zi
+            zx[:, n_states:] = x[:, start:stop]
+            np.matmul(zx, state_space['matrix'], out=yz)
+            x[:, start:stop] = yz[:, :stop - start]
+            zi[:] = yz[:, stop - start:]
+
+    @staticmethod
+    def max_pole_radius(sos):
+        """Computes the largest magnitude of the poles of a filter (the filter is stable if it is below 1).
+
+        Parameters
+        ----------
+        sos: `ndarray`
+            Second-order sections representation of the filter.
+
+        Returns
+        -------
+        radius: `float`
+            Largest magnitude of the poles of all sections.
+        """
+
+        return max(np.max(np.abs(np.roots(section[3:].astype(np.float64))), initial=0) for section in sos)
+
+    def enable_profiling(self, shared=False):
+        """Enables the timing counter of the filter.
+
+        Parameters
+        ----------
+        shared: `bool`
+            Whether the counter is shared with worker processes.
+        """
+
+        self.timer = StageTimer(['filter'], shared=shared)
+
+    def set_initial_conditions(self, level):
+        """Sets the filter delay to the initial conditions scaled for each channel.
+
+        Parameters
+        ----------
+        level: `ndarray`
+            1-D array of the scale factor for each channel.
         """
 
-        self.sos = signal.iirfilter(int(self.order / 2), self.fpass, btype='bandpass', ftype='butter',
-                                    output='sos')
+        self.zi[:] = np.transpose(self.zi0, (2, 0, 1)) * np.reshape(level, (self.n, 1, 1))
+
+    def prime(self, x):
+        """Primes the filter delay with the first samples of a signal and filters them.
+
+        The filter is run over the odd reflection of the samples about the first one (like the padding of filtfilt), so
+        it starts close to the steady state of the signal instead of seeing its DC offset as a step.
+
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x channels) of the first samples of the raw eeg data.
+
+        Returns
+        -------
+        y: `ndarray`
+            Band passed data.
+        """
 
-        zi = signal.sosfilt_zi(self.sos)
+        reflection = 2 * x[0] - x[:0:-1]
+        if np.shape(reflection)[0] > 0:
+            self.set_initial_conditions(reflection[0])
+            self.bandpass_filter(reflection)
+        else:
+            self.set_initial_conditions(x[0])
 
-        if self.n > 1:
-            zi = np.tile(zi, (self.n, 1, 1)).T
-        self.zi0 = zi.reshape((np.shape(self.sos)[0], 2, self.n))
-        self.zi = self.zi0
+        return self.bandpass_filter(x)
 
     def bandpass_filter(self, x):
         """Bandpass filters the input array.
@@ -502,14 +1923,42 @@ class Bandpass:
             Band passed data.
         """
 
-        y, self.zi = signal.sosfilt(self.sos, x, zi=self.zi, axis=0)
-        return y
+        y = np.array(np.transpose(x), dtype=self.dtype, order='C', ndmin=2)
+        self.bandpass_filter_inplace(y)
+        return np.transpose(y)
+
+    def bandpass_filter_inplace(self, x):
+        """Bandpass filters the input array in place.
+
+        Parameters
+        ----------
+        x: `ndarray`
+            Raw eeg data (2-D array, channels x samples), overwritten with the band passed data.
+        """
+
+        if self.timer is not None:
+            t = time.perf_counter_ns()
+
+        if self.backend == FilterBackend.STATE_SPACE:
+            self.__filter_state_space(x)
+        elif _sosfilt is not None and x.flags.c_contiguous and x.dtype == self.sos.dtype:
+            # The kernel only accepts C-contiguous arrays of the dtype of the filter
+            _sosfilt(self.sos, x, self.zi)
+        else:
+            x[:], zi = signal.sosfilt(self.sos, x, zi=np.transpose(self.zi, (1, 0, 2)), axis=1)
+            self.zi[:] = np.transpose(zi, (1, 0, 2))
+
+        if self.timer is not None:
+            self.timer.count('filter', t)
 
 
 class LogBandPower:
     """Log band power unit.
 
-    Holds parameters and methods for computing the log band power of a signal.
+    Holds parameters and methods for computing the log band power of a signal. The moving average of the power is the
+    FIR filter with equal coefficients (like lfilter with the coefficients b), computed as the sum over the window of
+    the last power values, which are kept in a preallocated history. All computations write into preallocated work
+    buffers.
 
     Parameters
     ----------
@@ -517,46 +1966,73 @@ class LogBandPower:
         Length of the window.
     n: `int`
         Number of channels.
+    dtype: `type`
+        Data type of the filter coefficients, the history and the log band power.
 
     Other Parameters
     ----------------
-    a: `int`
-        The denominator coefficient.
-    b: `ndarray`
-        The numerator coefficient vector (1-D array).
-    zi: `ndarray`
-        Conditions for lfilter for step response steady-state.
+    b: `float`
+        The coefficient of the FIR filter (one over the number of samples in the window).
+    window_samples: `int`
+        Number of samples in the window.
+    history: `ndarray`
+        2-D array ((window samples - 1) x channels) of the last power values (the filter delay), initialized with the
+        steady state of a unit step (like lfilter_zi).
+    work_buffers: `dict`
+        Preallocated arrays, one set per block size.
     """
 
-    def __init__(self, window_length, n):
+    def __init__(self, window_length, n, dtype=np.float64):
         self.window_length = window_length
         self.n = n
-        self.a = None
+        self.dtype = np.dtype(dtype)
         self.b = None
-        self.zi = None
+        self.window_samples = None
+        self.history = None
+        self.work_buffers = {}
 
         self.__init_conditions()
 
     def __init_conditions(self):
-        """Initializes the coefficients for the filter and the initial conditions for the filter delay.
+        """Initializes the coefficient of the filter and the filter delay.
+        """
+
+        self.window_samples = math.floor(self.window_length)
+        self.b = self.dtype.type(1 / self.window_samples)
+        self.history = np.ones((self.window_samples - 1, self.n), dtype=self.dtype)
+
+    def __init_work_buffers(self, n_samples):
+        """Allocates the work buffers for a block size.
+
+        Parameters
+        ----------
+        n_samples: `int`
+            Number of samples per block.
+
+        Returns
+        -------
+        work: `dict`
+            The work buffers.
         """
 
-        window_samples = math.floor(self.window_length)
-        self.b = 1 / window_samples * np.ones((1, window_samples))
-        self.a = 1
+        # The power values of the history followed by the ones of the block, the windows are views of it
+        x_pow = np.zeros((self.window_samples - 1 + n_samples, self.n), dtype=self.dtype)
+        work = {'x_pow': x_pow,
+                'windows': np.lib.stride_tricks.sliding_window_view(x_pow, self.window_samples, axis=0),
+                'y': np.zeros((n_samples, self.n), dtype=self.dtype)}
+        self.work_buffers[n_samples] = work
 
-        zi = signal.lfilter_zi(self.b[0], self.a)
-        if self.n > 1:
-            zi = np.tile(zi, (self.n, 1)).T
-        self.zi = zi
+        return work
 
-    def compute_log_band_power(self, x):
+    def compute_log_band_power(self, x, out=None):
         """Computes the logarithmic band power of the input signal.
 
         Parameters
         ----------
         x: `ndarray`
             Input data.
+        out: `ndarray`
+            Optional array (same shape as x) the result is written to.
 
         Returns
         -------
@@ -564,6 +2040,1159 @@ class LogBandPower:
             The log band power of the input data.
         """
 
-        x_filt, self.zi = signal.lfilter(self.b[0], self.a, np.square(np.abs(x)), zi=self.zi, axis=0)
+        n_samples = np.shape(x)[0]
+        work = self.work_buffers.get(n_samples)
+        if work is None:
+            work = self.__init_work_buffers(n_samples)
+        if out is None:
+            out = np.zeros((n_samples, self.n), dtype=self.dtype)
+
+        n_hist = self.window_samples - 1
+        x_pow = work['x_pow']
+        x_pow[:n_hist] = self.history
+        np.square(x, out=x_pow[n_hist:])
+
+        # Sum over the window of each sample, then the oldest values are dropped from the history
+        y = work['y']
+        np.sum(work['windows'], axis=2, out=y)
+        y *= self.b
+        self.history[:] = x_pow[n_samples:]
+
+        return np.log10(y, out=out)
+
+    def prime(self, x):
+        """Fills the window with the mean power of the first samples of a signal (instead of a power of one).
+
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x channels) of the first samples of the input data.
+        """
+
+        self.history[:] = np.mean(np.square(x, dtype=self.dtype), axis=0)
+
+
+class RunningLogBandPower:
+    """Log band power unit based on a running sum.
+
+    Computes the same moving average of the signal power as `LogBandPower`, but keeps a circular history of the last
+    power values and a compensated (Kahan) running sum. Each update costs O(1) independent of the window length and
+    works on preallocated buffers.
+
+    Parameters
+    ----------
+    window_length: `int`
+        Length of the window.
+    n: `int`
+        Number of channels.
+    dtype: `type`
+        Data type of the history, the running sum and the log band power.
+
+    Other Parameters
+    ----------------
+    window_samples: `int`
+        Number of samples in the window.
+    history: `ndarray`
+        2-D array (window samples x channels) of the last power values (circular buffer).
+    pos: `int`
+        Index of the oldest power value in the history.
+    sum: `ndarray`
+        1-D array of the running sum of the history for each channel.
+    compensation: `ndarray`
+        1-D array of the lost low-order bits of the running sum (Kahan summation).
+    work_buffers: `dict`
+        Preallocated arrays, one set per block size.
+    """
+
+    def __init__(self, window_length, n, dtype=np.float64):
+        self.window_length = window_length
+        self.n = n
+        self.dtype = np.dtype(dtype)
+        self.window_samples = None
+        self.history = None
+        self.pos = 0
+        self.sum = None
+        self.compensation = None
+        self.work_buffers = {}
+
+        self.__init_conditions()
+
+    def __init_conditions(self):
+        """Initializes the history with the steady state of a unit step (same as `LogBandPower`).
+        """
+
+        self.window_samples = math.floor(self.window_length)
+        self.history = np.ones((self.window_samples, self.n), dtype=self.dtype)
+        self.pos = 0
+        self.sum = np.sum(self.history, axis=0)
+        self.compensation = np.zeros((self.n,), dtype=self.dtype)
+
+    def __init_work_buffers(self, n_samples):
+        """Allocates the work buffers for a block size.
+
+        Parameters
+        ----------
+        n_samples: `int`
+            Number of samples per block.
+
+        Returns
+        -------
+        work: `dict`
+            The work buffers.
+        """
+
+        n_hist = min(n_samples, self.window_samples)
+        work = {'x_pow': np.zeros((n_samples, self.n), dtype=self.dtype),
+                'x_old': np.zeros((n_samples, self.n), dtype=self.dtype),
+                'delta': np.zeros((n_samples, self.n), dtype=self.dtype),
+                'idx': np.zeros((n_hist,), dtype=int),
+                'idx_range': np.arange(n_hist),
+                'sum': np.zeros((self.n,), dtype=self.dtype),
+                'y': np.zeros((self.n,), dtype=self.dtype)}
+        self.work_buffers[n_samples] = work
+
+        return work
+
+    def compute_log_band_power(self, x, out=None):
+        """Computes the logarithmic band power of the input signal.
+
+        Parameters
+        ----------
+        x: `ndarray`
+            Input data.
+        out: `ndarray`
+            Optional array (same shape as x) the result is written to.
+
+        Returns
+        -------
+        y: `ndarray`
+            The log band power of the input data.
+        """
+
+        n_samples = np.shape(x)[0]
+        work = self.work_buffers.get(n_samples)
+        if work is None:
+            work = self.__init_work_buffers(n_samples)
+        if out is None:
+            out = np.zeros((n_samples, self.n), dtype=self.dtype)
+
+        x_pow = work['x_pow']
+        x_old = work['x_old']
+        delta = work['delta']
+        idx = work['idx']
+        n_hist = np.shape(idx)[0]
+
+        np.abs(x, out=x_pow)
+        np.square(x_pow, out=x_pow)
+
+        # Power values which leave the window: first the oldest ones of the history, then the new ones
+        np.add(work['idx_range'], self.pos, out=idx)
+        np.remainder(idx, self.window_samples, out=idx)
+        np.take(self.history, idx, axis=0, out=x_old[:n_hist])
+        x_old[n_hist:] = x_pow[:n_samples - n_hist]
+
+        np.subtract(x_pow, x_old, out=delta)
+        np.cumsum(delta, axis=0, out=delta)
+        np.subtract(self.sum, self.compensation, out=work['sum'])
+        np.add(delta, work['sum'], out=out)
+        out /= self.window_samples
+
+        # Kahan summation of the change of the running sum
+        y = work['y']
+        np.subtract(delta[-1], self.compensation, out=y)
+        np.add(self.sum, y, out=work['sum'])
+        np.subtract(work['sum'], self.sum, out=self.compensation)
+        self.compensation -= y
+        self.sum[:] = work['sum']
+
+        # Only the last window_samples values remain in the history
+        np.add(work['idx_range'], self.pos + n_samples - n_hist, out=idx)
+        np.remainder(idx, self.window_samples, out=idx)
+        self.history[idx] = x_pow[n_samples - n_hist:]
+        self.pos = (self.pos + n_samples) % self.window_samples
+
+        # Rounding errors must not lead to a negative power
+        np.maximum(out, 0, out=out)
+
+        return np.log10(out, out=out)
+
+    def prime(self, x):
+        """Fills the window with the mean power of the first samples of a signal (instead of a power of one).
+
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x channels) of the first samples of the input data.
+        """
+
+        self.history[:] = np.mean(np.square(x, dtype=self.dtype), axis=0)
+        self.pos = 0
+        self.sum = np.sum(self.history, axis=0)
+        self.compensation[:] = 0
+
+
+class StreamResolver:
+    """LSL stream resolver unit.
+
+    Resolves LSL streams by name concurrently (one thread per stream) and caches the resolved stream infos. Each
+    attempt waits at most the timeout, a warning is printed for each failed attempt (e.g. because of a wrong stream
+    name) and the time needed to resolve a stream is reported.
+
+    Parameters
+    ----------
+    timeout: `float`
+        Time (in seconds) to wait for a stream per attempt.
+    attempts: `int`
+        Number of attempts (None to retry until the stream is found).
+
+    Other Parameters
+    ----------------
+    stream_infos: `dict`
+        Resolved stream infos by stream name.
+    durations: `dict`
+        Time (in seconds) needed to resolve each stream, by stream name.
+    threads: `dict`
+        Thread object resolving each stream, by stream name.
+    """
+
+    def __init__(self, timeout=RESOLVE_TIMEOUT, attempts=RESOLVE_ATTEMPTS):
+        self.timeout = timeout
+        self.attempts = attempts
+        self.stream_infos = {}
+        self.durations = {}
+        self.threads = {}
+
+    def start(self, names):
+        """Starts resolving streams in the background (streams which are already resolved or being resolved are
+        skipped).
+
+        Parameters
+        ----------
+        names: `list`
+            Names of the LSL streams.
+        """
+
+        for name in names:
+            if name not in self.threads:
+                self.threads[name] = threading.Thread(target=self.__resolve, args=(name,), daemon=True)
+                self.threads[name].start()
+
+    def is_resolved(self, name):
+        """Checks whether a stream is resolved (without waiting).
+
+        Parameters
+        ----------
+        name: `str`
+            Name of the LSL stream.
+
+        Returns
+        -------
+        is_resolved: `bool`
+            Whether the stream is resolved, so an inlet can be opened without waiting.
+        """
+
+        return name in self.stream_infos
+
+    def __resolve(self, name):
+        """Resolves a stream, attempt after attempt.
+
+        Parameters
+        ----------
+        name: `str`
+            Name of the LSL stream.
+        """
+
+        start_time = local_clock()
+        attempt = 1
+        while True:
+            streams = resolve_byprop('name', name, timeout=self.timeout)
+            if streams:
+                self.durations[name] = local_clock() - start_time
+                self.stream_infos[name] = streams[0]
+                print("INFO LSL stream '%s' resolved after %.2f s (attempt %d)" % (name, self.durations[name], attempt))
+                return
+
+            print("WARNING LSL stream '%s' not found within %.1f s (attempt %d)" % (name, self.timeout, attempt))
+            if self.attempts is not None and attempt >= self.attempts:
+                return
+            attempt += 1
+
+    def wait(self, name):
+        """Waits until a stream is resolved.
+
+        Parameters
+        ----------
+        name: `str`
+            Name of the LSL stream.
+
+        Returns
+        -------
+        info: `StreamInfo`
+            The resolved stream info.
+        """
+
+        self.start([name])
+        self.threads[name].join()
+
+        info = self.stream_infos.get(name)
+        if info is None:
+            raise RuntimeError("LSL stream '%s' not found after %d attempts" % (name, self.attempts))
+        return info
+
+    def open_inlet(self, name, **settings):
+        """Opens an inlet for a stream (waits until the stream is resolved).
+
+        Parameters
+        ----------
+        name: `str`
+            Name of the LSL stream.
+        settings: `dict`
+            Settings of the inlet (max_buflen, max_chunklen and processing_flags, see `StreamInlet`).
+
+        Returns
+        -------
+        inlet: `StreamInlet`
+            Inlet for the LSL stream.
+        """
+
+        return StreamInlet(self.wait(name), **settings)
+
+
+class ModelWatcher:
+    """Model watcher unit.
+
+    Watches the files of the CSP and LDA coefficients, so a new model (e.g. of a calibration run) can be installed
+    while the feedback model is running. A new model is only loaded once both files have been replaced, so a new CSP
+    filter is never combined with the old LDA coefficients (or vice versa). The files should be written to a temporary
+    file and renamed, so they are complete when they are loaded.
+
+    Parameters
+    ----------
+    csp_file: `str`
+        Path of the .mat file of the CSP filter.
+    lda_file: `str`
+        Path of the .mat file of the LDA coefficients.
+    n_channels: `int`
+        Number of enabled eeg channels (the CSP filter of a new model must have the same number of channels).
+
+    Other Parameters
+    ----------------
+    mtimes: `tuple`
+        Modification times of the files of the current model (None if a file does not exist).
+    """
+
+    def __init__(self, csp_file, lda_file, n_channels):
+        self.csp_file = csp_file
+        self.lda_file = lda_file
+        self.n_channels = n_channels
+        self.mtimes = self.__read_mtimes()
+
+    def __read_mtimes(self):
+        """Reads the modification times of the files.
+
+        Returns
+        -------
+        mtimes: `tuple`
+            Modification times (in nanoseconds) of the CSP and LDA file, None if a file does not exist.
+        """
+
+        try:
+            return os.stat(self.csp_file).st_mtime_ns, os.stat(self.lda_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def poll(self):
+        """Loads the model if both files have changed since the model was loaded.
+
+        Returns
+        -------
+        model: `tuple`
+            The CSP filter and the LDA coefficients (2-D arrays), or None if not both files have changed or they can
+            not be loaded (then they are loaded again at the next call).
+        """
+
+        mtimes = self.__read_mtimes()
+        if mtimes is None or mtimes == self.mtimes:
+            return None
+
+        # Half of a new model is kept back until the other file is replaced as well
+        if self.mtimes is not None and (mtimes[0] == self.mtimes[0] or mtimes[1] == self.mtimes[1]):
+            changed_file = self.csp_file if mtimes[0] != self.mtimes[0] else self.lda_file
+            print("WARNING only " + changed_file + " has changed, the new model is applied once both files are "
+                  "replaced")
+            return None
+
+        try:
+            csp = scipy.io.loadmat(self.csp_file)['csp_filter']
+            lda = scipy.io.loadmat(self.lda_file)['W']
+        except (OSError, ValueError, KeyError) as error:
+            print("ERROR the new model can not be loaded: " + str(error))
+            return None
+
+        if np.shape(csp)[1] != self.n_channels or np.shape(lda)[1] != np.shape(csp)[0] + 1:
+            print("ERROR the new CSP and LDA model do not match the enabled channels or each other")
+            return None
+
+        self.mtimes = mtimes
+        return csp, lda
+
+
+class Shareable:
+    """Base class of units whose arrays can be shared with worker processes.
+
+    Arrays allocated with `zeros` are placed in shared memory if the unit is shared. They stay shared when the unit is
+    passed to a worker process, because only the handles of the shared memory are pickled.
+
+    Parameters
+    ----------
+    shared: `bool`
+        Whether the arrays are placed in shared memory.
+
+    Other Parameters
+    ----------------
+    shared_memory: `dict`
+        Shared memory, shape and data type of each shared array.
+    """
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.shared_memory = {}
+
+    def zeros(self, name, shape, dtype=np.float64):
+        """Allocates an array filled with zeros as a member of the unit.
+
+        Parameters
+        ----------
+        name: `str`
+            Name of the member.
+        shape: `tuple`
+            Shape of the array.
+        dtype: `type`
+            Data type of the array.
+        """
+
+        if self.shared:
+            dtype = np.dtype(dtype)
+            raw = multiprocessing.RawArray('b', max(int(np.prod(shape)) * dtype.itemsize, 1))
+            self.shared_memory[name] = (raw, shape, dtype)
+            setattr(self, name, self.__map(name))
+        else:
+            setattr(self, name, np.zeros(shape, dtype=dtype))
+
+    def __map(self, name):
+        raw, shape, dtype = self.shared_memory[name]
+        return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self.shared_memory:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in self.shared_memory:
+            setattr(self, name, self.__map(name))
+
+
+class WarmStart:
+    """Warm start unit.
+
+    Collects the first eeg samples received by a worker, which prime its filters instead of only feeding them for
+    WARM_UP_DURATION seconds.
+
+    Parameters
+    ----------
+    n_samples: `int`
+        Number of samples which prime the filters.
+    n: `int`
+        Number of channels.
+    dtype: `type`
+        Data type of the samples.
+
+    Other Parameters
+    ----------------
+    data: `ndarray`
+        2-D array (samples x channels) of the collected samples.
+    n_collected: `int`
+        Number of samples collected so far.
+    """
+
+    def __init__(self, n_samples, n, dtype=np.float64):
+        self.n_samples = n_samples
+        self.n = n
+        self.data = np.zeros((self.n_samples, self.n), dtype=dtype)
+        self.n_collected = 0
+
+    @property
+    def is_complete(self):
+        return self.n_collected >= self.n_samples
+
+    def collect(self, x):
+        """Appends samples until all samples are collected.
+
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x channels).
+
+        Returns
+        -------
+        n_collected: `int`
+            Number of samples taken from the beginning of x (the remaining samples are filtered as usual).
+        """
+
+        n_collected = min(np.shape(x)[0], self.n_samples - self.n_collected)
+        self.data[self.n_collected:self.n_collected + n_collected] = x[:n_collected]
+        self.n_collected += n_collected
+
+        return n_collected
+
+
+class Decimator:
+    """Decimation unit.
+
+    Reduces feedback values computed for every eeg sample to the output rate. Each interval of (sample rate / output
+    rate) samples yields one value, with the time stamp of its last sample. The intervals are counted from the last
+    reset.
+
+    Parameters
+    ----------
+    sample_rate: `int`
+        Sample rate of the eeg signal.
+    output_rate: `int`
+        Number of values per second.
+    mode: `OutputDecimation`
+        Reduction of the values of an interval.
+
+    Other Parameters
+    ----------------
+    n_samples: `int`
+        Number of samples since the last reset.
+    carry: `ndarray`
+        Reduction of the samples of the current (incomplete) interval (None if there are none).
+    n_carry: `int`
+        Number of samples of the current interval.
+    """
+
+    def __init__(self, sample_rate, output_rate, mode=OutputDecimation.LATEST):
+        self.sample_rate = sample_rate
+        self.output_rate = output_rate
+        self.mode = mode
+        self.n_samples = 0
+        self.carry = None
+        self.n_carry = 0
+
+    def reset(self):
+        """Starts the first interval (e.g. at the beginning of the feedback period).
+        """
+
+        self.n_samples = 0
+        self.carry = None
+        self.n_carry = 0
+
+    def interval_ends(self, n_samples):
+        """Finds the samples of the next block which end an interval.
+
+        Parameters
+        ----------
+        n_samples: `int`
+            Number of samples of the block.
+
+        Returns
+        -------
+        ends: `ndarray`
+            1-D array of the indexes (within the block) of the last samples of the intervals.
+        """
+
+        n_intervals = np.arange(self.n_samples, self.n_samples + n_samples + 1) * self.output_rate // self.sample_rate
+        self.n_samples += n_samples
+        return np.flatnonzero(np.diff(n_intervals))
+
+    def reduce(self, x, ends):
+        """Reduces the values of a block to one value per interval which ends in the block.
+
+        Parameters
+        ----------
+        x: `ndarray`
+            Values of the block (1-D or 2-D array, samples first).
+        ends: `ndarray`
+            1-D array of the indexes of the last samples of the intervals (see `interval_ends`).
+
+        Returns
+        -------
+        y: `ndarray`
+            Values of the intervals (intervals first).
+        """
+
+        if self.mode == OutputDecimation.LATEST:
+            return x[ends]
+
+        ufunc = np.maximum if self.mode == OutputDecimation.MAX else np.add
+        n_samples = np.shape(x)[0]
+        n_ended = ends[-1] + 1 if np.shape(ends)[0] > 0 else 0
+
+        # Intervals which end in the block, the first one continues the current interval
+        y = ufunc.reduceat(x[:n_ended], np.concatenate(([0], ends[:-1] + 1)), axis=0) if n_ended > 0 else x[:0]
+        if n_ended > 0 and self.carry is not None:
+            y[0] = ufunc(y[0], self.carry)
+        if self.mode == OutputDecimation.MEAN and n_ended > 0:
+            n_values = np.diff(np.concatenate(([-1], ends)))
+            n_values[0] += self.n_carry
+            y = y / np.reshape(n_values, (-1,) + (1,) * (np.ndim(x) - 1))
+
+        # The remaining samples start the next interval
+        if n_ended > 0:
+            self.carry = None
+            self.n_carry = 0
+        if n_ended < n_samples:
+            carry = ufunc.reduce(x[n_ended:], axis=0)
+            self.carry = carry if self.carry is None else ufunc(self.carry, carry)
+            self.n_carry += n_samples - n_ended
+
+        return y
+
+
+class WarmUp(Shareable):
+    """Warm up unit.
+
+    Counts the eeg samples fed to the filters of a worker after starting the feedback model and measures the
+    processing latency (time between the time stamp of a block and the end of its processing) meanwhile.
+
+    Parameters
+    ----------
+    n_samples: `int`
+        Number of samples to feed to the filters.
+    shared: `bool`
+        Whether the unit is shared with a worker process.
+
+    Other Parameters
+    ----------------
+    n_fed: `ndarray`
+        Number of samples fed so far (single element array).
+    event: `Event object`
+        Set as soon as all samples are fed.
+    n_blocks: `ndarray`
+        Number of blocks fed so far (single element array).
+    latency_sum: `ndarray`
+        Sum of the processing latencies (single element array).
+    latency_max: `ndarray`
+        Maximum processing latency (single element array).
+    """
+
+    def __init__(self, n_samples, shared=False):
+        super().__init__(shared)
+        self.n_samples = n_samples
+        self.zeros('n_fed', (1,), dtype=np.int64)
+        self.event = multiprocessing.Event() if shared else threading.Event()
+        self.zeros('n_blocks', (1,), dtype=np.int64)
+        self.zeros('latency_sum', (1,))
+        self.zeros('latency_max', (1,))
+
+    def feed(self, timestamps):
+        """Counts a processed block of samples.
+
+        Parameters
+        ----------
+        timestamps: `ndarray`
+            1-D array of the time stamps of the samples.
+        """
+
+        latency = local_clock() - timestamps[-1]
+        self.n_blocks[0] += 1
+        self.latency_sum[0] += latency
+        self.latency_max[0] = max(self.latency_max[0], latency)
+
+        self.n_fed[0] += np.shape(timestamps)[0]
+        if self.n_fed[0] >= self.n_samples:
+            self.event.set()
+
+    def latency_summary(self):
+        """Summarizes the measured processing latency.
+
+        Returns
+        -------
+        summary: `str`
+            Mean and maximum latency in milliseconds.
+        """
+
+        if self.n_blocks[0] == 0:
+            return "no blocks processed"
+
+        return "mean %.2f ms, max %.2f ms" % (1000 * self.latency_sum[0] / self.n_blocks[0], 1000 * self.latency_max[0])
+
+
+class LatencyHistogram(Shareable):
+    """Latency histogram unit.
+
+    Counts the latencies of the feedback (time between the time stamp of an eeg sample and the push of the feedback
+    computed from it) in logarithmic bins, so recording a block costs only a few operations. The counters are updated
+    and reset under a lock, because they are recorded by a worker (thread or process) and read by the main thread.
+
+    Parameters
+    ----------
+    shared: `bool`
+        Whether the unit is shared with a worker process.
+
+    Other Parameters
+    ----------------
+    edges: `ndarray`
+        1-D array of the upper edges of the bins (the last bin also counts all larger latencies).
+    counts: `ndarray`
+        1-D array of the number of samples per bin.
+    latency_max: `ndarray`
+        Maximum latency (single element array).
+    lock: `RLock`
+        Lock of the counters (reentrant, because the main thread also reads them in a signal handler).
+    """
+
+    def __init__(self, shared=False):
+        super().__init__(shared)
+        n_bins = LATENCY_HISTOGRAM_BINS_PER_DECADE * LATENCY_HISTOGRAM_DECADES
+        self.edges = LATENCY_HISTOGRAM_MIN * 10 ** (np.arange(1, n_bins + 1) / LATENCY_HISTOGRAM_BINS_PER_DECADE)
+        self.zeros('counts', (n_bins,), dtype=np.int64)
+        self.zeros('latency_max', (1,))
+        self.lock = multiprocessing.RLock() if shared else threading.RLock()
+
+    def record(self, timestamps):
+        """Records the latency of pushed feedback samples.
+
+        Parameters
+        ----------
+        timestamps: `ndarray`
+            1-D array of the time stamps of the eeg samples the feedback was computed from.
+        """
+
+        latency = local_clock() - timestamps
+
+        idx = np.log10(np.maximum(latency, LATENCY_HISTOGRAM_MIN) / LATENCY_HISTOGRAM_MIN)
+        idx = np.minimum((idx * LATENCY_HISTOGRAM_BINS_PER_DECADE).astype(int), np.shape(self.counts)[0] - 1)
+
+        with self.lock:
+            np.add.at(self.counts, idx, 1)
+            self.latency_max[0] = max(self.latency_max[0], np.max(latency))
+
+    def read(self):
+        """Reads the latency statistics and restarts the recording.
+
+        Returns
+        -------
+        n_samples: `int`
+            Number of recorded samples.
+        p50: `float`
+            Median latency (upper edge of its bin) or nan if no sample was recorded.
+        p99: `float`
+            99th percentile of the latency (upper edge of its bin) or nan if no sample was recorded.
+        latency_max: `float`
+            Maximum latency or nan if no sample was recorded.
+        """
+
+        with self.lock:
+            counts = self.counts.copy()
+            self.counts[:] = 0
+            latency_max = self.latency_max[0]
+            self.latency_max[0] = 0
+
+        n_samples = int(np.sum(counts))
+        if n_samples == 0:
+            return 0, np.nan, np.nan, np.nan
+
+        cum_counts = np.cumsum(counts)
+        p50 = self.edges[np.searchsorted(cum_counts, math.ceil(0.5 * n_samples))]
+        p99 = self.edges[np.searchsorted(cum_counts, math.ceil(0.99 * n_samples))]
+
+        return n_samples, p50, p99, latency_max
+
+
+class StageTimer(Shareable):
+    """Stage timer unit.
+
+    Cumulative timing counters (time in nanoseconds and number of calls) of processing stages.
+
+    Parameters
+    ----------
+    stages: `list`
+        Names of the stages.
+    shared: `bool`
+        Whether the counters are shared with worker processes.
+
+    Other Parameters
+    ----------------
+    idx_stages: `dict`
+        Index of each stage in the counters.
+    time_ns: `ndarray`
+        1-D array of the cumulative time of each stage.
+    n_calls: `ndarray`
+        1-D array of the number of calls of each stage.
+    """
+
+    def __init__(self, stages, shared=False):
+        super().__init__(shared)
+        self.stages = stages
+        self.idx_stages = {stage: idx for idx, stage in enumerate(stages)}
+        self.zeros('time_ns', (len(stages),), dtype=np.int64)
+        self.zeros('n_calls', (len(stages),), dtype=np.int64)
+
+    def count(self, stage, start_ns):
+        """Adds the time since the start of a stage to its counter.
+
+        Parameters
+        ----------
+        stage: `str`
+            Name of the stage.
+        start_ns: `int`
+            Start of the stage (`time.perf_counter_ns()`).
+
+        Returns
+        -------
+        stop_ns: `int`
+            End of the stage, which is the start of the next stage.
+        """
+
+        stop_ns = time.perf_counter_ns()
+        idx = self.idx_stages[stage]
+        self.time_ns[idx] += stop_ns - start_ns
+        self.n_calls[idx] += 1
+
+        return stop_ns
+
+    def summary(self):
+        """Summarizes the counters.
+
+        Returns
+        -------
+        summary: `str`
+            Number of calls, mean time per call (in microseconds) and total time (in milliseconds) of each stage.
+        """
+
+        summaries = []
+        for idx, stage in enumerate(self.stages):
+            n_calls = self.n_calls[idx]
+            mean_us = self.time_ns[idx] / n_calls / 1000 if n_calls > 0 else 0
+            summaries.append("%s %d calls, %.1f us/call, %.1f ms" % (stage, n_calls, mean_us, self.time_ns[idx] / 1e6))
+
+        return "; ".join(summaries)
+
+
+class StateTimeline(Shareable):
+    """State timeline unit.
+
+    Records the state changes of the BCI together with the time stamps of the markers which caused them, so the
+    workers can look up the state of each sample by its time stamp. The changes are kept in a ring of preallocated
+    arrays. A change is written before the counter is incremented, so the workers read the timeline without a lock
+    (also from a worker process, if the timeline is shared).
+
+    Samples which were already processed are not processed again, if a marker arrives after them: they keep the state
+    which was recorded when they were processed, only the following samples get the new state. So the state of each
+    sample only depends on the time stamps (and not on the block size and the timing of the threads) if the markers
+    arrive before the samples they apply to are processed, e.g. when an xdf file is replayed. Online, the state changes
+    are delayed by the marker latency (usually a few milliseconds).
+
+    Parameters
+    ----------
+    capacity: `int`
+        Maximum number of state changes kept.
+    state: `enum`
+        Initial state of the BCI.
+    shared: `bool`
+        Whether the unit is shared with worker processes.
+
+    Other Parameters
+    ----------------
+    times: `ndarray`
+        1-D array of the time stamps of the state changes.
+    states: `ndarray`
+        1-D array of the states (values of `BCIState`).
+    n_changes: `ndarray`
+        Total number of recorded state changes (single element array).
+    """
+
+    def __init__(self, capacity, state, shared=False):
+        super().__init__(shared)
+        self.capacity = capacity
+        self.zeros('times', (self.capacity,))
+        self.zeros('states', (self.capacity,), dtype=np.int64)
+        self.zeros('n_changes', (1,), dtype=np.int64)
+
+        self.times[0] = -np.inf
+        self.states[0] = state.value
+        self.n_changes[0] = 1
+
+    @property
+    def state(self):
+        return BCIState(int(self.states[(self.n_changes[0] - 1) % self.capacity]))
+
+    def set_state(self, state, timestamp):
+        """Records a state change. Must only be called by a single thread.
+
+        Parameters
+        ----------
+        state: `enum`
+            The new state.
+        timestamp: `float`
+            Time stamp from which on the new state applies.
+        """
+
+        n_changes = self.n_changes[0]
+
+        # The time stamps must be sorted (they may jitter if the markers come from another machine)
+        timestamp = max(timestamp, self.times[(n_changes - 1) % self.capacity])
+
+        self.times[n_changes % self.capacity] = timestamp
+        self.states[n_changes % self.capacity] = state.value
+        self.n_changes[0] = n_changes + 1
+
+    def segments(self, timestamps):
+        """Splits a block of samples into segments of constant state.
+
+        Parameters
+        ----------
+        timestamps: `ndarray`
+            1-D array of the (sorted) time stamps of the samples.
+
+        Returns
+        -------
+        segments: `list`
+            Tuples of the start index, the stop index and the state of each segment.
+        """
+
+        # The oldest slot is skipped, because it is overwritten by the next state change
+        n_changes = self.n_changes[0]
+        idx_ring = np.arange(max(n_changes - self.capacity + 1, 0), n_changes) % self.capacity
+        times = self.times[idx_ring]
+        states = self.states[idx_ring]
+
+        idx = np.searchsorted(times, timestamps, side='right') - 1
+
+        # Samples before the oldest kept state change get the oldest state
+        np.maximum(idx, 0, out=idx)
+
+        if idx[0] == idx[-1]:
+            return [(0, np.shape(idx)[0], BCIState(int(states[idx[0]])))]
+
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(idx)) + 1, [np.shape(idx)[0]]))
+        return [(bounds[i], bounds[i + 1], BCIState(int(states[idx[bounds[i]]])))
+                for i in range(np.shape(bounds)[0] - 1)]
+
+
+class RingBuffer(Shareable):
+    """Ring buffer unit.
+
+    Preallocated buffer for eeg samples which is written by a single producer and read by multiple consumers. Each
+    consumer reads the samples via its own cursor (see `RingBufferCursor`), so all consumers get the same sample
+    sequence. If the buffer is shared, the consumers may run in worker processes.
+
+    Parameters
+    ----------
+    capacity: `int`
+        Maximum number of samples held in the buffer.
+    n: `int`
+        Number of channels.
+    shared: `bool`
+        Whether the buffer is shared with worker processes.
+    dtype: `type`
+        Data type of the buffered samples.
+
+    Other Parameters
+    ----------------
+    data: `ndarray`
+        2-D array (capacity x channels) of the buffered samples.
+    timestamps: `ndarray`
+        1-D array of the time stamps of the buffered samples.
+    n_written: `ndarray`
+        Total number of samples written to the buffer (single element array).
+    condition: `Condition object`
+        Notifies the consumers about new samples.
+    """
+
+    def __init__(self, capacity, n, shared=False, dtype=np.float64):
+        super().__init__(shared)
+        self.capacity = int(capacity)
+        self.n = n
+        self.zeros('data', (self.capacity, self.n), dtype=dtype)
+        self.zeros('timestamps', (self.capacity,))
+        self.zeros('n_written', (1,), dtype=np.int64)
+        self.condition = multiprocessing.Condition() if shared else threading.Condition()
+
+    def write(self, x, timestamps):
+        """Appends samples to the buffer and notifies the consumers.
+
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x channels).
+        timestamps: `list`
+            Time stamps of the samples.
+        """
+
+        n_samples = np.shape(x)[0]
+        if n_samples > self.capacity:
+            x = x[-self.capacity:]
+            timestamps = timestamps[-self.capacity:]
+            self.n_written[0] += n_samples - self.capacity
+            n_samples = self.capacity
+
+        pos = self.n_written[0] % self.capacity
+        n_first = min(n_samples, self.capacity - pos)
+        self.data[pos:pos + n_first] = x[:n_first]
+        self.data[:n_samples - n_first] = x[n_first:]
+        self.timestamps[pos:pos + n_first] = timestamps[:n_first]
+        self.timestamps[:n_samples - n_first] = timestamps[n_first:]
+
+        with self.condition:
+            self.n_written[0] += n_samples
+            self.condition.notify_all()
+
+    def cursor(self, block_size):
+        """Creates a new read cursor, starting at the most recent sample.
+
+        Parameters
+        ----------
+        block_size: `int`
+            Maximum number of samples returned per read.
+
+        Returns
+        -------
+        cursor: `RingBufferCursor`
+            Read cursor of the buffer.
+        """
+
+        return RingBufferCursor(self, block_size)
+
+
+class RingBufferCursor:
+    """Read cursor of a ring buffer.
+
+    Parameters
+    ----------
+    ring_buffer: `RingBuffer instance`
+        The buffer to read from.
+    block_size: `int`
+        Maximum number of samples returned per read.
+
+    Other Parameters
+    ----------------
+    position: `int`
+        Total number of samples read by this cursor.
+    block: `ndarray`
+        2-D array (block size x channels) the samples are copied to.
+    timestamps: `ndarray`
+        1-D array the time stamps are copied to.
+    n_dropped: `int`
+        Number of samples which were overwritten before the cursor read them.
+    """
+
+    def __init__(self, ring_buffer, block_size):
+        self.ring_buffer = ring_buffer
+        self.block_size = block_size
+        self.position = int(ring_buffer.n_written[0])
+        self.block = np.zeros((self.block_size, ring_buffer.n), dtype=ring_buffer.data.dtype)
+        self.timestamps = np.zeros((self.block_size,))
+        self.n_dropped = 0
+
+    def read(self, timeout):
+        """Reads the next block of samples.
+
+        Waits until `block_size` samples are available (or the timeout expired).
+
+        Parameters
+        ----------
+        timeout: `float`
+            Maximum time (in seconds) to wait for the samples.
+
+        Returns
+        -------
+        block: `ndarray`
+            2-D array (samples x channels) or None if no sample is available. The array is reused by the next read.
+        timestamps: `ndarray`
+            1-D array of the time stamps of the samples.
+        """
+
+        rb = self.ring_buffer
+        with rb.condition:
+            rb.condition.wait_for(lambda: rb.n_written[0] - self.position >= self.block_size, timeout)
+            n_written = int(rb.n_written[0])
+
+        # The consumer is too slow: skip the samples which were already overwritten
+        if n_written - self.position > rb.capacity - self.block_size:
+            n_skip = n_written - self.position - (rb.capacity - self.block_size)
+            self.position += n_skip
+            self.n_dropped += n_skip
+            print("WARNING " + str(n_skip) + " eeg samples were dropped")
+
+        n_samples = min(n_written - self.position, self.block_size)
+        if n_samples == 0:
+            return None, None
+
+        pos = self.position % rb.capacity
+        n_first = min(n_samples, rb.capacity - pos)
+        self.block[:n_first] = rb.data[pos:pos + n_first]
+        self.block[n_first:n_samples] = rb.data[:n_samples - n_first]
+        self.timestamps[:n_first] = rb.timestamps[pos:pos + n_first]
+        self.timestamps[n_first:n_samples] = rb.timestamps[:n_samples - n_first]
+        self.position += n_samples
+
+        return self.block[:n_samples], self.timestamps[:n_samples]
+
+
+class ReferenceBuffer:
+    """Reference buffer unit.
+
+    Keeps a running sum of the eeg data of the reference period for the computation of the mean (the samples
+    themselves are not stored).
+
+    Parameters
+    ----------
+    n: `int`
+        Number of channels.
+    idx_start: `int`
+        Number of samples at the beginning of the reference period which are not considered for the mean.
+
+    Other Parameters
+    ----------------
+    n_samples: `int`
+        Number of samples appended since the last reset.
+    sum: `ndarray`
+        1-D array of the sum of the considered samples for each channel.
+    """
+
+    def __init__(self, n, idx_start):
+        self.n = n
+        self.idx_start = idx_start
+        self.n_samples = 0
+        self.sum = np.zeros((self.n,))
+
+    def reset(self):
+        """Clears the buffer after each trial.
+        """
+
+        self.n_samples = 0
+        self.sum[:] = 0
+
+    def append(self, x):
+        """Adds samples to the running sum.
+
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x channels).
+        """
+
+        n_samples = np.shape(x)[0]
+
+        idx_start = max(self.idx_start - self.n_samples, 0)
+        if idx_start < n_samples:
+            self.sum += np.sum(x[idx_start:], axis=0)
+
+        self.n_samples += n_samples
+
+    def mean(self):
+        """Computes the mean of the considered samples.
+
+        Returns
+        -------
+        mean: `ndarray`
+            1-D array of the mean for each channel.
+        """
 
-        return np.log10(x_filt)
+        return self.sum / (self.n_samples - self.idx_start)
@@ -0,0 +1,208 @@
+"""
+Benchmarks the signal processing units of the feedback model with synthetic eeg data.
+"""
+
+import json
+import numpy as np
+import platform
+import scipy
+import time
+
+import bciutils
+
+# Duration (in seconds) of the synthetic eeg data processed per measurement
+BENCHMARK_DURATION = 2
+
+# Number of blocks processed before a measurement (e.g. to allocate the work buffers)
+WARM_UP_BLOCKS = 10
+
+# Number of CSP filters (features of the LDA)
+N_CSP = 4
+
+# Number of pipelines (CSP and LDA models) of the batched BCI core
+N_BATCHED = 4
+
+
+def measure(function, blocks):
+    """Measures the latency of each call of a function and the throughput.
+
+    Parameters
+    ----------
+    function: `function`
+        Processes a block of samples.
+    blocks: `list`
+        Blocks (2-D arrays, samples x channels) passed to the function one after the other.
+
+    Returns
+    -------
+    result: `dict`
+        Number of calls, throughput (samples per second) and latency (in microseconds) of the calls.
+    """
+
+    for block in blocks[:WARM_UP_BLOCKS]:
+        function(block)
+
+    latency_ns = np.zeros((len(blocks),), dtype=np.int64)
+    for i, block in enumerate(blocks):
+        start_ns = time.perf_counter_ns()
+        function(block)
+        latency_ns[i] = time.perf_counter_ns() - start_ns
+
+    n_samples = sum(np.shape(block)[0] for block in blocks)
+    latency_us = latency_ns / 1000
+
+    return {'n_calls': len(blocks),
+            'samples_per_second': n_samples / (np.sum(latency_ns) / 1e9),
+            'latency_us': {'mean': np.mean(latency_us), 'p50': np.percentile(latency_us, 50),
+                           'p99': np.percentile(latency_us, 99), 'max': np.max(latency_us)}}
+
+
+def split_blocks(x, block_size):
+    """Splits data into blocks of consecutive samples.
+
+    Parameters
+    ----------
+    x: `ndarray`
+        2-D array (samples x channels).
+    block_size: `int`
+        Number of samples per block.
+
+    Returns
+    -------
+    blocks: `list`
+        Blocks of the data (views).
+    """
+
+    return [x[start:start + block_size] for start in range(0, np.shape(x)[0] - block_size + 1, block_size)]
+
+
+def create_bci_core(sample_rate, n_channels, pipeline_order, rng, dtype=np.float64):
+    """Creates a BCI core with random CSP and LDA coefficients.
+
+    Parameters
+    ----------
+    sample_rate: `int`
+        Sample rate of the eeg signal.
+    n_channels: `int`
+        Number of eeg channels.
+    pipeline_order: `PipelineOrder`
+        Order of the bandpass and the CSP filter.
+    rng: `Generator`
+        Random number generator.
+    dtype: `type`
+        Data type of the signal processing.
+
+    Returns
+    -------
+    bci_core: `BCICore`
+        The BCI core.
+    """
+
+    s_rate_half = sample_rate / 2
+    n_bandpass = N_CSP if pipeline_order == bciutils.PipelineOrder.SPATIAL_FIRST else n_channels
+    bandpass_cl = bciutils.Bandpass(order=12, fstop=[3 / s_rate_half, 35 / s_rate_half],
+                                    fpass=[8 / s_rate_half, 30 / s_rate_half], n=n_bandpass, dtype=dtype)
+    log_band_power = bciutils.RunningLogBandPower(window_length=sample_rate, n=N_CSP, dtype=dtype)
+
+    return bciutils.BCICore(sample_rate=sample_rate, bandpass_cl=bandpass_cl, bandpass_erds=None,
+                            csp=rng.standard_normal((N_CSP, n_channels)), lda=rng.standard_normal((2, N_CSP + 1)),
+                            log_band_power=log_band_power, pipeline_order=pipeline_order)
+
+
+def run_benchmarks(channels, sample_rates, block_sizes):
+    """Runs the benchmarks of all units for all combinations of the settings.
+
+    Parameters
+    ----------
+    channels: `list`
+        Numbers of eeg channels.
+    sample_rates: `list`
+        Sample rates of the eeg signal.
+    block_sizes: `list`
+        Numbers of samples processed at once.
+
+    Returns
+    -------
+    results: `list`
+        One result (see `measure`) per unit and setting. Units which do not depend on the number of channels are only
+        measured once per sample rate and block size (with channels None).
+    """
+
+    rng = np.random.default_rng(0)
+    results = []
+
+    for sample_rate in sample_rates:
+        s_rate_half = sample_rate / 2
+        for block_size in block_sizes:
+            features = rng.standard_normal((BENCHMARK_DURATION * sample_rate, N_CSP))
+            units = {'LogBandPower': bciutils.LogBandPower(window_length=sample_rate, n=N_CSP).compute_log_band_power,
+                     'RunningLogBandPower': bciutils.RunningLogBandPower(window_length=sample_rate,
+                                                                         n=N_CSP).compute_log_band_power,
+                     'BCICore.lda_predict': create_bci_core(sample_rate, N_CSP, bciutils.PipelineOrder.BANDPASS_FIRST,
+                                                            rng).lda_predict}
+            for unit, function in units.items():
+                results.append(dict(unit=unit, channels=None, sample_rate=sample_rate, block_size=block_size,
+                                    **measure(function, split_blocks(features, block_size))))
+
+            for n_channels in channels:
+                eeg = rng.standard_normal((BENCHMARK_DURATION * sample_rate, n_channels)) * 10
+                bandpass = bciutils.Bandpass(order=12, fstop=[3 / s_rate_half, 35 / s_rate_half],
+                                             fpass=[8 / s_rate_half, 30 / s_rate_half], n=n_channels)
+                bci_core = create_bci_core(sample_rate, n_channels, bciutils.PipelineOrder.BANDPASS_FIRST, rng)
+                bci_core_spatial = create_bci_core(sample_rate, n_channels, bciutils.PipelineOrder.SPATIAL_FIRST, rng)
+                batched_bci_core = bciutils.BatchedBCICore([create_bci_core(sample_rate, n_channels,
+                                                                            bciutils.PipelineOrder.SPATIAL_FIRST, rng)
+                                                            for _ in range(N_BATCHED)])
+                bandpass_state_space = bciutils.Bandpass(order=12, fstop=[3 / s_rate_half, 35 / s_rate_half],
+                                                         fpass=[8 / s_rate_half, 30 / s_rate_half], n=n_channels,
+                                                         backend=bciutils.FilterBackend.STATE_SPACE)
+                units = {'Bandpass': bandpass.bandpass_filter,
+                         'Bandpass (state-space)': bandpass_state_space.bandpass_filter,
+                         'BCICore.csp_filter': bci_core.csp_filter,
+                         'BCICore.process (bandpass-first)': bci_core.process,
+                         'BCICore.process (spatial-first)': bci_core_spatial.process,
+                         'BatchedBCICore.process (spatial-first, %d models)' % N_BATCHED: batched_bci_core.process}
+                for unit, function in units.items():
+                    results.append(dict(unit=unit, channels=n_channels, sample_rate=sample_rate,
+                                        block_size=block_size, **measure(function, split_blocks(eeg, block_size))))
+
+                result = results[-3]
+                print("INFO %d channels, %d Hz, block size %d: full chain %.0f samples/s (%.1f x real time), "
+                      "p99 latency %.1f us" % (n_channels, sample_rate, block_size, result['samples_per_second'],
+                                               result['samples_per_second'] / sample_rate,
+                                               result['latency_us']['p99']))
+
+                # Single precision (the eeg buffer holds float32 samples as well)
+                bci_core_single = create_bci_core(sample_rate, n_channels, bciutils.PipelineOrder.SPATIAL_FIRST, rng,
+                                                  dtype=np.float32)
+                results.append(dict(unit='BCICore.process (spatial-first, float32)', channels=n_channels,
+                                    sample_rate=sample_rate, block_size=block_size,
+                                    **measure(bci_core_single.process,
+                                              split_blocks(eeg.astype(np.float32), block_size))))
+
+    return results
+
+
+if __name__ == "__main__":
+
+    # ------------- Benchmark settings -------------
+    channels = [8, 16, 32, 64, 128, 256]
+    sample_rates = [250, 500, 1000, 2000]
+    block_sizes = [1, 10, 100]
+    result_file = 'benchmark.json'
+    # ----------------------------------------------
+
+    results = run_benchmarks(channels, sample_rates, block_sizes)
+
+    # The environment is saved with the results, to compare versions and hardware
+    benchmark = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                 'platform': platform.platform(),
+                 'processor': platform.processor(),
+                 'python': platform.python_version(),
+                 'numpy': np.__version__,
+                 'scipy': scipy.__version__,
+                 'results': results}
+
+    with open(result_file, 'w') as json_file:
+        json.dump(benchmark, json_file, indent=4)
+    print("INFO results saved to " + result_file)
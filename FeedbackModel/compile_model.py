@@ -0,0 +1,158 @@
+"""
+Compiles the feedback model (filter coefficients, initial filter conditions, CSP and LDA coefficients) into a single
+.npz file. The feedback model loads this file at startup instead of reading the .mat files and designing the filters.
+"""
+
+import hashlib
+import json
+import numpy as np
+import os
+import scipy.io
+
+import bciutils
+
+# Version of the compiled model (part of the key, so a changed format is compiled again)
+MODEL_VERSION = 1
+
+
+def compute_model_key(file_paths, sample_rate):
+    """Computes the key of a compiled model (hash of the configuration and model files and the sample rate).
+
+    Parameters
+    ----------
+    file_paths: `list`
+        Paths of the files the model is compiled from (bci configuration, CSP and LDA).
+    sample_rate: `int`
+        Sample rate of the eeg signal.
+
+    Returns
+    -------
+    key: `str`
+        Hexadecimal SHA-256 hash.
+    """
+
+    sha256 = hashlib.sha256()
+    sha256.update(("%d %d" % (MODEL_VERSION, sample_rate)).encode())
+    for file_path in file_paths:
+        with open(file_path, 'rb') as file:
+            sha256.update(file.read())
+
+    return sha256.hexdigest()
+
+
+def compile_model(config, sample_rate, csp_filter, lda_coef, key):
+    """Computes the coefficients and initial conditions of the bandpass filters.
+
+    Parameters
+    ----------
+    config: `dict`
+        BCI configuration.
+    sample_rate: `int`
+        Sample rate of the eeg signal.
+    csp_filter: `ndarray`
+        Common spatial pattern (2-D array).
+    lda_coef: `ndarray`
+        Linear discriminant analysis coefficients (2-D array).
+    key: `str`
+        Key of the model (see `compute_model_key`).
+
+    Returns
+    -------
+    model: `dict`
+        The compiled model (arrays).
+    """
+
+    s_rate_half = sample_rate / 2
+    model = {'key': np.array(key), 'csp': csp_filter, 'lda': lda_coef}
+
+    for name, settings in [('cl', config['feedback-model-settings']['bandpass']),
+                           ('erds', config['feedback-model-settings']['bandpass-erds'])]:
+        bandpass = bciutils.Bandpass(order=settings['order'], fstop=[freq / s_rate_half for freq in settings['fstop']],
+                                     fpass=[freq / s_rate_half for freq in settings['fpass']], n=1)
+        model['sos_' + name] = bandpass.sos
+        model['zi_' + name] = bandpass.zi[0]
+
+    return model
+
+
+def load_model(file_path, key):
+    """Loads a compiled model.
+
+    Parameters
+    ----------
+    file_path: `str`
+        Path of the .npz file.
+    key: `str`
+        Expected key of the model.
+
+    Returns
+    -------
+    model: `dict`
+        The compiled model or None if the file does not exist or was compiled from other files.
+    """
+
+    if not os.path.isfile(file_path):
+        return None
+
+    with np.load(file_path) as data:
+        if str(data['key']) != key:
+            return None
+        return {name: data[name] for name in data.files}
+
+
+def load_or_compile_model(config, sample_rate, config_file, csp_file, lda_file, model_file):
+    """Loads the compiled model, or compiles and saves it if it is missing or out of date.
+
+    Parameters
+    ----------
+    config: `dict`
+        BCI configuration.
+    sample_rate: `int`
+        Sample rate of the eeg signal.
+    config_file: `str`
+        Path of the bci configuration file.
+    csp_file: `str`
+        Path of the CSP .mat file.
+    lda_file: `str`
+        Path of the LDA .mat file.
+    model_file: `str`
+        Path of the compiled model (.npz file).
+
+    Returns
+    -------
+    model: `dict`
+        The compiled model.
+    """
+
+    key = compute_model_key([config_file, csp_file, lda_file], sample_rate)
+    model = load_model(model_file, key)
+    if model is not None:
+        return model
+
+    print("INFO compiling the model to " + model_file)
+    csp_filter = scipy.io.loadmat(csp_file)['csp_filter']
+    lda_coef = scipy.io.loadmat(lda_file)['W']
+    model = compile_model(config, sample_rate, csp_filter, lda_coef, key)
+
+    # Uncompressed, so loading the model is a plain read of the arrays
+    np.savez(model_file, **model)
+
+    return model
+
+
+if __name__ == "__main__":
+
+    cwd = os.getcwd()
+    config_file = cwd + '/../bci-config.json'
+    csp_file = 'data/CSP_LDA/csp.mat'
+    lda_file = 'data/CSP_LDA/lda.mat'
+    model_file = 'data/CSP_LDA/model.npz'
+
+    # Read BCI Configuration
+    with open(config_file) as json_file:
+        config = json.load(json_file)
+
+    # The model is compiled for the sample rate of the configuration (it is compiled again at startup of the feedback
+    # model if the eeg stream has another sample rate)
+    load_or_compile_model(config, config['eeg-settings']['sample-rate'], config_file, csp_file, lda_file, model_file)
+    print("INFO model " + model_file + " is up to date")
@@ -0,0 +1,239 @@
+"""
+EEG Feedback Engine
+Runs the feedback model on one asyncio event loop instead of threads: eeg ingestion, marker handling, classification
+and ERDS computation are cooperative tasks.
+"""
+
+import asyncio
+import json
+import numpy as np
+import os
+from pylsl import local_clock
+import time
+
+import bciutils
+from compile_model import load_or_compile_model
+from feedback_model import create_bci_core
+
+# Maximum number of eeg samples pulled at once
+MAX_PULL_SAMPLES = 1024
+
+# Time (in seconds) between two polls of the eeg inlet if no samples were received
+EEG_POLL_INTERVAL = 0.001
+
+# Time (in seconds) between two polls of the marker inlet (and of the warm-up and the resolution of the marker stream)
+MARKER_POLL_INTERVAL = 0.005
+
+
+class Session:
+    """Feedback session unit.
+
+    One feedback model (eeg inlet, marker inlet, classification and ERDS worker and feedback outlets) run by
+    cooperative tasks on the event loop. The inlets are polled without blocking, the received eeg samples are passed
+    to the classification and ERDS task by queues. The queues hold at most RING_BUFFER_DURATION seconds of eeg data,
+    if a task falls behind the oldest blocks are dropped (like in the ring buffer of the threaded feedback model).
+    Several sessions can run on the same event loop.
+
+    Parameters
+    ----------
+    name: `str`
+        Name of the session.
+    bci_model: `BCI instance`
+        The BCI model with its BCI core (created in thread execution mode and without own feedback loop).
+
+    Other Parameters
+    ----------------
+    worker_cl: `ClassificationWorker instance`
+        Classification worker.
+    worker_erds: `ERDSWorker instance`
+        ERDS worker.
+    queue_cl: `Queue`
+        Blocks of eeg samples (with their time stamps) for the classification task.
+    queue_erds: `Queue`
+        Blocks of eeg samples (with their time stamps) for the ERDS task.
+    inlet_marker: `StreamInlet`
+        Inlet of the marker stream (opened by the marker task).
+    """
+
+    def __init__(self, name, bci_model):
+        self.name = name
+        self.bci_model = bci_model
+        self.worker_cl, self.worker_erds = self.bci_model.create_workers()
+        self.queue_cl = None
+        self.queue_erds = None
+        self.inlet_marker = None
+
+    async def run(self):
+        """Runs the tasks of the session until one of them fails or the session is cancelled, then stops the other
+        tasks and closes the inlets.
+        """
+
+        # The queues belong to the running event loop
+        max_blocks = max(bciutils.RING_BUFFER_DURATION * self.bci_model.sample_rate // self.bci_model.block_size, 1)
+        self.queue_cl = asyncio.Queue(maxsize=max_blocks)
+        self.queue_erds = asyncio.Queue(maxsize=max_blocks)
+
+        tasks = [asyncio.ensure_future(task) for task in [self.__receive_eeg(), self.__handle_markers(),
+                                                          self.__classify(), self.__compute_erds()]]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            self.bci_model.inlet_eeg.close_stream()
+            if self.inlet_marker is not None:
+                self.inlet_marker.close_stream()
+            print("INFO " + self.name + ": session stopped")
+
+    async def __receive_eeg(self):
+        """Polls the eeg inlet and passes the received samples in blocks to the classification and ERDS task.
+        """
+
+        inlet_eeg = self.bci_model.inlet_eeg
+        chunk = np.zeros((MAX_PULL_SAMPLES, inlet_eeg.channel_count), dtype=np.dtype(inlet_eeg.value_type))
+        block_size = self.bci_model.block_size
+
+        while True:
+            _, timestamps = inlet_eeg.pull_chunk(timeout=0.0, max_samples=MAX_PULL_SAMPLES, dest_obj=chunk)
+            if not timestamps:
+                await asyncio.sleep(EEG_POLL_INTERVAL)
+                continue
+
+            n_samples = len(timestamps)
+            eeg = chunk[:n_samples, self.bci_model.idx_enabled_channels].astype(self.bci_model.dtype)
+            timestamps = np.array(timestamps)
+
+            for start in range(0, n_samples, block_size):
+                stop = min(start + block_size, n_samples)
+                put_block(self.queue_cl, eeg[start:stop], timestamps[start:stop])
+                put_block(self.queue_erds, eeg[start:stop], timestamps[start:stop])
+
+            # Lets the classification and ERDS task process the blocks
+            await asyncio.sleep(0)
+
+    async def __handle_markers(self):
+        """Waits for the warm-up, then polls the marker inlet and sets the BCI state accordingly.
+        """
+
+        # The marker stream is resolved in the background (until unity is started), so the task can be cancelled
+        # meanwhile
+        while not self.bci_model.resolver.is_resolved(self.bci_model.stream_marker['name']):
+            await asyncio.sleep(MARKER_POLL_INTERVAL)
+        self.inlet_marker = self.bci_model.open_marker_inlet()
+        outlet_diagnostics = self.bci_model.create_diagnostics_outlet()
+
+        start_time = local_clock()
+        start_cpu_time = time.process_time()
+        while not (self.bci_model.warm_up_cl.event.is_set() and self.bci_model.warm_up_erds.event.is_set()):
+            await asyncio.sleep(MARKER_POLL_INTERVAL)
+        self.bci_model.state_timeline.set_state(bciutils.BCIState.SLEEP, local_clock())
+
+        duration = local_clock() - start_time
+        print("INFO %s: warm-up finished after %.2f s (cpu load %.1f %%)"
+              % (self.name, duration, 100 * (time.process_time() - start_cpu_time) / duration))
+
+        while True:
+            marker, timestamp = self.inlet_marker.pull_sample(timeout=0.0)
+            if marker is None:
+                await asyncio.sleep(MARKER_POLL_INTERVAL)
+                continue
+
+            self.bci_model.handle_marker(marker[0], timestamp, outlet_diagnostics)
+
+    async def __classify(self):
+        """Classifies the blocks of eeg samples and sends the feedback.
+        """
+
+        outlet_fb_cl = self.worker_cl.create_outlet()
+        while True:
+            block, timestamps = await self.queue_cl.get()
+            self.worker_cl.process(block, timestamps, outlet_fb_cl)
+
+    async def __compute_erds(self):
+        """Computes the ERDS values of the blocks of eeg samples and sends the feedback.
+        """
+
+        outlet_fb_erds = self.worker_erds.create_outlet()
+        while True:
+            block, timestamps = await self.queue_erds.get()
+            self.worker_erds.process(block, timestamps, outlet_fb_erds)
+
+
+def put_block(queue, block, timestamps):
+    """Puts a block of eeg samples into a bounded queue without waiting. If the queue is full (the task reading it
+    falls behind), the oldest block is dropped.
+
+    Parameters
+    ----------
+    queue: `Queue`
+        Queue of the blocks of eeg samples (with their time stamps).
+    block: `ndarray`
+        2-D array (samples x enabled channels) of raw eeg data.
+    timestamps: `ndarray`
+        1-D array of the time stamps of the samples.
+    """
+
+    if queue.full():
+        block_dropped, _ = queue.get_nowait()
+        print("WARNING " + str(np.shape(block_dropped)[0]) + " eeg samples were dropped")
+
+    queue.put_nowait((block, timestamps))
+
+
+async def run_session(session):
+    """Runs a session and reports its failure, so the other sessions keep running.
+
+    Parameters
+    ----------
+    session: `Session instance`
+        The session.
+    """
+
+    try:
+        await session.run()
+    except Exception as error:
+        print("ERROR %s: session failed (%s: %s)" % (session.name, type(error).__name__, error))
+
+
+async def run_sessions(sessions):
+    """Runs several sessions on the event loop until all of them are stopped. A failing session does not stop the
+    others.
+
+    Parameters
+    ----------
+    sessions: `list`
+        The sessions.
+    """
+
+    await asyncio.gather(*[run_session(session) for session in sessions])
+
+
+if __name__ == "__main__":
+
+    cwd = os.getcwd()
+    config_file = cwd + '/../bci-config.json'
+
+    # Read BCI Configuration
+    with open(config_file) as json_file:
+        config = json.load(json_file)
+
+    # All tasks run on the event loop
+    config['feedback-model-settings']['execution-mode'] = bciutils.ExecutionMode.THREAD
+
+    # Initialize the BCI model (resolves the eeg stream) like the feedback model, but without its threads and eeg ring
+    # buffer (the tasks drive the workers)
+    bci_model = bciutils.BCI(config, feedback_loop=False)
+    model = load_or_compile_model(config, bci_model.sample_rate, config_file, 'data/CSP_LDA/csp.mat',
+                                  'data/CSP_LDA/lda.mat', 'data/CSP_LDA/model.npz')
+    bci_model.bci_core = create_bci_core(config, bci_model, model['csp'], model['lda'], model)
+    if config['feedback-model-settings']['model-hot-swap']:
+        bci_model.model_watcher = bciutils.ModelWatcher('data/CSP_LDA/csp.mat', 'data/CSP_LDA/lda.mat',
+                                                        bci_model.n_enabled_channels)
+
+    # It will run until the script is stopped by the user (Ctrl+C cancels the tasks and closes the inlets)
+    try:
+        asyncio.run(run_sessions([Session('feedback', bci_model)]))
+    except KeyboardInterrupt:
+        pass
@@ -6,51 +6,99 @@ Performs classification and calculates erds-values for online-BCIs.
 import json
 import numpy as np
 import os
-import scipy.io
 
 import bciutils
+from compile_model import load_or_compile_model
 
-if __name__ == "__main__":
 
-    cwd = os.getcwd()
-    config_file = cwd + '/../bci-config.json'
+def create_bci_core(config, bci_model, csp_filter, lda_coef, model=None):
+    """Creates the signal processing unit of the feedback model.
 
-    # Read BCI Configuration
-    with open(config_file) as json_file:
-        config = json.load(json_file)
+    Parameters
+    ----------
+    config: `dict`
+        BCI configuration.
+    bci_model: `BCI`
+        The BCI model (defines the sample rate and the channels).
+    csp_filter: `ndarray`
+        Common spatial pattern (2-D array).
+    lda_coef: `ndarray`
+        Linear discriminant analysis coefficients (2-D array).
+    model: `dict`
+        Compiled model with the coefficients and initial conditions of the bandpass filters (see compile_model.py), the
+        filters are designed if None.
 
-    # Initialize the BCI model
-    bci_model = bciutils.BCI(config)
-
-    # Load CSP and LDA coefficients
-    csp_filter = scipy.io.loadmat('data/CSP_LDA/csp.mat')['csp_filter']
-    lda_coef = scipy.io.loadmat('data/CSP_LDA/lda.mat')['W']
+    Returns
+    -------
+    bci_core: `BCICore`
+        The signal processing unit.
+    """
 
     s_rate_half = bci_model.sample_rate / 2
+    dtype = bci_model.dtype
+    backend = config['feedback-model-settings']['filter-backend']
+    if model is None:
+        model = {}
+
+    # Define bandpass for classification unit (in the spatial-first order only the CSP outputs are band passed)
+    pipeline_order = config['feedback-model-settings']['pipeline-order']
+    if pipeline_order == bciutils.PipelineOrder.SPATIAL_FIRST:
+        n_bandpass_cl = np.shape(csp_filter)[0]
+    else:
+        n_bandpass_cl = bci_model.n_enabled_channels
 
-    # Define bandpass for classification unit
     bandpass_settings_cl = config['feedback-model-settings']['bandpass']
     fstop = [freq / s_rate_half for freq in bandpass_settings_cl['fstop']]
     fpass = [freq / s_rate_half for freq in bandpass_settings_cl['fpass']]
     bandpass_cl = bciutils.Bandpass(order=bandpass_settings_cl['order'], fstop=fstop, fpass=fpass,
-                                    n=bci_model.n_enabled_channels)
+                                    n=n_bandpass_cl, dtype=dtype, backend=backend, sos=model.get('sos_cl'),
+                                    zi=model.get('zi_cl'))
 
-    # Define bandpass for ERDS unit
+    # Define bandpass for ERDS unit (only for the channels of the ROIs)
     bandpass_settings_erds = config['feedback-model-settings']['bandpass-erds']
     fstop_erds = [freq / s_rate_half for freq in bandpass_settings_erds['fstop']]
     fpass_erds = [freq / s_rate_half for freq in bandpass_settings_erds['fpass']]
     bandpass_erds = bciutils.Bandpass(order=bandpass_settings_erds['order'], fstop=fstop_erds, fpass=fpass_erds,
-                                      n=bci_model.n_enabled_channels)
+                                      n=bci_model.n_erds_channels, dtype=dtype, backend=backend,
+                                      sos=model.get('sos_erds'), zi=model.get('zi_erds'))
 
     # Define log band power unit
-    log_band_power_unit = bciutils.LogBandPower(window_length=1 * bci_model.sample_rate,
-                                                n=np.shape(csp_filter)[0])
+    if config['feedback-model-settings']['log-band-power'] == bciutils.LogBandPowerMode.RUNNING:
+        log_band_power_unit = bciutils.RunningLogBandPower(window_length=1 * bci_model.sample_rate,
+                                                           n=np.shape(csp_filter)[0], dtype=dtype)
+    else:
+        log_band_power_unit = bciutils.LogBandPower(window_length=1 * bci_model.sample_rate,
+                                                    n=np.shape(csp_filter)[0], dtype=dtype)
 
     # Define BCI Core
-    bci_model.bci_core = bciutils.BCICore(sample_rate=bci_model.sample_rate,
-                                          bandpass_cl=bandpass_cl,
-                                          bandpass_erds=bandpass_erds,
-                                          csp=csp_filter, lda=lda_coef, log_band_power=log_band_power_unit)
+    return bciutils.BCICore(sample_rate=bci_model.sample_rate, bandpass_cl=bandpass_cl, bandpass_erds=bandpass_erds,
+                            csp=csp_filter, lda=lda_coef, log_band_power=log_band_power_unit,
+                            pipeline_order=pipeline_order)
+
+
+if __name__ == "__main__":
+
+    cwd = os.getcwd()
+    config_file = cwd + '/../bci-config.json'
+
+    # Read BCI Configuration
+    with open(config_file) as json_file:
+        config = json.load(json_file)
+
+    # Initialize the BCI model
+    bci_model = bciutils.BCI(config)
+
+    # Load the compiled model (it is compiled again if the configuration, the CSP and LDA coefficients or the sample
+    # rate have changed)
+    model = load_or_compile_model(config, bci_model.sample_rate, config_file, 'data/CSP_LDA/csp.mat',
+                                  'data/CSP_LDA/lda.mat', 'data/CSP_LDA/model.npz')
+
+    bci_model.bci_core = create_bci_core(config, bci_model, model['csp'], model['lda'], model)
+
+    # New CSP and LDA files (e.g. of a calibration run) are applied at the end of a trial
+    if config['feedback-model-settings']['model-hot-swap']:
+        bci_model.model_watcher = bciutils.ModelWatcher('data/CSP_LDA/csp.mat', 'data/CSP_LDA/lda.mat',
+                                                        bci_model.n_enabled_channels)
 
     # Start the feedback loop. It will run unitl the script is stopped by the user
     bci_model.start_feedback_loop()
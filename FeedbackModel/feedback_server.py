@@ -0,0 +1,205 @@
+"""
+EEG Feedback Server
+Runs several feedback pipelines (e.g. one per VR booth) in a single process.
+"""
+
+import json
+import numpy as np
+import os
+from pylsl import local_clock
+import scipy.io
+import time
+
+import bciutils
+from feedback_model import create_bci_core
+
+# Maximum number of eeg samples pulled from a pipeline per scheduling round
+MAX_PULL_SAMPLES = 1024
+
+# Time (in seconds) the scheduler sleeps if no pipeline received new samples
+IDLE_TIME = 0.001
+
+
+class Pipeline:
+    """Feedback pipeline unit.
+
+    One feedback model (eeg inlet, marker inlet, BCI core and feedback outlets) driven by the scheduler of the server
+    instead of its own threads. It is created once its eeg stream is resolved, the marker inlet is opened as soon as
+    the marker stream is resolved (the pipeline is polled meanwhile).
+
+    Parameters
+    ----------
+    name: `str`
+        Name of the pipeline.
+    bci_config: `dict`
+        Settings for the feedback loop of the pipeline.
+    csp_filter: `ndarray`
+        Common spatial pattern (2-D array).
+    lda_coef: `ndarray`
+        Linear discriminant analysis coefficients (2-D array).
+    resolver: `StreamResolver instance`
+        Resolver of the LSL streams of all pipelines (the eeg stream of the pipeline must be resolved).
+
+    Other Parameters
+    ----------------
+    bci_model: `BCI instance`
+        The BCI model of the pipeline.
+    inlet_marker: `StreamInlet`
+        Inlet of the marker stream (None until the marker stream is resolved).
+    is_warm: `bool`
+        Whether the warm-up is finished (the markers are processed afterwards, like in the feedback loop).
+    worker_cl: `ClassificationWorker instance`
+        Classification worker.
+    worker_erds: `ERDSWorker instance`
+        ERDS worker.
+    outlet_fb_cl: `StreamOutlet`
+        Outlet of the feedback stream for the class labels and distance.
+    outlet_fb_erds: `StreamOutlet`
+        Outlet of the feedback stream for the ERDS values.
+    outlet_diagnostics: `StreamOutlet`
+        Outlet of the diagnostics stream or None.
+    chunk: `ndarray`
+        2-D array (samples x channels) the eeg samples are pulled into (channel format of the eeg stream).
+    busy_time: `float`
+        Processing time (in seconds) since the last load report.
+    report_time: `float`
+        Time of the last load report.
+    """
+
+    def __init__(self, name, bci_config, csp_filter, lda_coef, resolver):
+        self.name = name
+        self.bci_model = bciutils.BCI(bci_config, resolver=resolver, feedback_loop=False)
+        self.bci_model.bci_core = create_bci_core(bci_config, self.bci_model, csp_filter, lda_coef)
+
+        self.inlet_marker = None
+        self.is_warm = False
+        self.worker_cl, self.worker_erds = self.bci_model.create_workers()
+        self.outlet_fb_cl = self.worker_cl.create_outlet()
+        self.outlet_fb_erds = self.worker_erds.create_outlet()
+        self.outlet_diagnostics = self.bci_model.create_diagnostics_outlet()
+
+        inlet_eeg = self.bci_model.inlet_eeg
+        self.chunk = np.zeros((MAX_PULL_SAMPLES, inlet_eeg.channel_count), dtype=np.dtype(inlet_eeg.value_type))
+
+        self.busy_time = 0.0
+        self.report_time = local_clock()
+
+    def poll(self):
+        """Processes the markers and the eeg samples received since the last call (without waiting).
+
+        Returns
+        -------
+        n_samples: `int`
+            Number of processed eeg samples.
+        """
+
+        start_time = time.perf_counter()
+
+        if self.inlet_marker is None and self.bci_model.resolver.is_resolved(self.bci_model.stream_marker['name']):
+            self.inlet_marker = self.bci_model.open_marker_inlet()
+
+        while self.is_warm and self.inlet_marker is not None:
+            marker, timestamp = self.inlet_marker.pull_sample(timeout=0.0)
+            if marker is None:
+                break
+
+            state = self.bci_model.handle_marker(marker[0], timestamp, self.outlet_diagnostics)
+            if state == bciutils.BCIState.BREAK:
+                self.__report_load()
+
+        _, timestamps = self.bci_model.inlet_eeg.pull_chunk(timeout=0.0, max_samples=MAX_PULL_SAMPLES,
+                                                            dest_obj=self.chunk)
+        if not timestamps:
+            return 0
+
+        n_samples = len(timestamps)
+        eeg = self.chunk[:n_samples, self.bci_model.idx_enabled_channels].astype(self.bci_model.dtype)
+        timestamps = np.array(timestamps)
+
+        block_size = self.bci_model.block_size
+        for start in range(0, n_samples, block_size):
+            stop = min(start + block_size, n_samples)
+            self.worker_cl.process(eeg[start:stop], timestamps[start:stop], self.outlet_fb_cl)
+            self.worker_erds.process(eeg[start:stop], timestamps[start:stop], self.outlet_fb_erds)
+
+        if not self.is_warm and self.bci_model.warm_up_cl.event.is_set() and self.bci_model.warm_up_erds.event.is_set():
+            self.bci_model.state_timeline.set_state(bciutils.BCIState.SLEEP, local_clock())
+            self.is_warm = True
+            print("INFO " + self.name + ": warm-up finished")
+
+        self.busy_time += time.perf_counter() - start_time
+        return n_samples
+
+    def __report_load(self):
+        """Prints the cpu load of the pipeline since the last report.
+        """
+
+        now = local_clock()
+        print("INFO %s: cpu load %.1f %%" % (self.name, 100 * self.busy_time / (now - self.report_time)))
+        self.busy_time = 0.0
+        self.report_time = now
+
+
+def load_pipeline_config(pipeline_settings, cwd):
+    """Creates the settings for the feedback loop of a pipeline.
+
+    Parameters
+    ----------
+    pipeline_settings: `dict`
+        Settings of the pipeline (bci configuration file and LSL streams of the pipeline).
+    cwd: `str`
+        Directory the paths are relative to.
+
+    Returns
+    -------
+    bci_config: `dict`
+        Settings for the feedback loop, with the LSL streams of the pipeline.
+    """
+
+    with open(os.path.join(cwd, pipeline_settings['bci-config'])) as json_file:
+        bci_config = json.load(json_file)
+
+    bci_config['general-settings']['lsl-streams'].update(pipeline_settings['lsl-streams'])
+
+    # The scheduler of the server processes all pipelines
+    bci_config['feedback-model-settings']['execution-mode'] = bciutils.ExecutionMode.THREAD
+
+    return bci_config
+
+
+if __name__ == "__main__":
+
+    cwd = os.getcwd()
+    config_file = cwd + '/../server-config.json'
+
+    # Read server configuration
+    with open(config_file) as json_file:
+        server_config = json.load(json_file)
+
+    # The eeg and marker streams of all pipelines are resolved concurrently
+    configs = [load_pipeline_config(settings, cwd) for settings in server_config['pipelines']]
+    resolver = bciutils.StreamResolver()
+    resolver.start([config['general-settings']['lsl-streams'][stream]['name'] for config in configs
+                    for stream in ['eeg', 'marker']])
+
+    pending = list(zip(server_config['pipelines'], configs))
+    pipelines = []
+
+    # Round robin over the pipelines. It will run until the script is stopped by the user
+    while True:
+        # A pipeline is initialized (opens its eeg inlet) once its eeg stream is resolved, so booths which are offline
+        # do not block the others
+        for settings, config in list(pending):
+            if resolver.is_resolved(config['general-settings']['lsl-streams']['eeg']['name']):
+                csp_filter = scipy.io.loadmat(os.path.join(cwd, settings['csp']))['csp_filter']
+                lda_coef = scipy.io.loadmat(os.path.join(cwd, settings['lda']))['W']
+                pipelines.append(Pipeline(settings['name'], config, csp_filter, lda_coef, resolver))
+                pending.remove((settings, config))
+                print("INFO pipeline " + settings['name'] + " started")
+
+        n_processed = 0
+        for pipeline in pipelines:
+            n_processed += pipeline.poll()
+
+        if n_processed == 0:
+            time.sleep(IDLE_TIME)
@@ -0,0 +1,220 @@
+"""
+Replays a recorded session through the feedback model (without LSL) as fast as possible.
+"""
+
+import json
+import numpy as np
+import os
+import scipy.io
+import time
+
+import bciutils
+from feedback_model import create_bci_core
+from xdf_to_mat import load_xdf
+
+
+class ArrayOutlet:
+    """Array outlet unit.
+
+    Collects the feedback pushed by a worker in arrays instead of sending it to a LSL stream.
+
+    Other Parameters
+    ----------------
+    samples: `list`
+        2-D arrays of the pushed chunks.
+    timestamps: `list`
+        Time stamps of the pushed samples.
+    """
+
+    def __init__(self):
+        self.samples = []
+        self.timestamps = []
+
+    def push_chunk(self, x, timestamp):
+        """Appends a chunk of samples (same interface as StreamOutlet.push_chunk).
+
+        Parameters
+        ----------
+        x: `ndarray`
+            2-D array (samples x channels).
+        timestamp: `list`
+            Time stamps of the samples.
+        """
+
+        self.samples.append(np.array(x))
+        self.timestamps.extend(timestamp)
+
+    def to_arrays(self, n_channels):
+        """Concatenates the pushed chunks.
+
+        Parameters
+        ----------
+        n_channels: `int`
+            Number of channels of the feedback (for the shape of an empty result).
+
+        Returns
+        -------
+        samples: `ndarray`
+            2-D array (samples x channels) of the pushed samples.
+        timestamps: `ndarray`
+            1-D array of the time stamps of the pushed samples.
+        """
+
+        if not self.samples:
+            return np.zeros((0, n_channels)), np.zeros((0,))
+
+        return np.concatenate(self.samples), np.array(self.timestamps)
+
+
+def markers_from_labels(labels, sample_rate, timing):
+    """Creates the markers of the trials from the class labels at the cue positions (as stored in messung.mat).
+
+    Parameters
+    ----------
+    labels: `ndarray`
+        1-D array with class labels at the cue positions (one value per eeg sample).
+    sample_rate: `int`
+        Sample rate of the eeg signal.
+    timing: `dict`
+        Timing of the experiment (durations in seconds).
+
+    Returns
+    -------
+    markers: `list`
+        The markers (Reference, Cue, Feedback and End_of_Trial of each trial).
+    marker_timestamps: `ndarray`
+        1-D array of the time stamps of the markers (the first eeg sample has the time stamp 0).
+    """
+
+    markers = []
+    marker_timestamps = []
+    for cue_time in np.where(labels != 0)[0] / sample_rate:
+        markers.extend(['Reference', 'Cue', 'Feedback', 'End_of_Trial'])
+        marker_timestamps.extend([cue_time - timing['duration-ref'], cue_time, cue_time + timing['duration-cue'],
+                                  cue_time + timing['duration-cue'] + timing['duration-task']])
+
+    return markers, np.array(marker_timestamps)
+
+
+def replay(bci_model, eeg, timestamps, markers, marker_timestamps):
+    """Feeds a recorded session through the state machine and the BCI core of the feedback model.
+
+    The eeg data is processed in blocks of the configured block size, like in the feedback loop. The markers are
+    applied as soon as the eeg data reaches their time stamps.
+
+    Parameters
+    ----------
+    bci_model: `BCI`
+        The BCI model, created without eeg stream and with its BCI core.
+    eeg: `ndarray`
+        2-D array (samples x channels) of the raw eeg data (all channels).
+    timestamps: `ndarray`
+        1-D array of the time stamps of the eeg samples.
+    markers: `list`
+        The markers from unity.
+    marker_timestamps: `ndarray`
+        1-D array of the time stamps of the markers.
+
+    Returns
+    -------
+    results: `dict`
+        Class labels (as sent to unity), distances and ERDS values together with the time stamps of the eeg samples
+        they were computed from.
+    """
+
+    worker_cl, worker_erds = bci_model.create_workers()
+
+    # Latencies are meaningless when replaying
+    worker_cl.latency = None
+    worker_erds.latency = None
+
+    outlet_cl = ArrayOutlet()
+    outlet_erds = ArrayOutlet()
+
+    eeg = eeg[:, bci_model.idx_enabled_channels]
+    n_samples = np.shape(eeg)[0]
+    block_size = bci_model.block_size
+
+    # The warm-up ends after the same amount of eeg data as in the feedback loop. Markers received during the warm-up
+    # apply from its end on.
+    n_warm_up = bci_model.warm_up_cl.n_samples
+    if n_warm_up < n_samples:
+        bci_model.state_timeline.set_state(bciutils.BCIState.SLEEP, timestamps[n_warm_up])
+
+    idx_marker = 0
+    for start in range(0, n_samples, block_size):
+        stop = min(start + block_size, n_samples)
+
+        while idx_marker < len(markers) and marker_timestamps[idx_marker] <= timestamps[stop - 1]:
+            bci_model.apply_marker(markers[idx_marker], marker_timestamps[idx_marker])
+            idx_marker += 1
+
+        worker_cl.process(eeg[start:stop], timestamps[start:stop], outlet_cl)
+        worker_erds.process(eeg[start:stop], timestamps[start:stop], outlet_erds)
+
+    fb_cl, timestamps_cl = outlet_cl.to_arrays(2)
+    erds, timestamps_erds = outlet_erds.to_arrays(bci_model.n_roi)
+
+    return {'label': fb_cl[:, 0], 'distance': fb_cl[:, 1], 'timestamps_cl': timestamps_cl,
+            'erds': erds, 'timestamps_erds': timestamps_erds}
+
+
+if __name__ == "__main__":
+
+    # ------------- Subject specific variables -------------
+    modality = 'ME'
+    subject_id = 'sub-P001'
+    session = '1'
+    run = '1'
+    # ------------------------------------------------------
+
+    cwd = os.getcwd()
+
+    root_dir = cwd + '/data/current/'
+    out_dir = root_dir + subject_id + '/' + modality
+
+    xdf_file_path = root_dir + subject_id + '/subj_' + session + '_block' + run + '.xdf'
+    mat_file_path = out_dir + '/messung.mat'
+    replay_file_path = out_dir + '/replay.mat'
+
+    # Read BCI Configuration
+    config_file = cwd + '/../bci-config.json'
+    with open(config_file) as json_file:
+        config = json.load(json_file)
+
+    # Load the recorded session (the xdf file contains the markers, for messung.mat they are created from the cues)
+    if os.path.isfile(xdf_file_path):
+        stream_eeg, stream_marker = load_xdf(xdf_file_path, config['general-settings']['lsl-streams'])
+        eeg = stream_eeg['time_series']
+        eeg_timestamps = stream_eeg['time_stamps']
+        sample_rate = float(stream_eeg['info']['nominal_srate'][0])
+        markers = [marker[0] for marker in stream_marker['time_series']]
+        marker_timestamps = stream_marker['time_stamps']
+    else:
+        data = scipy.io.loadmat(mat_file_path)['data']
+        eeg = data[:, 1:]
+        sample_rate = config['eeg-settings']['sample-rate']
+        eeg_timestamps = np.arange(np.shape(eeg)[0]) / sample_rate
+        markers, marker_timestamps = markers_from_labels(data[:, 0], sample_rate,
+                                                         config['general-settings']['timing'])
+
+    # Initialize the BCI model without LSL
+    bci_model = bciutils.BCI(config, sample_rate=sample_rate, n_channels=np.shape(eeg)[1])
+
+    # Load CSP and LDA coefficients
+    csp_filter = scipy.io.loadmat('data/CSP_LDA/csp.mat')['csp_filter']
+    lda_coef = scipy.io.loadmat('data/CSP_LDA/lda.mat')['W']
+
+    bci_model.bci_core = create_bci_core(config, bci_model, csp_filter, lda_coef)
+
+    start_time = time.perf_counter()
+    results = replay(bci_model, np.asarray(eeg, dtype=float), np.asarray(eeg_timestamps, dtype=float), markers,
+                     np.asarray(marker_timestamps, dtype=float))
+    duration = time.perf_counter() - start_time
+
+    n_samples = np.shape(eeg)[0]
+    print("INFO replayed %d samples in %.2f s (%.0f samples/s, %.1f x real time)"
+          % (n_samples, duration, n_samples / duration, n_samples / sample_rate / duration))
+
+    scipy.io.savemat(replay_file_path, results)
+    print("INFO results saved to " + replay_file_path)
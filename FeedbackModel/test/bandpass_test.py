@@ -0,0 +1,100 @@
+"""
+Test of the filter backends of the bandpass.
+"""
+
+import numpy as np
+from scipy import signal
+
+import bciutils
+
+
+if __name__ == "__main__":
+    sample_rate = 500
+    n_channels = 8
+    s_rate_half = sample_rate / 2
+    fstop = [3 / s_rate_half, 35 / s_rate_half]
+    fpass = [8 / s_rate_half, 30 / s_rate_half]
+
+    eeg = np.random.default_rng(0).standard_normal((4 * sample_rate, n_channels)) * 10
+    n_samples = np.shape(eeg)[0]
+
+    # The filter delay of each channel starts with the initial conditions of sosfilt_zi (section by section)
+    bandpass = bciutils.Bandpass(order=12, fstop=fstop, fpass=fpass, n=n_channels)
+    zi = signal.sosfilt_zi(bandpass.sos)
+    for channel in range(n_channels):
+        for section in range(np.shape(bandpass.sos)[0]):
+            np.testing.assert_array_equal(bandpass.zi[channel, section], zi[section])
+
+    # Reference: the whole signal filtered at once with sosfilt (starting from the initial conditions)
+    y_ref, _ = signal.sosfilt(bandpass.sos, eeg, axis=0, zi=np.repeat(zi[:, :, np.newaxis], n_channels, axis=2))
+    np.testing.assert_allclose(bandpass.bandpass_filter(eeg), y_ref, rtol=0, atol=1e-12 * np.max(np.abs(y_ref)))
+
+    # Both backends compute the same output in blocks of any size (larger than the state-space block as well)
+    for backend, dtype, block_size in [(backend, dtype, size) for backend in bciutils.FilterBackend
+                                       for dtype in [np.float64, np.float32]
+                                       for size in [1, 7, bciutils.STATE_SPACE_MAX_BLOCK, 100]]:
+        bandpass = bciutils.Bandpass(order=12, fstop=fstop, fpass=fpass, n=n_channels, dtype=dtype, backend=backend)
+        y = np.zeros((n_samples, n_channels))
+        for i in range(0, n_samples, block_size):
+            y[i:i + block_size] = bandpass.bandpass_filter(eeg[i:i + block_size])
+
+        error = np.max(np.abs(y - y_ref)) / np.max(np.abs(y_ref))
+        print(backend.value, np.dtype(dtype).name, 'block size', block_size, 'max. relative difference', error)
+        assert error < (1e-12 if dtype == np.float64 else 1e-4)
+
+    # The in place filter falls back to sosfilt for arrays the compiled kernel does not accept (Fortran order, other
+    # dtype than the filter)
+    bandpass = bciutils.Bandpass(order=12, fstop=fstop, fpass=fpass, n=n_channels)
+    y_c = np.array(np.transpose(eeg), order='C')
+    bandpass.bandpass_filter_inplace(y_c)
+    for x in [np.array(np.transpose(eeg), order='F'), np.ascontiguousarray(np.transpose(eeg), dtype=np.float32)]:
+        bandpass = bciutils.Bandpass(order=12, fstop=fstop, fpass=fpass, n=n_channels)
+        bandpass.bandpass_filter_inplace(x)
+        error = np.max(np.abs(x - y_c)) / np.max(np.abs(y_c))
+        print('order', 'F' if x.flags.f_contiguous else 'C', x.dtype.name, 'max. relative difference', error)
+        assert error < (1e-12 if x.dtype == np.float64 else 1e-4)
+
+    # Warm start: with a DC offset and a drift the primed filter is close to a filter which has seen the whole past
+    # signal right after the warm start, a filter started from the initial conditions is not
+    n_warm_up = int(bciutils.WARM_START_DURATION * sample_rate)
+    eeg_offset = eeg + np.linspace(-5000, 5000, n_channels) + np.cumsum(eeg, axis=0) * 0.05
+    y_past = bciutils.Bandpass(order=12, fstop=fstop, fpass=fpass, n=n_channels).bandpass_filter(eeg_offset)
+    y_ref = y_past[n_samples // 2 + n_warm_up:]
+    x = eeg_offset[n_samples // 2:]
+
+    bandpass = bciutils.Bandpass(order=12, fstop=fstop, fpass=fpass, n=n_channels)
+    y_cold = bandpass.bandpass_filter(x)[n_warm_up:]
+    bandpass = bciutils.Bandpass(order=12, fstop=fstop, fpass=fpass, n=n_channels)
+    bandpass.prime(x[:n_warm_up])
+    y_warm = bandpass.bandpass_filter(x[n_warm_up:])
+
+    error_cold = np.max(np.abs(y_cold - y_ref)) / np.std(y_ref)
+    error_warm = np.max(np.abs(y_warm - y_ref)) / np.std(y_ref)
+    print('warm start max. relative difference', error_warm, 'without priming', error_cold)
+    assert error_warm < 0.25 and error_warm < error_cold / 20
+
+    # In float32 the band passed signal and its log band power stay close to float64, the error grows with the sample
+    # rate and with narrower pass bands (see Precision)
+    for sample_rate, fpass_hz in [(rate, band) for rate in [250, 500, 1000, 2000] for band in [[8, 30], [9, 11]]]:
+        fpass = [freq / (sample_rate / 2) for freq in fpass_hz]
+        timestamps = np.arange(20 * sample_rate) / sample_rate
+        x = np.random.default_rng(1).standard_normal((20 * sample_rate, 4)) * 10 + 50
+        x += 20 * np.sin(2 * np.pi * 10 * timestamps)[:, np.newaxis]
+
+        y = bciutils.Bandpass(order=12, fstop=fpass, fpass=fpass, n=4).bandpass_filter(x)
+        bandpass = bciutils.Bandpass(order=12, fstop=fpass, fpass=fpass, n=4, dtype=np.float32)
+        y_single = bandpass.bandpass_filter(x.astype(np.float32))
+        assert bandpass.dtype == np.float32
+
+        lbp = bciutils.LogBandPower(window_length=sample_rate, n=4).compute_log_band_power(y)
+        lbp_single = bciutils.LogBandPower(window_length=sample_rate, n=4,
+                                           dtype=np.float32).compute_log_band_power(y_single)
+
+        error = np.max(np.abs(y_single - y)) / np.max(np.abs(y))
+        error_lbp = np.max(np.abs(lbp_single - lbp))
+        print('float32', sample_rate, 'Hz, pass band', fpass_hz, 'max. relative difference', error,
+              'max. difference log band power', error_lbp)
+        assert error < (1e-4 if sample_rate <= 500 else 1e-3)
+        assert error_lbp < 1e-3
+
+    print("bandpass test passed")
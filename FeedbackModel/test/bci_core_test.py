@@ -0,0 +1,208 @@
+"""
+Test of the fused classification of the BCI core.
+"""
+
+import numpy as np
+import scipy.io
+import tracemalloc
+
+import bciutils
+
+
+def create_bci_core(sample_rate, n_channels, csp_filter, lda_coef, pipeline_order=bciutils.PipelineOrder.BANDPASS_FIRST,
+                    dtype=np.float64, log_band_power_mode=bciutils.LogBandPowerMode.RUNNING):
+    """Creates a BCI core with the settings of the reference data.
+
+    Parameters
+    ----------
+    sample_rate: `int`
+        Sample rate of the eeg signal.
+    n_channels: `int`
+        Number of eeg channels.
+    csp_filter: `ndarray`
+        Common spatial pattern (2-D array).
+    lda_coef: `ndarray`
+        Linear discriminant analysis coefficients (2-D array).
+    pipeline_order: `PipelineOrder`
+        Order of the bandpass and the CSP filter.
+    dtype: `type`
+        Data type of the signal processing.
+    log_band_power_mode: `LogBandPowerMode`
+        Computation of the log band power.
+
+    Returns
+    -------
+    bci_core: `BCICore`
+        The BCI core.
+    """
+
+    s_rate_half = sample_rate / 2
+    fstop = [freq / s_rate_half for freq in [3, 35]]
+    fpass = [freq / s_rate_half for freq in [8, 30]]
+    if pipeline_order == bciutils.PipelineOrder.SPATIAL_FIRST:
+        n_channels = np.shape(csp_filter)[0]
+    bandpass_cl = bciutils.Bandpass(order=12, fstop=fstop, fpass=fpass, n=n_channels, dtype=dtype)
+    if log_band_power_mode == bciutils.LogBandPowerMode.RUNNING:
+        log_band_power_unit = bciutils.RunningLogBandPower(window_length=1 * sample_rate, n=np.shape(csp_filter)[0],
+                                                           dtype=dtype)
+    else:
+        log_band_power_unit = bciutils.LogBandPower(window_length=1 * sample_rate, n=np.shape(csp_filter)[0],
+                                                    dtype=dtype)
+
+    return bciutils.BCICore(sample_rate=sample_rate, bandpass_cl=bandpass_cl, bandpass_erds=None,
+                            csp=csp_filter, lda=lda_coef, log_band_power=log_band_power_unit,
+                            pipeline_order=pipeline_order)
+
+
+if __name__ == "__main__":
+    # Load reference variables
+    reference_variables = scipy.io.loadmat('variables_ref.mat')
+    eeg = reference_variables['eeg']
+    n_samples, n_channels = np.shape(eeg)
+
+    sample_rate = 128
+
+    # Load CSP and LDA coefficients
+    csp_filter = scipy.io.loadmat('csp.mat')['csp_filters']
+    lda_coef = scipy.io.loadmat('lda.mat')['W']
+
+    # Classify sample by sample with the single stages
+    bci_core = create_bci_core(sample_rate, n_channels, csp_filter, lda_coef)
+    class_label_list = []
+    distance_list = []
+    for i in range(n_samples):
+        y_bp = bci_core.bandpass_cl.bandpass_filter(eeg[i:i + 1, :])
+        y_csp = bci_core.csp_filter(y_bp)
+        y_lbp = bci_core.log_band_power.compute_log_band_power(y_csp)
+
+        label, distance = bci_core.lda_predict(y_lbp)
+        class_label_list.append(label[0])
+        distance_list.append(distance[0])
+
+    class_label_arr = np.array(class_label_list, dtype=int)
+    distance_arr = np.array(distance_list)
+
+    # Classify block wise with the fused pipeline (in both orders of bandpass and CSP filter and with both log band
+    # power units)
+    for pipeline_order, block_size, mode in [(order, size, mode) for order in bciutils.PipelineOrder
+                                             for size in [1, 10, sample_rate + 1]
+                                             for mode in bciutils.LogBandPowerMode]:
+        bci_core = create_bci_core(sample_rate, n_channels, csp_filter, lda_coef, pipeline_order,
+                                   log_band_power_mode=mode)
+        class_label_block = np.zeros((n_samples,), dtype=int)
+        distance_block = np.zeros((n_samples,))
+        for i in range(0, n_samples, block_size):
+            label, distance = bci_core.process(eeg[i:i + block_size, :])
+            class_label_block[i:i + block_size] = label
+            distance_block[i:i + block_size] = distance
+
+        print(pipeline_order.value, mode.value, 'block size', block_size,
+              'differing labels', np.count_nonzero(class_label_block != class_label_arr),
+              'max. difference distance', np.max(np.abs(distance_block - distance_arr)))
+        np.testing.assert_array_equal(class_label_block, class_label_arr)
+        np.testing.assert_allclose(distance_block, distance_arr, rtol=0, atol=1e-12)
+
+    # Once the work buffers exist, the fused pipeline allocates no arrays (with both log band power units)
+    for mode in bciutils.LogBandPowerMode:
+        bci_core = create_bci_core(sample_rate, n_channels, csp_filter, lda_coef, log_band_power_mode=mode)
+        bci_core.process(eeg[:1, :])
+        tracemalloc.start()
+        for i in range(1, 1001):
+            bci_core.process(eeg[i:i + 1, :])
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(mode.value, 'memory retained after 1000 samples', memory, 'bytes')
+        assert memory < 16 * 1024
+
+    # The band passed CSP outputs of both orders only differ by rounding errors
+    bci_core = create_bci_core(sample_rate, n_channels, csp_filter, lda_coef)
+    y_csp = bci_core.csp_filter(bci_core.bandpass_cl.bandpass_filter(eeg))
+    bci_core = create_bci_core(sample_rate, n_channels, csp_filter, lda_coef, bciutils.PipelineOrder.SPATIAL_FIRST)
+    y_csp_spatial_first = bci_core.bandpass_cl.bandpass_filter(bci_core.csp_filter(eeg))
+
+    print('max. relative difference CSP outputs', np.max(np.abs(y_csp_spatial_first - y_csp)) / np.max(np.abs(y_csp)))
+    np.testing.assert_allclose(y_csp_spatial_first, y_csp, rtol=0, atol=1e-9 * np.max(np.abs(y_csp)))
+
+    # The batched BCI core computes the same results as separate BCI cores (here with different CSP and LDA models)
+    rng = np.random.default_rng(0)
+    n_pipelines = 3
+    csp_filters = [csp_filter] + [rng.standard_normal(np.shape(csp_filter)) for _ in range(n_pipelines - 1)]
+    lda_coefs = [lda_coef] + [rng.standard_normal(np.shape(lda_coef)) for _ in range(n_pipelines - 1)]
+    eeg_pipelines = np.stack([eeg] + [rng.standard_normal(np.shape(eeg)) * 10 for _ in range(n_pipelines - 1)])
+    for pipeline_order, block_size, same_eeg, mode in [(order, size, same, mode) for order in bciutils.PipelineOrder
+                                                       for size in [1, 10, sample_rate + 1] for same in [False, True]
+                                                       for mode in bciutils.LogBandPowerMode]:
+        # The same eeg data for all pipelines (candidate models of one subject) or one eeg signal per pipeline
+        eeg_batch = np.stack([eeg] * n_pipelines) if same_eeg else eeg_pipelines
+        class_label_separate = np.zeros((n_pipelines, n_samples), dtype=int)
+        distance_separate = np.zeros((n_pipelines, n_samples))
+        for k in range(n_pipelines):
+            bci_core = create_bci_core(sample_rate, n_channels, csp_filters[k], lda_coefs[k], pipeline_order,
+                                       log_band_power_mode=mode)
+            for i in range(0, n_samples, block_size):
+                label, distance = bci_core.process(eeg_batch[k, i:i + block_size])
+                class_label_separate[k, i:i + block_size] = label
+                distance_separate[k, i:i + block_size] = distance
+
+        bci_cores = [create_bci_core(sample_rate, n_channels, csp_filters[k], lda_coefs[k], pipeline_order,
+                                     log_band_power_mode=mode) for k in range(n_pipelines)]
+        batched_bci_core = bciutils.BatchedBCICore(bci_cores)
+        class_label_batched = np.zeros((n_pipelines, n_samples), dtype=int)
+        distance_batched = np.zeros((n_pipelines, n_samples))
+        for i in range(0, n_samples, block_size):
+            block = eeg[i:i + block_size] if same_eeg else eeg_batch[:, i:i + block_size]
+            label, distance = batched_bci_core.process(block)
+            class_label_batched[:, i:i + block_size] = label
+            distance_batched[:, i:i + block_size] = distance
+
+        print('batched', pipeline_order.value, mode.value, 'block size', block_size, 'same eeg', same_eeg,
+              'differing labels', np.count_nonzero(class_label_batched != class_label_separate))
+        np.testing.assert_array_equal(class_label_batched, class_label_separate)
+        np.testing.assert_allclose(distance_batched, distance_separate, rtol=0, atol=1e-12)
+
+    # In float32 the filter stays stable, the band passed signal differs by less than 1e-4 of its amplitude and the
+    # classification is the same as in float64
+    for pipeline_order in bciutils.PipelineOrder:
+        bci_core = create_bci_core(sample_rate, n_channels, csp_filter, lda_coef, pipeline_order, dtype=np.float32)
+        assert bci_core.dtype == np.float32
+        assert bciutils.Bandpass.max_pole_radius(bci_core.bandpass_cl.sos) < 1
+
+        y_bp = bci_core.bandpass_cl.bandpass_filter(eeg[:, :bci_core.bandpass_cl.n].astype(np.float32))
+        y_bp_ref = create_bci_core(sample_rate, n_channels, csp_filter, lda_coef,
+                                   pipeline_order).bandpass_cl.bandpass_filter(eeg[:, :bci_core.bandpass_cl.n])
+        np.testing.assert_allclose(y_bp, y_bp_ref, rtol=0, atol=1e-4 * np.max(np.abs(y_bp_ref)))
+
+        bci_core = create_bci_core(sample_rate, n_channels, csp_filter, lda_coef, pipeline_order, dtype=np.float32)
+        class_label_single = np.zeros((n_samples,), dtype=int)
+        distance_single = np.zeros((n_samples,))
+        for i in range(0, n_samples, 10):
+            label, distance = bci_core.process(eeg[i:i + 10, :].astype(np.float32))
+            class_label_single[i:i + 10] = label
+            distance_single[i:i + 10] = distance
+
+        print('float32', pipeline_order.value, 'differing labels',
+              np.count_nonzero(class_label_single != class_label_arr))
+        np.testing.assert_array_equal(class_label_single, class_label_arr)
+        np.testing.assert_allclose(distance_single, distance_arr, rtol=0, atol=1e-12)
+
+    # After replacing the model, the classification equals the one with the new model as soon as the log band power
+    # window and the label buffer have passed (the bandpass state is kept in the bandpass-first order)
+    csp_new, lda_new = csp_filters[1], lda_coefs[1]
+    n_swap = n_samples // 2
+    for pipeline_order in bciutils.PipelineOrder:
+        bci_core = create_bci_core(sample_rate, n_channels, csp_filter, lda_coef, pipeline_order)
+        bci_core_new = create_bci_core(sample_rate, n_channels, csp_new, lda_new, pipeline_order)
+        bci_core.process(eeg[:n_swap])
+        bci_core_new.process(eeg[:n_swap])
+
+        bci_core.set_model(csp_new, lda_new)
+        bci_core.reset_buffer()
+        bci_core_new.reset_buffer()
+        if pipeline_order == bciutils.PipelineOrder.SPATIAL_FIRST:
+            bci_core_new.bandpass_cl.set_initial_conditions(np.sum(csp_new, axis=1))
+
+        label, distance = bci_core.process(eeg[n_swap:])
+        label_new, distance_new = bci_core_new.process(eeg[n_swap:])
+        np.testing.assert_array_equal(label[2 * sample_rate:], label_new[2 * sample_rate:])
+        np.testing.assert_allclose(distance[2 * sample_rate:], distance_new[2 * sample_rate:], rtol=0, atol=1e-12)
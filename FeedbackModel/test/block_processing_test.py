@@ -0,0 +1,97 @@
+"""
+Test of the block processing of the classification and ERDS worker.
+"""
+
+import json
+import numpy as np
+import scipy.io
+
+import bciutils
+from feedback_model import create_bci_core
+from replay import ArrayOutlet
+
+
+def process_blocks(config, eeg, timestamps, state_changes, block_size):
+    """Processes eeg data block by block with the classification and ERDS worker.
+
+    Parameters
+    ----------
+    config: `dict`
+        BCI configuration.
+    eeg: `ndarray`
+        2-D array (samples x channels) of raw eeg data.
+    timestamps: `ndarray`
+        1-D array of the time stamps of the samples.
+    state_changes: `list`
+        States of a trial with the time stamps they apply from.
+    block_size: `int`
+        Number of eeg samples processed at once.
+
+    Returns
+    -------
+    results: `dict`
+        Class labels, distances and ERDS values together with their time stamps.
+    """
+
+    config['feedback-model-settings']['block-size'] = block_size
+    sample_rate = config['eeg-settings']['sample-rate']
+
+    # The workers are driven directly (like in the feedback server), without threads and eeg ring buffer
+    bci_model = bciutils.BCI(config, sample_rate=sample_rate, n_channels=np.shape(eeg)[1], feedback_loop=False)
+    assert bci_model.eeg_buffer is None and bci_model.thread_eeg is None
+    csp_filter = scipy.io.loadmat('../data/CSP_LDA/csp.mat')['csp_filter']
+    lda_coef = scipy.io.loadmat('../data/CSP_LDA/lda.mat')['W']
+    bci_model.bci_core = create_bci_core(config, bci_model, csp_filter, lda_coef)
+
+    for state, timestamp in state_changes:
+        bci_model.state_timeline.set_state(state, timestamp)
+
+    worker_cl, worker_erds = bci_model.create_workers()
+    worker_cl.latency = None
+    worker_erds.latency = None
+    outlet_cl = ArrayOutlet()
+    outlet_erds = ArrayOutlet()
+
+    eeg = eeg[:, bci_model.idx_enabled_channels]
+    for start in range(0, np.shape(eeg)[0], block_size):
+        worker_cl.process(eeg[start:start + block_size], timestamps[start:start + block_size], outlet_cl)
+        worker_erds.process(eeg[start:start + block_size], timestamps[start:start + block_size], outlet_erds)
+
+    fb_cl, timestamps_cl = outlet_cl.to_arrays(2)
+    erds, timestamps_erds = outlet_erds.to_arrays(bci_model.n_roi)
+
+    return {'label': fb_cl[:, 0], 'distance': fb_cl[:, 1], 'timestamps_cl': timestamps_cl,
+            'erds': erds, 'timestamps_erds': timestamps_erds}
+
+
+if __name__ == "__main__":
+    with open('../../bci-config.json') as json_file:
+        config = json.load(json_file)
+
+    sample_rate = config['eeg-settings']['sample-rate']
+    n_channels = len(config['eeg-settings']['channels'])
+
+    n_samples = 12 * sample_rate
+    timestamps = np.arange(n_samples) / sample_rate
+    eeg = np.random.default_rng(0).standard_normal((n_samples, n_channels)) * 10
+    eeg += 20 * np.sin(2 * np.pi * 10 * timestamps)[:, np.newaxis]
+
+    # One trial, the state changes are not aligned to the blocks
+    state_changes = [(bciutils.BCIState.SLEEP, 0.5), (bciutils.BCIState.REFERENCE, 1.003),
+                     (bciutils.BCIState.CUE, 4.003), (bciutils.BCIState.FEEDBACK, 5.253),
+                     (bciutils.BCIState.BREAK, 10.253)]
+
+    # Processing sample by sample and in blocks gives the same feedback for the same samples
+    results = process_blocks(config, eeg, timestamps, state_changes, block_size=1)
+    n_feedback = np.count_nonzero((timestamps >= 5.253) & (timestamps < 10.253))
+    assert np.shape(results['label'])[0] == n_feedback
+    assert np.shape(results['erds'])[0] == n_feedback
+
+    for block_size in [7, 64, sample_rate + 1]:
+        results_block = process_blocks(config, eeg, timestamps, state_changes, block_size=block_size)
+        print('block size', block_size, 'max. difference distance',
+              np.max(np.abs(results_block['distance'] - results['distance'])))
+        for key in results:
+            np.testing.assert_allclose(results_block[key], results[key], rtol=1e-9, atol=1e-12)
+
+    print("block processing test passed")
@@ -0,0 +1,91 @@
+"""
+Test of the bounded eeg queues of the feedback engine with a slow task.
+"""
+
+import asyncio
+import numpy as np
+
+from feedback_engine import put_block
+
+
+async def produce(queue, n_blocks, sizes):
+    """Puts blocks of one sample into the queue (like the eeg task) and records the size of the queue.
+
+    Parameters
+    ----------
+    queue: `Queue`
+        Bounded queue of the blocks.
+    n_blocks: `int`
+        Number of blocks.
+    sizes: `list`
+        Receives the size of the queue after each block.
+    """
+
+    for i in range(n_blocks):
+        put_block(queue, np.full((1, 4), i), np.array([i / 500]))
+        sizes.append(queue.qsize())
+        await asyncio.sleep(0)
+
+
+async def consume(queue, received):
+    """Takes blocks from the queue slower than they are produced (like a task which falls behind).
+
+    Parameters
+    ----------
+    queue: `Queue`
+        Bounded queue of the blocks.
+    received: `list`
+        Receives the first sample of each block.
+    """
+
+    while True:
+        block, _ = await queue.get()
+        received.append(block[0, 0])
+        await asyncio.sleep(0.001)
+
+
+async def main(max_blocks, n_blocks):
+    """Runs a fast producer and a slow consumer of a bounded queue.
+
+    Parameters
+    ----------
+    max_blocks: `int`
+        Maximum number of blocks in the queue.
+    n_blocks: `int`
+        Number of produced blocks.
+
+    Returns
+    -------
+    sizes: `list`
+        Size of the queue after each produced block.
+    received: `list`
+        First sample of each consumed block.
+    remaining: `list`
+        First sample of each block left in the queue.
+    """
+
+    queue = asyncio.Queue(maxsize=max_blocks)
+    sizes, received = [], []
+    consumer = asyncio.ensure_future(consume(queue, received))
+    await produce(queue, n_blocks, sizes)
+    consumer.cancel()
+
+    remaining = []
+    while not queue.empty():
+        remaining.append(queue.get_nowait()[0][0, 0])
+
+    return sizes, received, remaining
+
+
+if __name__ == "__main__":
+    max_blocks, n_blocks = 50, 2000
+    sizes, received, remaining = asyncio.run(main(max_blocks, n_blocks))
+    print('max. queue size', max(sizes), 'blocks received', len(received), 'remaining', len(remaining))
+
+    # The queue does not grow beyond its size, the oldest blocks are dropped and the newest ones are kept in order
+    assert max(sizes) <= max_blocks
+    assert len(received) + len(remaining) < n_blocks
+    assert remaining[-1] == n_blocks - 1
+    assert np.all(np.diff(received + remaining) > 0)
+
+    print("feedback engine test passed")
@@ -53,8 +53,8 @@ if __name__ == "__main__":
         y_lbp = bci_core.log_band_power.compute_log_band_power(y_csp)
 
         label, distance = bci_core.lda_predict(y_lbp)
-        class_label_list.append(label)
-        distance_list.append(distance)
+        class_label_list.append(label[0])
+        distance_list.append(distance[0])
 
     class_label_arr = np.array(class_label_list, dtype=int)
     distance_arr = np.array(distance_list)
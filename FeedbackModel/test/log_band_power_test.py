@@ -0,0 +1,60 @@
+"""
+Test of the log band power units.
+"""
+
+import numpy as np
+import scipy.io
+from scipy import signal
+
+import bciutils
+
+if __name__ == "__main__":
+    # Load reference variables
+    reference_variables = scipy.io.loadmat('variables_ref.mat')
+    eeg = reference_variables['eeg']
+    n_samples, n_channels = np.shape(eeg)
+
+    sample_rate = 128
+    s_rate_half = sample_rate / 2
+
+    # Define bandpass for classification unit
+    order = 12
+    fstop = [3, 35]
+    fpass = [8, 30]
+    fstop = [freq / s_rate_half for freq in fstop]
+    fpass = [freq / s_rate_half for freq in fpass]
+    bandpass_cl = bciutils.Bandpass(order=order, fstop=fstop, fpass=fpass,
+                                    n=n_channels)
+
+    # Load CSP coefficients
+    csp_filter = scipy.io.loadmat('csp.mat')['csp_filters']
+    y_csp = np.matmul(bandpass_cl.bandpass_filter(eeg), csp_filter.T)
+
+    for window_length in [sample_rate, 4 * sample_rate]:
+        log_band_power_fir = bciutils.LogBandPower(window_length=window_length, n=np.shape(csp_filter)[0])
+        y_fir = log_band_power_fir.compute_log_band_power(y_csp)
+
+        # The FIR unit computes the moving average of lfilter (starting from the steady state of a unit step), also
+        # block wise
+        b = np.ones((window_length,)) / window_length
+        zi = np.outer(signal.lfilter_zi(b, 1), np.ones((np.shape(csp_filter)[0],)))
+        y_lfilter = np.log10(signal.lfilter(b, 1, np.square(y_csp), axis=0, zi=zi)[0])
+        np.testing.assert_allclose(y_fir, y_lfilter, rtol=0, atol=1e-12)
+        for block_size in [1, 10, window_length + 1]:
+            log_band_power_fir = bciutils.LogBandPower(window_length=window_length, n=np.shape(csp_filter)[0])
+            y_fir_block = np.concatenate([log_band_power_fir.compute_log_band_power(y_csp[i:i + block_size])
+                                          for i in range(0, n_samples, block_size)])
+            print('FIR window length', window_length, 'block size', block_size, 'max. difference to lfilter',
+                  np.max(np.abs(y_fir_block - y_lfilter)))
+            np.testing.assert_allclose(y_fir_block, y_lfilter, rtol=0, atol=1e-12)
+
+        # Compare sample by sample and block wise computation to the FIR filter
+        for block_size in [1, 10, window_length + 1]:
+            log_band_power_running = bciutils.RunningLogBandPower(window_length=window_length,
+                                                                  n=np.shape(csp_filter)[0])
+            y_running = np.concatenate([log_band_power_running.compute_log_band_power(y_csp[i:i + block_size])
+                                        for i in range(0, n_samples, block_size)])
+
+            max_diff = np.max(np.abs(y_running - y_fir))
+            print('window length', window_length, 'block size', block_size, 'max. difference', max_diff)
+            np.testing.assert_allclose(y_running, y_fir, rtol=0, atol=1e-9)
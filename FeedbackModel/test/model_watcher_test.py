@@ -0,0 +1,65 @@
+"""
+Test of the model watcher with a model whose files are replaced one after the other.
+"""
+
+import numpy as np
+import os
+import scipy.io
+import tempfile
+
+import bciutils
+
+
+def replace_file(file, variables, mtime_ns):
+    """Replaces a .mat file (written to a temporary file and renamed) with a given modification time.
+
+    Parameters
+    ----------
+    file: `str`
+        Path of the .mat file.
+    variables: `dict`
+        Variables of the .mat file.
+    mtime_ns: `int`
+        Modification time (in nanoseconds), so the change is detected regardless of the resolution of the file system.
+    """
+
+    scipy.io.savemat(file + '.tmp.mat', variables)
+    os.utime(file + '.tmp.mat', ns=(mtime_ns, mtime_ns))
+    os.replace(file + '.tmp.mat', file)
+
+
+if __name__ == "__main__":
+    n_channels, n_csp = 8, 4
+    rng = np.random.default_rng(0)
+    models = [(rng.standard_normal((n_csp, n_channels)), rng.standard_normal((2, n_csp + 1))) for _ in range(3)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        csp_file = os.path.join(directory, 'csp.mat')
+        lda_file = os.path.join(directory, 'lda.mat')
+        mtime_ns = 10 ** 18
+        replace_file(csp_file, {'csp_filter': models[0][0]}, mtime_ns)
+        replace_file(lda_file, {'W': models[0][1]}, mtime_ns)
+
+        model_watcher = bciutils.ModelWatcher(csp_file, lda_file, n_channels)
+        assert model_watcher.poll() is None
+
+        # Only one file of the new model is replaced: the old model is kept
+        for file, variables, new_model in [(csp_file, {'csp_filter': models[1][0]}, models[1]),
+                                           (lda_file, {'W': models[2][1]}, models[2])]:
+            mtime_ns += 10 ** 9
+            replace_file(file, variables, mtime_ns)
+            assert model_watcher.poll() is None
+            assert model_watcher.poll() is None
+
+            # Once the other file is replaced as well, the new model is loaded (once)
+            mtime_ns += 10 ** 9
+            if file == csp_file:
+                replace_file(lda_file, {'W': new_model[1]}, mtime_ns)
+            else:
+                replace_file(csp_file, {'csp_filter': new_model[0]}, mtime_ns)
+            csp, lda = model_watcher.poll()
+            np.testing.assert_array_equal(csp, new_model[0])
+            np.testing.assert_array_equal(lda, new_model[1])
+            assert model_watcher.poll() is None
+
+    print("model watcher test passed")
@@ -0,0 +1,55 @@
+"""
+Test of the running sum of the ERDS reference buffer.
+"""
+
+import numpy as np
+
+import bciutils
+
+
+def reference_mean(blocks, idx_start):
+    """Computes the reference mean like the original feedback model (appends every block to an array).
+
+    Parameters
+    ----------
+    blocks: `list`
+        2-D arrays (samples x channels) of the reference period.
+    idx_start: `int`
+        Number of samples at the beginning of the reference period which are not considered for the mean.
+
+    Returns
+    -------
+    mean: `ndarray`
+        1-D array of the mean for each channel.
+    """
+
+    data_ref = np.zeros((1, np.shape(blocks[0])[1]))
+    for block in blocks:
+        data_ref = np.append(data_ref, block, axis=0)
+
+    return np.mean(np.delete(data_ref, 0, 0)[idx_start:, :], axis=0)
+
+
+if __name__ == "__main__":
+    sample_rate = 500
+    n_channels = 6
+    idx_start = int(sample_rate / 2)
+    rng = np.random.default_rng(0)
+
+    ref_buffer = bciutils.ReferenceBuffer(n=n_channels, idx_start=idx_start)
+
+    # Several trials with reference periods of different lengths, in blocks of different sizes
+    for n_samples, block_size in [(3 * sample_rate, 1), (3 * sample_rate + 17, 7), (idx_start + 1, 64),
+                                  (2 * sample_rate, 3 * sample_rate)]:
+        x = np.square(rng.standard_normal((n_samples, n_channels)) * 10)
+        blocks = [x[start:start + block_size] for start in range(0, n_samples, block_size)]
+
+        ref_buffer.reset()
+        for block in blocks:
+            ref_buffer.append(block)
+
+        max_diff = np.max(np.abs(ref_buffer.mean() - reference_mean(blocks, idx_start)))
+        print('samples', n_samples, 'block size', block_size, 'max. difference', max_diff)
+        np.testing.assert_allclose(ref_buffer.mean(), reference_mean(blocks, idx_start), rtol=1e-12)
+
+    print("reference buffer test passed")
@@ -0,0 +1,145 @@
+"""
+Test of the offline replay of a session through the feedback model.
+"""
+
+import json
+import numpy as np
+import scipy.io
+
+import bciutils
+from feedback_model import create_bci_core
+from replay import markers_from_labels, replay
+
+
+def replay_session(config, eeg, labels, block_size):
+    """Replays a session with a block size.
+
+    Parameters
+    ----------
+    config: `dict`
+        BCI configuration.
+    eeg: `ndarray`
+        2-D array (samples x channels) of raw eeg data.
+    labels: `ndarray`
+        1-D array with class labels at the cue positions.
+    block_size: `int`
+        Number of eeg samples processed at once.
+
+    Returns
+    -------
+    results: `dict`
+        Results of the replay.
+    """
+
+    config['feedback-model-settings']['block-size'] = block_size
+    sample_rate = config['eeg-settings']['sample-rate']
+
+    bci_model = bciutils.BCI(config, sample_rate=sample_rate, n_channels=np.shape(eeg)[1])
+    csp_filter = scipy.io.loadmat('../data/CSP_LDA/csp.mat')['csp_filter']
+    lda_coef = scipy.io.loadmat('../data/CSP_LDA/lda.mat')['W']
+    bci_model.bci_core = create_bci_core(config, bci_model, csp_filter, lda_coef)
+
+    markers, marker_timestamps = markers_from_labels(labels, sample_rate, config['general-settings']['timing'])
+    return replay(bci_model, eeg, np.arange(np.shape(eeg)[0]) / sample_rate, markers, marker_timestamps)
+
+
+def reduce_intervals(x, ends, n_trials, mode):
+    """Reduces the feedback of each trial (sent for every sample) to one value per interval.
+
+    Parameters
+    ----------
+    x: `ndarray`
+        Feedback values of all trials (samples first).
+    ends: `ndarray`
+        1-D array of the indexes (within the feedback period of a trial) of the last samples of the intervals.
+    n_trials: `int`
+        Number of trials.
+    mode: `OutputDecimation`
+        Reduction of the values of an interval.
+
+    Returns
+    -------
+    y: `ndarray`
+        Values of the intervals of all trials.
+    """
+
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    n_values = np.reshape(np.diff(np.concatenate(([-1], ends))), (-1,) + (1,) * (np.ndim(x) - 1))
+
+    y = []
+    for x_trial in np.split(x, n_trials):
+        if mode == bciutils.OutputDecimation.LATEST:
+            y.append(x_trial[ends])
+        elif mode == bciutils.OutputDecimation.MAX:
+            y.append(np.maximum.reduceat(x_trial, starts, axis=0))
+        else:
+            y.append(np.add.reduceat(x_trial, starts, axis=0) / n_values)
+    return np.concatenate(y)
+
+
+if __name__ == "__main__":
+    with open('../../bci-config.json') as json_file:
+        config = json.load(json_file)
+
+    sample_rate = config['eeg-settings']['sample-rate']
+    timing = config['general-settings']['timing']
+    n_channels = len(config['eeg-settings']['channels'])
+
+    # Simulated session with two trials
+    n_samples = 30 * sample_rate
+    t = np.arange(n_samples) / sample_rate
+    eeg = np.random.default_rng(0).standard_normal((n_samples, n_channels)) * 10
+    eeg += 20 * np.sin(2 * np.pi * 10 * t)[:, np.newaxis]
+    labels = np.zeros((n_samples,))
+    labels[8 * sample_rate] = 121
+    labels[20 * sample_rate] = 122
+
+    results = replay_session(config, eeg, labels, block_size=1)
+
+    # The feedback is computed for the samples of the feedback period of each trial
+    n_feedback = 2 * round(timing['duration-task'] * sample_rate)
+    assert np.shape(results['label'])[0] == n_feedback
+    assert np.shape(results['erds'])[0] == n_feedback
+    np.testing.assert_allclose(results['timestamps_cl'][0], 8 + timing['duration-cue'])
+
+    # The results do not depend on the block size (the state changes are applied at the marker time stamps)
+    for block_size in [7, 64]:
+        results_block = replay_session(config, eeg, labels, block_size=block_size)
+        for key in results:
+            np.testing.assert_allclose(results_block[key], results[key], rtol=1e-9, atol=1e-12)
+
+    # With warm start the reference period of the first trial may start after WARM_START_DURATION (instead of
+    # WARM_UP_DURATION), the priming does not depend on the block size
+    config['feedback-model-settings']['warm-start'] = True
+    labels_warm = np.zeros((n_samples,))
+    labels_warm[4 * sample_rate] = 121
+    labels_warm[20 * sample_rate] = 122
+    results_warm = replay_session(config, eeg, labels_warm, block_size=1)
+    assert np.shape(results_warm['label'])[0] == n_feedback
+    np.testing.assert_allclose(results_warm['timestamps_cl'][0], 4 + timing['duration-cue'])
+    results_block = replay_session(config, eeg, labels_warm, block_size=64)
+    for key in results_warm:
+        np.testing.assert_allclose(results_block[key], results_warm[key], rtol=1e-9, atol=1e-12)
+
+    # With an output rate one value is sent per interval, the same as the reduced values of the full rate feedback
+    config['feedback-model-settings']['warm-start'] = False
+    config['feedback-model-settings']['output-rate'] = 90
+    n_task = round(timing['duration-task'] * sample_rate)
+    ends = np.flatnonzero(np.diff(np.arange(n_task + 1) * 90 // sample_rate))
+    for mode in bciutils.OutputDecimation:
+        config['feedback-model-settings']['output-decimation'] = mode
+        for block_size in [1, 64]:
+            results_rate = replay_session(config, eeg, labels, block_size=block_size)
+            print('output rate 90, decimation', mode.value, 'block size', block_size, 'values',
+                  np.shape(results_rate['label'])[0])
+            np.testing.assert_allclose(results_rate['timestamps_cl'], reduce_intervals(
+                results['timestamps_cl'], ends, 2, bciutils.OutputDecimation.LATEST))
+            np.testing.assert_allclose(results_rate['label'], reduce_intervals(
+                results['label'], ends, 2, bciutils.OutputDecimation.LATEST))
+            np.testing.assert_allclose(results_rate['distance'], reduce_intervals(results['distance'], ends, 2, mode),
+                                       rtol=1e-5, atol=1e-6)
+            np.testing.assert_allclose(results_rate['timestamps_erds'], results_rate['timestamps_cl'])
+            np.testing.assert_allclose(results_rate['erds'], reduce_intervals(results['erds'], ends, 2, mode),
+                                       rtol=1e-5, atol=1e-6)
+
+    print("replay test passed")
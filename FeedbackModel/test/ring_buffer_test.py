@@ -0,0 +1,86 @@
+"""
+Test of the eeg ring buffer read by the classification and the ERDS thread.
+"""
+
+import json
+import numpy as np
+import scipy.io
+import threading
+
+import bciutils
+from feedback_model import create_bci_core
+
+
+def read_samples(cursor, n_samples, results):
+    """Reads samples from the ring buffer (runs in a reader thread).
+
+    Parameters
+    ----------
+    cursor: `RingBufferCursor`
+        Read position of the reader.
+    n_samples: `int`
+        Number of samples to read.
+    results: `list`
+        Receives the samples and their time stamps.
+    """
+
+    samples, timestamps = [], []
+    while len(timestamps) < n_samples:
+        block, block_timestamps = cursor.read(timeout=5.0)
+        if block is None:
+            break
+
+        samples.append(block.copy())
+        timestamps.extend(block_timestamps)
+
+    results.append((np.concatenate(samples), np.array(timestamps)))
+
+
+if __name__ == "__main__":
+    n_samples, n_channels = 2000, 4
+    eeg = np.random.default_rng(0).standard_normal((n_samples, n_channels))
+    timestamps = np.arange(n_samples) / 500
+
+    # Two readers with different block sizes share one buffer (one eeg inlet)
+    eeg_buffer = bciutils.RingBuffer(capacity=2 * n_samples, n=n_channels)
+    readers = []
+    for block_size in [1, 64]:
+        results = []
+        thread = threading.Thread(target=read_samples, args=(eeg_buffer.cursor(block_size), n_samples, results))
+        thread.start()
+        readers.append((block_size, thread, results))
+
+    # The eeg thread writes chunks of varying size
+    start = 0
+    for size in np.random.default_rng(1).integers(1, 50, n_samples):
+        eeg_buffer.write(eeg[start:start + size], timestamps[start:start + size])
+        start += size
+        if start >= n_samples:
+            break
+
+    # Each reader received every sample in the original order
+    for block_size, thread, results in readers:
+        thread.join()
+        samples_reader, timestamps_reader = results[0]
+        print('block size', block_size, 'samples read', np.shape(samples_reader)[0])
+        np.testing.assert_array_equal(samples_reader, eeg)
+        np.testing.assert_array_equal(timestamps_reader, timestamps)
+
+    # The readers get the samples in the data type of the configured precision, which is the one of the BCI core
+    with open('../../bci-config.json') as json_file:
+        config = json.load(json_file)
+    csp_filter = scipy.io.loadmat('../data/CSP_LDA/csp.mat')['csp_filter']
+    lda_coef = scipy.io.loadmat('../data/CSP_LDA/lda.mat')['W']
+    for precision in bciutils.Precision:
+        config['feedback-model-settings']['precision'] = precision.value
+        bci_model = bciutils.BCI(config, sample_rate=500, n_channels=len(config['eeg-settings']['channels']))
+        bci_model.bci_core = create_bci_core(config, bci_model, csp_filter, lda_coef)
+
+        cursor = bci_model.eeg_buffer.cursor(bci_model.block_size)
+        eeg = np.random.default_rng(2).standard_normal((bci_model.block_size, bci_model.n_enabled_channels))
+        bci_model.eeg_buffer.write(eeg, timestamps[:bci_model.block_size])
+        block, _ = cursor.read(timeout=5.0)
+        print(precision.value, 'block', block.dtype.name, 'BCI core', bci_model.bci_core.dtype.name)
+        assert block.dtype == bci_model.eeg_buffer.data.dtype == bci_model.bci_core.dtype == np.dtype(precision.value)
+
+    print("ring buffer test passed")
@@ -0,0 +1,110 @@
+"""
+Test of the eeg ring buffer, the state timeline and the latency histogram shared with a worker process.
+"""
+
+import multiprocessing
+import numpy as np
+
+import bciutils
+
+
+def read_samples(eeg_buffer, state_timeline, n_samples, queue):
+    """Reads samples from the shared ring buffer and looks up their states (runs in the worker process).
+
+    Parameters
+    ----------
+    eeg_buffer: `RingBuffer`
+        Shared buffer of the eeg samples.
+    state_timeline: `StateTimeline`
+        Shared state timeline.
+    n_samples: `int`
+        Number of samples to read.
+    queue: `Queue`
+        Receives the samples, their time stamps and their states.
+    """
+
+    cursor = eeg_buffer.cursor(block_size=7)
+    queue.put('ready')
+
+    samples, timestamps, states = [], [], []
+    while len(timestamps) < n_samples:
+        block, block_timestamps = cursor.read(timeout=5.0)
+        if block is None:
+            break
+
+        samples.append(block.copy())
+        timestamps.extend(block_timestamps)
+        for start, stop, state in state_timeline.segments(block_timestamps):
+            states.extend([state.value] * (stop - start))
+
+    queue.put((np.concatenate(samples), np.array(timestamps), np.array(states)))
+
+
+def record_latencies(latency, n_blocks, block_size):
+    """Records the latency of blocks of feedback samples (runs in the worker process).
+
+    Parameters
+    ----------
+    latency: `LatencyHistogram`
+        Shared latency histogram.
+    n_blocks: `int`
+        Number of recorded blocks.
+    block_size: `int`
+        Number of samples per block.
+    """
+
+    for _ in range(n_blocks):
+        latency.record(np.full((block_size,), bciutils.local_clock()))
+
+
+if __name__ == "__main__":
+    # The worker processes of the feedback model must also work with the spawn start method (Windows)
+    multiprocessing.set_start_method('spawn')
+
+    n_samples, n_channels = 500, 4
+    eeg = np.random.default_rng(0).standard_normal((n_samples, n_channels))
+    timestamps = np.arange(n_samples) / 100
+
+    eeg_buffer = bciutils.RingBuffer(capacity=2 * n_samples, n=n_channels, shared=True)
+    state_timeline = bciutils.StateTimeline(capacity=8, state=bciutils.BCIState.START, shared=True)
+
+    state_timeline.set_state(bciutils.BCIState.REFERENCE, 1.0)
+
+    queue = multiprocessing.Queue()
+    worker = multiprocessing.Process(target=read_samples, args=(eeg_buffer, state_timeline, n_samples, queue))
+    worker.start()
+    assert queue.get(timeout=30) == 'ready'
+
+    # A state change after starting the worker
+    state_timeline.set_state(bciutils.BCIState.FEEDBACK, 2.5)
+
+    for start in range(0, n_samples, 11):
+        eeg_buffer.write(eeg[start:start + 11], timestamps[start:start + 11])
+
+    samples_worker, timestamps_worker, states_worker = queue.get(timeout=30)
+    worker.join()
+
+    # The worker received every sample in the original order
+    np.testing.assert_array_equal(samples_worker, eeg)
+    np.testing.assert_array_equal(timestamps_worker, timestamps)
+
+    # The state changes are visible in the worker
+    states = np.full((n_samples,), bciutils.BCIState.START.value)
+    states[timestamps >= 1.0] = bciutils.BCIState.REFERENCE.value
+    states[timestamps >= 2.5] = bciutils.BCIState.FEEDBACK.value
+    np.testing.assert_array_equal(states_worker, states)
+
+    # No recorded latency is lost, if the histogram is read while the worker records
+    latency = bciutils.LatencyHistogram(shared=True)
+    n_blocks, block_size = 20000, 3
+    worker = multiprocessing.Process(target=record_latencies, args=(latency, n_blocks, block_size))
+    worker.start()
+    n_read = 0
+    while worker.is_alive():
+        n_read += latency.read()[0]
+    worker.join()
+    n_read += latency.read()[0]
+    print('latency samples recorded', n_blocks * block_size, 'read', n_read)
+    assert n_read == n_blocks * block_size
+
+    print("shared memory test passed")